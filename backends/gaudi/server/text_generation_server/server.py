@@ -185,6 +185,25 @@ class TextGenerationService(generate_pb2_grpc.TextGenerationServiceServicer):
         if len(batches) == 0:
             raise ValueError("All batches are empty")
 
+        # Requests to keep, sent instead of a FilterBatch call before this step
+        if len(request.filters) > 0:
+            filters = {
+                filter_pb.batch_id: filter_pb.request_ids
+                for filter_pb in request.filters
+            }
+            filtered_batches = []
+            for batch in batches:
+                request_ids = filters.get(batch.batch_id)
+                if request_ids is None:
+                    filtered_batches.append(batch)
+                elif len(request_ids) > 0:
+                    filtered_batches.append(batch.filter(request_ids))
+                # An empty keep-list drops the batch altogether
+            batches = filtered_batches
+
+            if len(batches) == 0:
+                return generate_pb2.DecodeResponse(total_ns=time.time_ns() - start)
+
         generations, next_batch, timings = self.model.generate_token(batches)
         self.cache.set(next_batch)
 
@@ -40,7 +40,7 @@ impl BackendV2 {
         let block_size = match attention.as_str() {
             "flashinfer" => 1,
             "flashdecoding" => 256,
-            "paged" => 16,
+            "paged" | "torch" => 16,
             _ => unreachable!(),
         };
 
@@ -1,6 +1,7 @@
 /// Batching and inference logic
 use crate::client::{
-    Batch, CachedBatch, ClientError, Generation, Health, InfoResponse, ShardedClient,
+    Batch, CachedBatch, ClientError, FilterBatchRequest, Generation, Health, InfoResponse,
+    ShardedClient,
 };
 use crate::queue::{Entry, Queue};
 use async_trait::async_trait;
@@ -157,6 +158,9 @@ pub(crate) async fn batching_task(
             let mut cached_batch = prefill(&mut client, batch, None, &mut entries)
                 .instrument(span)
                 .await;
+            // Filter of the cached batch that has not been sent to the shards yet.
+            // It is sent along the next decode call to save a round trip.
+            let mut pending_filter: Option<FilterBatchRequest> = None;
             let mut waiting_tokens = 1;
 
             // We loop until we do not receive any cached batch from the inference server (== until
@@ -220,7 +224,16 @@ pub(crate) async fn batching_task(
 
                     let new_cached_batch = if support_chunking {
                         // Get cached batch
-                        let cached_batch = batches.pop();
+                        let mut cached_batch = batches.pop();
+                        // The cached batch will be concatenated during the prefill op
+                        // so it must be filtered first
+                        if let Some(filter) = pending_filter.take() {
+                            // We unwrap here as we need to panic since we cannot recover if this method fails
+                            cached_batch = client
+                                .filter_batch(filter.batch_id, filter.request_ids)
+                                .await
+                                .unwrap();
+                        }
                         // Extend entries with the new entries since the batch will be
                         // concatenated during the prefill op server side
                         entries.extend(new_entries);
@@ -282,9 +295,10 @@ pub(crate) async fn batching_task(
                     entry.temp_span = Some(entry_batch_span);
                 });
 
-                cached_batch = decode(&mut client, batches, &mut entries)
-                    .instrument(next_batch_span)
-                    .await;
+                (cached_batch, pending_filter) =
+                    decode(&mut client, batches, pending_filter.take(), &mut entries)
+                        .instrument(next_batch_span)
+                        .await;
                 waiting_tokens += 1;
             }
             metrics::gauge!("tgi_batch_current_size").set(0.0);
@@ -342,20 +356,22 @@ async fn prefill(
 async fn decode(
     client: &mut ShardedClient,
     batches: Vec<CachedBatch>,
+    filter: Option<FilterBatchRequest>,
     entries: &mut IntMap<u64, Entry>,
-) -> Option<CachedBatch> {
+) -> (Option<CachedBatch>, Option<FilterBatchRequest>) {
     let start_time = Instant::now();
     let batch_ids: Vec<u64> = batches.iter().map(|b| b.id).collect();
     metrics::counter!("tgi_batch_inference_count", "method" => "decode").increment(1);
 
-    match client.decode(batches).await {
+    match client.decode(batches, filter.into_iter().collect()).await {
         Ok((generations, next_batch, timings)) => {
             let start_filtering_time = Instant::now();
             // Send generated tokens and filter stopped entries
             filter_send_generations(generations, entries);
 
             // Filter next batch and remove requests that were stopped
-            let next_batch = filter_batch(client, next_batch, entries).await;
+            // The shards are only notified on the next decode call
+            let (next_batch, next_filter) = defer_filter_batch(client, next_batch, entries).await;
 
             if let Some(concat_duration) = timings.concat {
                 metrics::histogram!("tgi_batch_concat_duration", "method" => "decode")
@@ -370,7 +386,7 @@ async fn decode(
             metrics::histogram!("tgi_batch_inference_duration", "method" => "decode")
                 .record(start_time.elapsed().as_secs_f64());
             metrics::counter!("tgi_batch_inference_success", "method" => "decode").increment(1);
-            next_batch
+            (next_batch, next_filter)
         }
         // If we have an error, we discard the whole batch
         Err(err) => {
@@ -379,7 +395,7 @@ async fn decode(
             }
             send_errors(err, entries);
             metrics::counter!("tgi_batch_inference_failure", "method" => "decode").increment(1);
-            None
+            (None, None)
         }
     }
 }
@@ -417,6 +433,49 @@ async fn filter_batch(
     }
 }
 
+/// Remove all requests not present in `entries` from `batch` without calling the shards
+///
+/// Returns the filtered batch and the `FilterBatchRequest` that must be sent to the shards
+/// along the next decode call
+#[instrument(skip_all)]
+async fn defer_filter_batch(
+    client: &mut ShardedClient,
+    next_batch: Option<CachedBatch>,
+    entries: &IntMap<u64, Entry>,
+) -> (Option<CachedBatch>, Option<FilterBatchRequest>) {
+    let mut batch = match next_batch {
+        Some(batch) => batch,
+        None => return (None, None),
+    };
+
+    // No need to filter
+    if batch.size as usize == entries.len() {
+        return (Some(batch), None);
+    }
+
+    let id = batch.id;
+
+    // Retain only requests that are still in entries
+    batch.request_ids.retain(|id| entries.contains_key(id));
+
+    if batch.request_ids.is_empty() {
+        // All requests have been filtered out
+        // Next batch is now empty
+        // Clear it from the Python shards cache
+        // We unwrap here as we need to panic since we cannot recover if this method fails
+        client.clear_cache(Some(id)).await.unwrap();
+        return (None, None);
+    }
+
+    // `max_tokens` and `current_tokens` are upper bounds until the shards filter the batch
+    batch.size = batch.request_ids.len() as u32;
+    let filter = FilterBatchRequest {
+        batch_id: id,
+        request_ids: batch.request_ids.clone(),
+    };
+    (Some(batch), Some(filter))
+}
+
 /// Send one or multiple `InferStreamResponse` to Infer for all `entries`
 /// and filter entries
 #[instrument(skip_all)]
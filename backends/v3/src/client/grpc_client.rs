@@ -7,6 +7,7 @@ use grpc_metadata::InjectTelemetryContext;
 use pb::generate::v3::text_generation_service_client::TextGenerationServiceClient;
 use pb::generate::v3::*;
 use std::cmp::min;
+use std::collections::HashMap;
 use std::time::Duration;
 use tonic::transport::{Channel, Uri};
 use tracing::instrument;
@@ -252,17 +253,31 @@ impl Client {
 
     /// Generate one token for each request in the given cached batches
     ///
+    /// `filters` are applied to the cached batches before decoding
+    ///
     /// Returns Generation for each request in batches
     /// and the next cached batch
     #[instrument(skip_all, fields(size = batches.iter().map(|batch|{batch.size}).sum::<u32>()))]
     pub async fn decode(
         &mut self,
         batches: Vec<CachedBatch>,
+        filters: Vec<FilterBatchRequest>,
     ) -> Result<(Vec<Generation>, Option<CachedBatch>, DecodeTimings)> {
-        let request = tonic::Request::new(DecodeRequest { batches }).inject_context();
+        let request = tonic::Request::new(DecodeRequest {
+            batches,
+            filters,
+            // Cheaper to build for the shards
+            packed_generations: true,
+        })
+        .inject_context();
         let response = self.stub.decode(request).await?.into_inner();
+        // Shards that do not support packed generations ignore the flag
+        let generations = match response.packed_generations {
+            Some(packed_generations) => unpack_generations(packed_generations),
+            None => response.generations,
+        };
         Ok((
-            response.generations,
+            generations,
             response.batch,
             DecodeTimings::new(
                 response.concat_ns,
@@ -274,6 +289,41 @@ impl Client {
     }
 }
 
+/// Convert columnar generations back to one `Generation` per request
+fn unpack_generations(packed: PackedGenerations) -> Vec<Generation> {
+    let mut sparse_generations: HashMap<u64, Generation> = packed
+        .generations
+        .into_iter()
+        .map(|generation| (generation.request_id, generation))
+        .collect();
+
+    let mut generations = Vec::with_capacity(packed.request_ids.len());
+    let mut start = 0;
+    for (request_id, token_count) in packed.request_ids.into_iter().zip(packed.token_counts) {
+        let end = start + token_count as usize;
+        let texts = (start..end)
+            .map(|i| {
+                let text_start = packed.text_offsets[i] as usize;
+                let text_end = packed.text_offsets[i + 1] as usize;
+                String::from_utf8_lossy(&packed.texts[text_start..text_end]).into_owned()
+            })
+            .collect();
+        let tokens = Tokens {
+            ids: packed.token_ids[start..end].to_vec(),
+            logprobs: packed.logprobs[start..end].to_vec(),
+            texts,
+            is_special: packed.is_special[start..end].to_vec(),
+        };
+
+        let mut generation = sparse_generations.remove(&request_id).unwrap_or_default();
+        generation.request_id = request_id;
+        generation.tokens = Some(tokens);
+        generations.push(generation);
+        start = end;
+    }
+    generations
+}
+
 pub struct PrefillTimings {
     pub concat: Option<Duration>,
     pub forward: Duration,
@@ -309,3 +359,48 @@ impl DecodeTimings {
         }
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_unpack_generations() {
+        let packed = PackedGenerations {
+            request_ids: vec![3, 7],
+            token_counts: vec![1, 2],
+            token_ids: vec![10, 11, 12],
+            logprobs: vec![-0.1, -0.2, -0.3],
+            is_special: vec![false, false, true],
+            text_offsets: vec![0, 2, 5, 9],
+            texts: "a bé</s>".as_bytes().to_vec(),
+            generations: vec![Generation {
+                request_id: 7,
+                generated_text: Some(GeneratedText {
+                    text: "bé</s>".to_string(),
+                    generated_tokens: 2,
+                    finish_reason: FinishReason::EosToken as i32,
+                    seed: None,
+                }),
+                ..Default::default()
+            }],
+        };
+
+        let generations = unpack_generations(packed);
+        assert_eq!(generations.len(), 2);
+
+        assert_eq!(generations[0].request_id, 3);
+        let tokens = generations[0].tokens.as_ref().unwrap();
+        assert_eq!(tokens.ids, vec![10]);
+        assert_eq!(tokens.texts, vec!["a ".to_string()]);
+        assert!(generations[0].generated_text.is_none());
+
+        assert_eq!(generations[1].request_id, 7);
+        let tokens = generations[1].tokens.as_ref().unwrap();
+        assert_eq!(tokens.ids, vec![11, 12]);
+        assert_eq!(tokens.logprobs, vec![-0.2, -0.3]);
+        assert_eq!(tokens.texts, vec!["bé".to_string(), "</s>".to_string()]);
+        assert_eq!(tokens.is_special, vec![false, true]);
+        assert!(generations[1].generated_text.is_some());
+    }
+}
@@ -0,0 +1,149 @@
+"""Micro-benchmark of the client side parsing of `generate_stream` and chat streams.
+
+Replays a synthetic Server-Sent Events stream, split in network sized chunks, through
+the line based parser the clients used to have and through the `text_generation.sse`
+fast paths.
+
+    python benchmarks/sse_parsing.py --tokens 20000 --chunk-size 1024
+"""
+
+import argparse
+import json
+import time
+
+from typing import Callable, Iterator, List
+
+from text_generation.sse import (
+    DONE,
+    iter_sse_data,
+    loads,
+    parse_event,
+)
+from text_generation.types import ChatCompletionChunk, StreamResponse
+
+
+def generate_event(i: int, tokens: int, top_n_tokens: int) -> dict:
+    token = {"id": i % 32000, "text": f" tok{i}", "logprob": -0.5, "special": False}
+    last = i == tokens - 1
+    return {
+        "index": i,
+        "token": token,
+        "top_tokens": [dict(token, id=token["id"] + j) for j in range(top_n_tokens)]
+        or None,
+        "generated_text": "..." if last else None,
+        "details": (
+            {"finish_reason": "length", "generated_tokens": tokens, "seed": None}
+            if last
+            else None
+        ),
+    }
+
+
+def chat_event(i: int, tokens: int, top_n_tokens: int) -> dict:
+    return {
+        "id": "",
+        "object": "chat.completion.chunk",
+        "created": 1700000000,
+        "model": "tgi",
+        "system_fingerprint": "3.0.0-native",
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": f" tok{i}"},
+                "logprobs": None,
+                "finish_reason": "length" if i == tokens - 1 else None,
+            }
+        ],
+        "usage": None,
+    }
+
+
+def make_stream(event: Callable, tokens: int, top_n_tokens: int, chat: bool) -> bytes:
+    stream = b"".join(
+        b"data:" + json.dumps(event(i, tokens, top_n_tokens)).encode() + b"\n\n"
+        for i in range(tokens)
+    )
+    if chat:
+        stream += b"data: [DONE]\n\n"
+    return stream
+
+
+def chunked(stream: bytes, chunk_size: int) -> List[bytes]:
+    return [stream[i : i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def lines(chunks: List[bytes]) -> Iterator[bytes]:
+    # What aiohttp's `StreamReader.__aiter__` does: yield one line at a time
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        for line in complete:
+            yield line + b"\n"
+
+
+def baseline(chunks: List[bytes], model) -> int:
+    count = 0
+    for byte_payload in lines(chunks):
+        if byte_payload == b"\n":
+            continue
+        payload = byte_payload.decode("utf-8")
+        if payload.startswith("data:"):
+            payload_data = payload.lstrip("data:").rstrip("\n").removeprefix(" ")
+            if payload_data == "[DONE]":
+                break
+            model(**json.loads(payload_data))
+            count += 1
+    return count
+
+
+def fast(chunks: List[bytes], model, raw: bool) -> int:
+    count = 0
+    for data in iter_sse_data(chunks):
+        if data == DONE:
+            break
+        parse_event(data, 200, model, raw)
+        count += 1
+    return count
+
+
+def measure(fn: Callable[[], int], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = fn()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--tokens", type=int, default=10_000)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--top-n-tokens", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"JSON decoder: {loads.__module__}")
+    print(f"{'stream':>8} {'mode':>24} {'events/s':>12} {'speedup':>8}")
+    streams = [
+        ("generate", generate_event, StreamResponse, False),
+        ("chat", chat_event, ChatCompletionChunk, True),
+    ]
+    for name, event, model, chat in streams:
+        stream = make_stream(event, args.tokens, args.top_n_tokens, chat)
+        chunks = chunked(stream, args.chunk_size)
+        modes = {
+            "line based + validation": lambda: baseline(chunks, model),
+            "framed + validation": lambda: fast(chunks, model, False),
+            "framed, raw": lambda: fast(chunks, model, True),
+        }
+        reference = None
+        for mode, fn in modes.items():
+            rate = measure(fn, args.repeat)
+            reference = reference or rate
+            print(f"{name:>8} {mode:>24} {rate:>12.0f} {rate / reference:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
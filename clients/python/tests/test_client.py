@@ -45,6 +45,14 @@ def test_generate_validation_error(llama_7b_url, hf_headers):
         client.generate("test", max_new_tokens=10_000)
 
 
+def test_generate_session_reuse(llama_7b_url, hf_headers):
+    with Client(llama_7b_url, hf_headers) as client:
+        first = client.generate("test", max_new_tokens=1)
+        second = client.generate("test", max_new_tokens=1)
+
+    assert first.generated_text == second.generated_text == "_"
+
+
 def test_generate_stream(llama_7b_url, hf_headers):
     client = Client(llama_7b_url, hf_headers)
     responses = [
@@ -107,6 +115,45 @@ async def test_generate_async_best_of(llama_7b_url, hf_headers):
     assert response.details.best_of_sequences[0].seed is not None
 
 
+@pytest.mark.asyncio
+async def test_generate_many_async(llama_7b_url, hf_headers):
+    async with AsyncClient(llama_7b_url, hf_headers, connection_limit=2) as client:
+        responses = await client.generate_many(
+            ["test"] * 4, concurrency=2, max_new_tokens=1
+        )
+
+    assert len(responses) == 4
+    assert all(response.generated_text == "_" for response in responses)
+
+
+@pytest.mark.asyncio
+async def test_generate_many_async_not_found(fake_url, hf_headers):
+    async with AsyncClient(fake_url, hf_headers) as client:
+        with pytest.raises(NotFoundError):
+            await client.generate_many(["test", "test"])
+
+        responses = await client.generate_many(["test"], return_exceptions=True)
+    assert isinstance(responses[0], NotFoundError)
+
+
+@pytest.mark.asyncio
+async def test_async_client_session_scope(fake_url):
+    client = AsyncClient(fake_url)
+    # Without context manager, each request has its own session
+    async with client._session_scope() as session:
+        assert not session.closed
+    assert session.closed
+
+    async with client:
+        async with client._session_scope() as first:
+            pass
+        async with client._session_scope() as second:
+            pass
+        assert first is second
+        assert not first.closed
+    assert first.closed
+
+
 @pytest.mark.asyncio
 async def test_generate_async_not_found(fake_url, hf_headers):
     client = AsyncClient(fake_url, hf_headers)
@@ -0,0 +1,173 @@
+import asyncio
+import pytest
+
+from text_generation import AsyncMultiEndpointClient
+from text_generation.errors import OverloadedError, ValidationError
+from text_generation.multi_endpoint import Endpoint, EndpointPool, affinity_key
+from text_generation.types import Message
+
+
+class FakeClient:
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate(self, prompt, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return prompt
+
+    async def close(self):
+        pass
+
+
+def make_client(clients, **kwargs) -> AsyncMultiEndpointClient:
+    client = AsyncMultiEndpointClient(
+        [f"http://replica-{i}" for i in range(len(clients))],
+        health_check_interval=None,
+        **kwargs,
+    )
+    for endpoint, fake in zip(client.pool.endpoints, clients):
+        endpoint.client = fake
+    return client
+
+
+def test_pool_least_outstanding():
+    a, b = Endpoint("a", None), Endpoint("b", None)
+    pool = EndpointPool([a, b])
+
+    pool.start(a)
+    assert pool.select() is b
+    pool.start(b)
+    pool.start(b)
+    assert pool.select() is a
+    assert pool.select({a}) is b
+    assert pool.select({a, b}) is None
+
+
+def test_pool_latency():
+    a, b = Endpoint("a", None), Endpoint("b", None)
+    pool = EndpointPool([a, b], ewma_alpha=0.5)
+
+    for endpoint, latency in [(a, 1.0), (b, 4.0)]:
+        pool.start(endpoint)
+        pool.finish(endpoint, latency, failed=False)
+    assert pool.select() is a
+    # a has two requests in flight but is still expected to answer first
+    pool.start(a)
+    pool.start(a)
+    assert pool.select() is a
+    pool.start(a)
+    pool.start(a)
+    assert pool.select() is b
+
+    pool.start(b)
+    pool.finish(b, 2.0, failed=False)
+    assert b.latency == 3.0
+
+
+def test_pool_ejection():
+    a, b = Endpoint("a", None), Endpoint("b", None)
+    pool = EndpointPool([a, b], max_failures=2, ejection_time=60)
+
+    for _ in range(2):
+        pool.start(a)
+        pool.finish(a, None, failed=True)
+    pool.start(b)
+    assert [pool.select() for _ in range(10)] == [b] * 10
+    # Ejected endpoints are used when no endpoint is healthy
+    assert pool.select({b}) is a
+
+    # A healthy probe does not end an ejection caused by failed requests
+    pool.set_health(a, True)
+    assert pool.select() is b
+
+    c, d = Endpoint("c", None), Endpoint("d", None)
+    pool = EndpointPool([c, d], ejection_time=60)
+    pool.start(d)
+    pool.set_health(c, False)
+    assert pool.select() is d
+    pool.set_health(c, True)
+    assert pool.select() is c
+
+
+def test_pool_hedge_delay():
+    pool = EndpointPool([Endpoint("a", None)])
+    assert pool.hedge_delay(0.95, min_samples=10) is None
+    for i in range(100):
+        pool.start(pool.endpoints[0])
+        pool.finish(pool.endpoints[0], i / 100, failed=False)
+    assert pool.hedge_delay(0.95, min_samples=10) == 0.95
+
+
+def test_affinity_key():
+    assert affinity_key("abcdef", 3) == b"abc"
+
+    system = Message(role="system", content="You are a helpful assistant " * 4)
+    first = [system, Message(role="user", content="Hello")]
+    second = [system, Message(role="user", content="Goodbye")]
+    assert affinity_key(first, 64) == affinity_key(second, 64)
+    assert affinity_key(first, 1024) != affinity_key(second, 1024)
+
+
+def test_pool_affinity():
+    endpoints = [Endpoint(f"http://replica-{i}", None) for i in range(4)]
+    pool = EndpointPool(endpoints, affinity_load_factor=1.25)
+
+    homes = {pool.select(key=f"prefix-{i}".encode()) for i in range(100)}
+    assert homes == set(endpoints)
+    home = pool.select(key=b"prefix")
+    assert all(pool.select(key=b"prefix") is home for _ in range(10))
+    # Retries go to another endpoint
+    assert pool.select({home}, key=b"prefix") is not home
+
+    # The home endpoint is overloaded: spill to the next endpoint of the ring
+    for _ in range(2):
+        pool.start(home)
+    spill = pool.select(key=b"prefix")
+    assert spill is not home
+    assert pool.select({home}, key=b"prefix") is spill
+
+    stats = pool.stats()["affinity"]
+    assert stats["requests"] == 112
+    assert stats["spills"] == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_on_endpoint_error():
+    broken, working = FakeClient(error=OverloadedError("test")), FakeClient()
+    client = make_client([broken, working])
+    client.pool.endpoints[1].outstanding = 1
+
+    assert await client.generate("test") == "test"
+    assert broken.calls == 1
+    assert working.calls == 1
+
+    # Errors caused by the request are not retried
+    broken.error = ValidationError("test")
+    client.pool.endpoints[1].outstanding = 1
+    with pytest.raises(ValidationError):
+        await client.generate("test")
+    assert working.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_hedging():
+    slow, fast = FakeClient(delay=10), FakeClient(delay=0.01)
+    client = make_client([slow, fast], hedge=True, hedge_min_samples=1)
+    client.pool.latencies.append(0.01)
+    client.pool.endpoints[1].outstanding = 1
+
+    assert await client.generate("test") == "test"
+    await asyncio.sleep(0)
+    assert client.stats()["hedges"] == 1
+    assert slow.cancelled == 1
+    assert [e["outstanding"] for e in client.stats()["endpoints"]] == [0, 1]
@@ -0,0 +1,91 @@
+import json
+import pytest
+
+from text_generation.errors import GenerationError
+from text_generation.sse import (
+    ServerSentEvents,
+    iter_sse_data,
+    parse_event,
+)
+from text_generation.types import ChatCompletionChunk, FinishReason, StreamResponse
+
+STREAM_EVENT = {
+    "index": 1,
+    "token": {"id": 29918, "text": "_", "logprob": -0.5, "special": False},
+    "top_tokens": [{"id": 29918, "text": "_", "logprob": -0.5, "special": False}],
+    "generated_text": "_",
+    "details": {
+        "finish_reason": "length",
+        "generated_tokens": 1,
+        "seed": None,
+        "input_length": 1,
+    },
+}
+
+CHAT_EVENT = {
+    "id": "",
+    "object": "chat.completion.chunk",
+    "created": 1700000000,
+    "model": "tgi",
+    "system_fingerprint": "3.0.0-native",
+    "choices": [
+        {
+            "index": 0,
+            "delta": {
+                "role": "assistant",
+                "tool_calls": [
+                    {
+                        "index": 0,
+                        "id": "",
+                        "type": "function",
+                        "function": {"name": None, "arguments": "{"},
+                    }
+                ],
+            },
+            "logprobs": None,
+            "finish_reason": None,
+        }
+    ],
+}
+
+
+def test_server_sent_events_chunking():
+    stream = (
+        b'data:{"a": 1}\n\n'
+        b'data: {"b": 2}\r\n\r\n'
+        b": comment\nevent: message\ndata:first\ndata:second\n\n"
+        b"data:[DONE]"
+    )
+    expected = [b'{"a": 1}', b'{"b": 2}', b"first\nsecond", b"[DONE]"]
+    for chunk_size in [1, 2, 7, len(stream)]:
+        chunks = [stream[i : i + chunk_size] for i in range(0, len(stream), chunk_size)]
+        assert list(iter_sse_data(chunks)) == expected
+
+    parser = ServerSentEvents()
+    assert parser.feed(b"data:{}") == []
+    assert parser.feed(b"\n") == []
+    assert parser.feed(b"\n") == [b"{}"]
+    assert parser.flush() == []
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_parse_event(raw):
+    data = json.dumps(STREAM_EVENT).encode()
+    event = parse_event(data, 200, StreamResponse, raw)
+    if raw:
+        assert event == STREAM_EVENT
+    else:
+        assert event == StreamResponse(**STREAM_EVENT)
+        assert event.details.finish_reason == FinishReason.Length
+
+    error = json.dumps({"error": "test", "error_type": "generation"}).encode()
+    with pytest.raises(GenerationError):
+        parse_event(error, 200, StreamResponse, raw)
+
+
+def test_parse_chat_event():
+    chunk = parse_event(
+        json.dumps(CHAT_EVENT).encode(), 200, ChatCompletionChunk, False
+    )
+    assert chunk == ChatCompletionChunk(**CHAT_EVENT)
+    assert chunk.choices[0].delta.tool_calls[0].function.arguments == "{"
@@ -20,6 +20,10 @@ DEPRECATION_WARNING = (
 )
 
 from text_generation.client import Client, AsyncClient  # noqa E402
+from text_generation.multi_endpoint import (  # noqa E402
+    MultiEndpointClient,
+    AsyncMultiEndpointClient,
+)
 from text_generation.inference_api import (  # noqa E402
     InferenceAPIClient,
     InferenceAPIAsyncClient,
@@ -28,6 +32,8 @@ from text_generation.inference_api import (  # noqa E402
 __all__ = [
     "Client",
     "AsyncClient",
+    "MultiEndpointClient",
+    "AsyncMultiEndpointClient",
     "InferenceAPIClient",
     "InferenceAPIAsyncClient",
 ]
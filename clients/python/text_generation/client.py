@@ -1,8 +1,10 @@
+import asyncio
 import json
 import requests
 import warnings
 
-from aiohttp import ClientSession, ClientTimeout
+from contextlib import asynccontextmanager
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from pydantic import ValidationError
 from typing import Dict, Optional, List, AsyncIterator, Iterator, Union
 
@@ -23,6 +25,12 @@ from text_generation.types import (
     Tool,
 )
 from text_generation.errors import parse_error
+from text_generation.sse import (
+    DONE,
+    aiter_sse_data,
+    iter_sse_data,
+    parse_event,
+)
 
 # emit deprecation warnings
 warnings.simplefilter("always", DeprecationWarning)
@@ -72,6 +80,18 @@ class Client:
         self.headers = headers
         self.cookies = cookies
         self.timeout = timeout
+        # Reuse connections across requests
+        self.session = requests.Session()
+
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def completion(
         self,
@@ -125,7 +145,7 @@ class Client:
             stop=stop,
         )
         if not stream:
-            resp = requests.post(
+            resp = self.session.post(
                 f"{self.base_url}/v1/completions",
                 json=request.dict(),
                 headers=self.headers,
@@ -140,7 +160,7 @@ class Client:
             return self._completion_stream_response(request)
 
     def _completion_stream_response(self, request):
-        resp = requests.post(
+        resp = self.session.post(
             f"{self.base_url}/v1/completions",
             json=request.dict(),
             headers=self.headers,
@@ -180,6 +200,7 @@ class Client:
         tool_prompt: Optional[str] = None,
         tool_choice: Optional[str] = None,
         stop: Optional[List[str]] = None,
+        raw: bool = False,
     ):
         """
         Given a list of messages, generate a response asynchronously
@@ -224,7 +245,8 @@ class Client:
                 The tool to use
             stop (`List[str]`):
                 Stop generating tokens if a member of `stop` is generated
-
+            raw (`bool`):
+                When streaming, yield the decoded chunk dicts instead of `ChatCompletionChunk` objects
         """
         request = ChatRequest(
             model="tgi",
@@ -247,7 +269,7 @@ class Client:
             stop=stop,
         )
         if not stream:
-            resp = requests.post(
+            resp = self.session.post(
                 f"{self.base_url}/v1/chat/completions",
                 json=request.dict(),
                 headers=self.headers,
@@ -259,10 +281,10 @@ class Client:
                 raise parse_error(resp.status_code, payload)
             return ChatComplete(**payload)
         else:
-            return self._chat_stream_response(request)
+            return self._chat_stream_response(request, raw)
 
-    def _chat_stream_response(self, request):
-        resp = requests.post(
+    def _chat_stream_response(self, request, raw):
+        resp = self.session.post(
             f"{self.base_url}/v1/chat/completions",
             json=request.dict(),
             headers=self.headers,
@@ -270,18 +292,10 @@ class Client:
             timeout=self.timeout,
             stream=True,
         )
-        # iterate and print stream
-        for byte_payload in resp.iter_lines():
-            if byte_payload == b"\n":
-                continue
-            payload = byte_payload.decode("utf-8")
-            if payload.startswith("data:"):
-                json_payload = json.loads(payload.lstrip("data:").rstrip("\n"))
-                try:
-                    response = ChatCompletionChunk(**json_payload)
-                    yield response
-                except ValidationError:
-                    raise parse_error(resp.status, json_payload)
+        for data in iter_sse_data(resp.iter_content(chunk_size=None)):
+            if data == DONE:
+                break
+            yield parse_event(data, resp.status_code, ChatCompletionChunk, raw)
 
     def generate(
         self,
@@ -377,7 +391,7 @@ class Client:
         )
         request = Request(inputs=prompt, stream=False, parameters=parameters)
 
-        resp = requests.post(
+        resp = self.session.post(
             self.base_url,
             json=request.dict(),
             headers=self.headers,
@@ -407,7 +421,8 @@ class Client:
         watermark: bool = False,
         top_n_tokens: Optional[int] = None,
         grammar: Optional[Grammar] = None,
-    ) -> Iterator[StreamResponse]:
+        raw: bool = False,
+    ) -> Iterator[Union[StreamResponse, Dict]]:
         """
         Given a prompt, generate the following stream of tokens
 
@@ -450,6 +465,8 @@ class Client:
             grammar (`Grammar`):
                 Whether to use a grammar for the generation and the grammar to use. Grammars will constrain the generation
                 of the text to match a regular expression or JSON schema.
+            raw (`bool`):
+                Yield the decoded event dicts instead of `StreamResponse` objects
 
         Returns:
             Iterator[StreamResponse]: stream of generated tokens
@@ -477,7 +494,7 @@ class Client:
         )
         request = Request(inputs=prompt, stream=True, parameters=parameters)
 
-        resp = requests.post(
+        resp = self.session.post(
             self.base_url,
             json=request.dict(),
             headers=self.headers,
@@ -490,24 +507,8 @@ class Client:
             raise parse_error(resp.status_code, resp.json())
 
         # Parse ServerSentEvents
-        for byte_payload in resp.iter_lines():
-            # Skip line
-            if byte_payload == b"\n":
-                continue
-
-            payload = byte_payload.decode("utf-8")
-
-            # Event data
-            if payload.startswith("data:"):
-                # Decode payload
-                json_payload = json.loads(payload.lstrip("data:").rstrip("/n"))
-                # Parse payload
-                try:
-                    response = StreamResponse(**json_payload)
-                except ValidationError:
-                    # If we failed to parse the payload, then it is an error payload
-                    raise parse_error(resp.status_code, json_payload)
-                yield response
+        for data in iter_sse_data(resp.iter_content(chunk_size=None)):
+            yield parse_event(data, resp.status_code, StreamResponse, raw)
 
 
 class AsyncClient:
@@ -538,6 +539,7 @@ class AsyncClient:
         headers: Optional[Dict[str, str]] = None,
         cookies: Optional[Dict[str, str]] = None,
         timeout: int = 10,
+        connection_limit: int = 100,
     ):
         """
         Args:
@@ -549,12 +551,49 @@ class AsyncClient:
                 Cookies to include in the requests
             timeout (`int`):
                 Timeout in seconds
+            connection_limit (`int`):
+                Maximum number of simultaneous connections, 0 for no limit. The connections
+                are only kept between requests when the client is used as a context manager
         """
         warnings.warn(DEPRECATION_WARNING, DeprecationWarning)
         self.base_url = base_url
         self.headers = headers
         self.cookies = cookies
         self.timeout = ClientTimeout(timeout)
+        self.connection_limit = connection_limit
+        self._session: Optional[ClientSession] = None
+
+    def _new_session(self) -> ClientSession:
+        return ClientSession(
+            headers=self.headers,
+            cookies=self.cookies,
+            timeout=self.timeout,
+            connector=TCPConnector(limit=self.connection_limit),
+        )
+
+    @asynccontextmanager
+    async def _session_scope(self) -> AsyncIterator[ClientSession]:
+        # Requests share the pooled session while the client is used as a context
+        # manager, otherwise each request has its own session, closed after it
+        if self._session is not None and not self._session.closed:
+            yield self._session
+        else:
+            async with self._new_session() as session:
+                yield session
+
+    async def close(self):
+        """Close the pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        if self._session is None or self._session.closed:
+            self._session = self._new_session()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
 
     async def completion(
         self,
@@ -613,9 +652,7 @@ class AsyncClient:
             return self._completion_stream_response(request)
 
     async def _completion_single_response(self, request):
-        async with ClientSession(
-            headers=self.headers, cookies=self.cookies, timeout=self.timeout
-        ) as session:
+        async with self._session_scope() as session:
             async with session.post(
                 f"{self.base_url}/v1/completions", json=request.dict()
             ) as resp:
@@ -625,9 +662,7 @@ class AsyncClient:
                 return Completion(**payload)
 
     async def _completion_stream_response(self, request):
-        async with ClientSession(
-            headers=self.headers, cookies=self.cookies, timeout=self.timeout
-        ) as session:
+        async with self._session_scope() as session:
             async with session.post(
                 f"{self.base_url}/v1/completions", json=request.dict()
             ) as resp:
@@ -662,7 +697,8 @@ class AsyncClient:
         tool_prompt: Optional[str] = None,
         tool_choice: Optional[str] = None,
         stop: Optional[List[str]] = None,
-    ) -> Union[ChatComplete, AsyncIterator[ChatCompletionChunk]]:
+        raw: bool = False,
+    ) -> Union[ChatComplete, AsyncIterator[Union[ChatCompletionChunk, Dict]]]:
         """
         Given a list of messages, generate a response asynchronously
 
@@ -706,7 +742,8 @@ class AsyncClient:
                 The tool to use
             stop (`List[str]`):
                 Stop generating tokens if a member of `stop` is generated
-
+            raw (`bool`):
+                When streaming, yield the decoded chunk dicts instead of `ChatCompletionChunk` objects
         """
         request = ChatRequest(
             model="tgi",
@@ -731,12 +768,10 @@ class AsyncClient:
         if not stream:
             return await self._chat_single_response(request)
         else:
-            return self._chat_stream_response(request)
+            return self._chat_stream_response(request, raw)
 
     async def _chat_single_response(self, request):
-        async with ClientSession(
-            headers=self.headers, cookies=self.cookies, timeout=self.timeout
-        ) as session:
+        async with self._session_scope() as session:
             async with session.post(
                 f"{self.base_url}/v1/chat/completions", json=request.dict()
             ) as resp:
@@ -745,29 +780,15 @@ class AsyncClient:
                     raise parse_error(resp.status, payload)
                 return ChatComplete(**payload)
 
-    async def _chat_stream_response(self, request):
-        async with ClientSession(
-            headers=self.headers, cookies=self.cookies, timeout=self.timeout
-        ) as session:
+    async def _chat_stream_response(self, request, raw):
+        async with self._session_scope() as session:
             async with session.post(
                 f"{self.base_url}/v1/chat/completions", json=request.dict()
             ) as resp:
-                async for byte_payload in resp.content:
-                    if byte_payload == b"\n":
-                        continue
-                    payload = byte_payload.decode("utf-8")
-                    if payload.startswith("data:"):
-                        payload_data = (
-                            payload.lstrip("data:").rstrip("\n").removeprefix(" ")
-                        )
-                        if payload_data == "[DONE]":
-                            break
-                        json_payload = json.loads(payload_data)
-                        try:
-                            response = ChatCompletionChunk(**json_payload)
-                            yield response
-                        except ValidationError:
-                            raise parse_error(resp.status, json_payload)
+                async for data in aiter_sse_data(resp.content.iter_any()):
+                    if data == DONE:
+                        break
+                    yield parse_event(data, resp.status, ChatCompletionChunk, raw)
 
     async def generate(
         self,
@@ -864,9 +885,7 @@ class AsyncClient:
         )
         request = Request(inputs=prompt, stream=False, parameters=parameters)
 
-        async with ClientSession(
-            headers=self.headers, cookies=self.cookies, timeout=self.timeout
-        ) as session:
+        async with self._session_scope() as session:
             async with session.post(self.base_url, json=request.model_dump()) as resp:
                 payload = await resp.json()
 
@@ -874,6 +893,51 @@ class AsyncClient:
                     raise parse_error(resp.status, payload)
                 return Response(**payload[0])
 
+    async def generate_many(
+        self,
+        prompts: List[str],
+        concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> List[Union[Response, BaseException]]:
+        """
+        Given a list of prompts, generate their responses concurrently over the pooled connections
+
+        Args:
+            prompts (`List[str]`):
+                Input texts
+            concurrency (`Optional[int]`):
+                Maximum number of requests in flight. Defaults to `connection_limit`
+            return_exceptions (`bool`):
+                Return the exceptions in place of the failed responses instead of raising the first one
+            **kwargs:
+                Generation parameters forwarded to `generate`
+
+        Returns:
+            List[Response]: generated responses, in the order of `prompts`
+        """
+        if self._session is None or self._session.closed:
+            # Pool the connections for the duration of the call
+            async with self:
+                return await self.generate_many(
+                    prompts, concurrency, return_exceptions, **kwargs
+                )
+
+        if concurrency is None:
+            concurrency = self.connection_limit or max(len(prompts), 1)
+        if concurrency < 1:
+            raise ValueError("`concurrency` must be strictly positive")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate(prompt: str) -> Response:
+            async with semaphore:
+                return await self.generate(prompt, **kwargs)
+
+        return await asyncio.gather(
+            *[generate(prompt) for prompt in prompts],
+            return_exceptions=return_exceptions,
+        )
+
     async def generate_stream(
         self,
         prompt: str,
@@ -892,7 +956,8 @@ class AsyncClient:
         watermark: bool = False,
         top_n_tokens: Optional[int] = None,
         grammar: Optional[Grammar] = None,
-    ) -> AsyncIterator[StreamResponse]:
+        raw: bool = False,
+    ) -> AsyncIterator[Union[StreamResponse, Dict]]:
         """
         Given a prompt, generate the following stream of tokens asynchronously
 
@@ -935,6 +1000,8 @@ class AsyncClient:
             grammar (`Grammar`):
                 Whether to use a grammar for the generation and the grammar to use. Grammars will constrain the generation
                 of the text to match a regular expression or JSON schema.
+            raw (`bool`):
+                Yield the decoded event dicts instead of `StreamResponse` objects
 
         Returns:
             AsyncIterator[StreamResponse]: stream of generated tokens
@@ -962,29 +1029,11 @@ class AsyncClient:
         )
         request = Request(inputs=prompt, stream=True, parameters=parameters)
 
-        async with ClientSession(
-            headers=self.headers, cookies=self.cookies, timeout=self.timeout
-        ) as session:
+        async with self._session_scope() as session:
             async with session.post(self.base_url, json=request.dict()) as resp:
                 if resp.status != 200:
                     raise parse_error(resp.status, await resp.json())
 
                 # Parse ServerSentEvents
-                async for byte_payload in resp.content:
-                    # Skip line
-                    if byte_payload == b"\n":
-                        continue
-
-                    payload = byte_payload.decode("utf-8")
-
-                    # Event data
-                    if payload.startswith("data:"):
-                        # Decode payload
-                        json_payload = json.loads(payload.lstrip("data:").rstrip("/n"))
-                        # Parse payload
-                        try:
-                            response = StreamResponse(**json_payload)
-                        except ValidationError:
-                            # If we failed to parse the payload, then it is an error payload
-                            raise parse_error(resp.status, json_payload)
-                        yield response
+                async for data in aiter_sse_data(resp.content.iter_any()):
+                    yield parse_event(data, resp.status, StreamResponse, raw)
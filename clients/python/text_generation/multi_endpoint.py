@@ -0,0 +1,739 @@
+import asyncio
+import bisect
+import hashlib
+import inspect
+import json
+import math
+import random
+import requests
+import threading
+import time
+import warnings
+
+from aiohttp import ClientError, ClientTimeout
+from collections import deque
+from pydantic import BaseModel
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Union
+
+from text_generation import DEPRECATION_WARNING
+from text_generation.client import Client, AsyncClient
+from text_generation.errors import (
+    OverloadedError,
+    RateLimitExceededError,
+    ShardNotReadyError,
+    ShardTimeoutError,
+    UnknownError,
+)
+from text_generation.types import Response
+
+# Errors caused by the endpoint rather than by the request: the request is retried on
+# another endpoint and the endpoint is ejected after `max_failures` of them in a row
+_SERVER_ERRORS = (
+    OverloadedError,
+    RateLimitExceededError,
+    ShardNotReadyError,
+    ShardTimeoutError,
+    UnknownError,
+)
+ENDPOINT_ERRORS = _SERVER_ERRORS + (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+ASYNC_ENDPOINT_ERRORS = _SERVER_ERRORS + (ClientError, asyncio.TimeoutError)
+
+# Points of each endpoint on the consistent hashing ring
+_RING_REPLICAS = 64
+
+
+def _hash(data: bytes) -> int:
+    # Stable across processes, unlike `hash`, so that all the clients agree
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def affinity_key(prompt: Union[str, List], length: int) -> bytes:
+    """Key of the first `length` characters of a prompt or of a list of chat messages"""
+    if not isinstance(prompt, str):
+        prompt = json.dumps(
+            [m.model_dump() if isinstance(m, BaseModel) else m for m in prompt],
+            sort_keys=True,
+        )
+    return prompt[:length].encode()
+
+
+class Endpoint:
+    def __init__(self, url: str, client: Union[Client, AsyncClient]):
+        self.url = url
+        self.client = client
+        # Requests in flight
+        self.outstanding = 0
+        # Exponentially weighted moving average of the request latency in seconds
+        self.latency: Optional[float] = None
+        self.consecutive_failures = 0
+        # The endpoint is not selected before these `time.monotonic()` deadlines, set
+        # by failed requests and by failed health probes
+        self.ejected_until = 0.0
+        self.probe_ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until > now or self.probe_ejected_until > now
+
+
+class EndpointPool:
+    """Least outstanding requests balancing, weighted by the observed latency
+
+    Endpoints are ejected after `max_failures` consecutive failures, or a failed
+    health probe, for `ejection_time` seconds.
+
+    Requests with an affinity key go to the key's home endpoint on a consistent
+    hashing ring, unless it has more than `affinity_load_factor` times the average
+    number of outstanding requests, in which case they spill to the next endpoints of
+    the ring (consistent hashing with bounded loads).
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        ewma_alpha: float = 0.3,
+        max_failures: int = 3,
+        ejection_time: float = 30.0,
+        latency_window: int = 1000,
+        affinity_load_factor: float = 1.25,
+    ):
+        if not endpoints:
+            raise ValueError("at least one endpoint is required")
+        if affinity_load_factor < 1:
+            raise ValueError("`affinity_load_factor` must be greater or equal to 1")
+        self.endpoints = endpoints
+        self.ewma_alpha = ewma_alpha
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        # Latencies of the last requests of all endpoints, used for the hedging delay
+        self.latencies = deque(maxlen=latency_window)
+        self.hedges = 0
+        self.affinity_load_factor = affinity_load_factor
+        self.ring = sorted(
+            (
+                (_hash(f"{endpoint.url}-{i}".encode()), endpoint)
+                for endpoint in endpoints
+                for i in range(_RING_REPLICAS)
+            ),
+            key=lambda point: point[0],
+        )
+        self.ring_hashes = [h for h, _ in self.ring]
+        self.affinity_requests = 0
+        self.affinity_spills = 0
+        self.lock = threading.Lock()
+
+    def select(
+        self, exclude: Set[Endpoint] = frozenset(), key: Optional[bytes] = None
+    ) -> Optional[Endpoint]:
+        """Return the endpoint with the lowest expected wait, None if all are excluded
+
+        If `key` is set, return its home endpoint unless it is overloaded.
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            # Try ejected endpoints rather than failing when no endpoint is healthy
+            healthy = [e for e in candidates if not e.is_ejected(now)]
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+            if key is not None:
+                return self._select_affinity(candidates, key, count=not exclude)
+            known = [e.latency for e in candidates if e.latency is not None]
+            # Endpoints without latency samples yet are assumed to be as fast as the
+            # fastest one so that they receive traffic
+            default = min(known) if known else 1.0
+            return min(
+                candidates,
+                key=lambda e: (
+                    (e.outstanding + 1)
+                    * (e.latency if e.latency is not None else default),
+                    random.random(),
+                ),
+            )
+
+    def _select_affinity(
+        self, candidates: List[Endpoint], key: bytes, count: bool
+    ) -> Endpoint:
+        outstanding = sum(e.outstanding for e in self.endpoints)
+        capacity = math.ceil(
+            self.affinity_load_factor * (outstanding + 1) / len(candidates)
+        )
+        candidates = set(candidates)
+        start = bisect.bisect(self.ring_hashes, _hash(key))
+        home = None
+        for i in range(len(self.ring)):
+            endpoint = self.ring[(start + i) % len(self.ring)][1]
+            if endpoint not in candidates:
+                continue
+            home = home or endpoint
+            if endpoint.outstanding < capacity:
+                break
+        # Retries and hedges are not counted
+        if count:
+            self.affinity_requests += 1
+            if endpoint is not home:
+                self.affinity_spills += 1
+        return endpoint
+
+    def start(self, endpoint: Endpoint):
+        with self.lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+
+    def finish(self, endpoint: Endpoint, latency: Optional[float], failed: bool):
+        """Record the end of a request, `latency` is None if it is not representative"""
+        with self.lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.max_failures:
+                    endpoint.ejected_until = time.monotonic() + self.ejection_time
+                return
+            endpoint.consecutive_failures = 0
+            if latency is not None:
+                self.latencies.append(latency)
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += self.ewma_alpha * (latency - endpoint.latency)
+
+    def set_health(self, endpoint: Endpoint, healthy: bool):
+        # A healthy probe does not clear the ejections caused by failed requests, the
+        # endpoint can answer its probes while failing the requests
+        with self.lock:
+            if healthy:
+                endpoint.probe_ejected_until = 0.0
+            else:
+                endpoint.probe_ejected_until = time.monotonic() + self.ejection_time
+
+    def hedge_delay(self, quantile: float, min_samples: int) -> Optional[float]:
+        """Latency `quantile` of the recent requests, None without enough samples"""
+        with self.lock:
+            if len(self.latencies) < min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "hedges": self.hedges,
+                "affinity": {
+                    "requests": self.affinity_requests,
+                    "spills": self.affinity_spills,
+                    # Share of the requests served by their home endpoint
+                    "home_rate": (
+                        1 - self.affinity_spills / self.affinity_requests
+                        if self.affinity_requests
+                        else None
+                    ),
+                },
+                "endpoints": [
+                    {
+                        "url": e.url,
+                        "healthy": not e.is_ejected(now),
+                        "outstanding": e.outstanding,
+                        "latency": e.latency,
+                        "requests": e.requests,
+                        "failures": e.failures,
+                    }
+                    for e in self.endpoints
+                ],
+            }
+
+
+class MultiEndpointClient:
+    """Client spreading the requests over several text-generation-inference replicas
+
+    Requests go to the replica with the fewest outstanding requests relative to its
+    observed latency. Replicas failing requests or health probes are ejected for a
+    while, and requests failing because of the replica are retried on another one.
+
+     Example:
+
+     ```python
+     >>> from text_generation import MultiEndpointClient
+
+     >>> client = MultiEndpointClient(["http://replica-0:8080", "http://replica-1:8080"])
+     >>> client.generate("Why is the sky blue?").generated_text
+     ' Rayleigh scattering'
+     ```
+    """
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        headers: Optional[Dict[str, str]] = None,
+        cookies: Optional[Dict[str, str]] = None,
+        timeout: int = 10,
+        retries: int = 1,
+        max_failures: int = 3,
+        ejection_time: float = 30.0,
+        health_check_interval: Optional[float] = 5.0,
+        health_check_timeout: float = 2.0,
+        ewma_alpha: float = 0.3,
+        affinity: bool = False,
+        affinity_prefix_length: int = 256,
+        affinity_load_factor: float = 1.25,
+    ):
+        """
+        Args:
+            base_urls (`List[str]`):
+                text-generation-inference instance base urls
+            headers (`Optional[Dict[str, str]]`):
+                Additional headers
+            cookies (`Optional[Dict[str, str]]`):
+                Cookies to include in the requests
+            timeout (`int`):
+                Timeout in seconds
+            retries (`int`):
+                Number of other endpoints to try when a request fails because of its endpoint
+            max_failures (`int`):
+                Consecutive failures after which an endpoint is ejected
+            ejection_time (`float`):
+                Time in seconds during which an ejected endpoint is not selected
+            health_check_interval (`Optional[float]`):
+                Interval in seconds between two `/health` probes of the endpoints, None to disable them
+            health_check_timeout (`float`):
+                Timeout of the health probes in seconds
+            ewma_alpha (`float`):
+                Smoothing factor of the latency moving averages
+            affinity (`bool`):
+                Send the prompts sharing a prefix to the same endpoint, to hit its prefix cache
+            affinity_prefix_length (`int`):
+                Number of characters of the prompt, or of the serialized chat messages, used as affinity key
+            affinity_load_factor (`float`):
+                An endpoint with more than this factor times the average outstanding requests
+                does not receive the requests of its prefixes
+        """
+        warnings.warn(DEPRECATION_WARNING, DeprecationWarning)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            endpoints = [
+                Endpoint(url, Client(url, headers, cookies, timeout))
+                for url in base_urls
+            ]
+        self.pool = EndpointPool(
+            endpoints,
+            ewma_alpha=ewma_alpha,
+            max_failures=max_failures,
+            ejection_time=ejection_time,
+            affinity_load_factor=affinity_load_factor,
+        )
+        self.retries = retries
+        self.affinity = affinity
+        self.affinity_prefix_length = affinity_prefix_length
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self._closed = threading.Event()
+        self._health_thread = None
+        if health_check_interval is not None:
+            self._health_thread = threading.Thread(
+                target=self._health_checks, daemon=True
+            )
+            self._health_thread.start()
+
+    def close(self):
+        """Stop the health probes and close the pooled connections"""
+        self._closed.set()
+        for endpoint in self.pool.endpoints:
+            endpoint.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Per endpoint load, latency and failure statistics, and affinity hit rate"""
+        return self.pool.stats()
+
+    def _key(self, prompt: Union[str, List]) -> Optional[bytes]:
+        if not self.affinity:
+            return None
+        return affinity_key(prompt, self.affinity_prefix_length)
+
+    def _health_checks(self):
+        while not self._closed.wait(self.health_check_interval):
+            for endpoint in self.pool.endpoints:
+                try:
+                    resp = requests.get(
+                        f"{endpoint.url}/health", timeout=self.health_check_timeout
+                    )
+                    healthy = resp.status_code == 200
+                except requests.exceptions.RequestException:
+                    healthy = False
+                self.pool.set_health(endpoint, healthy)
+
+    def _send(self, endpoint: Endpoint, method: str, *args, **kwargs):
+        self.pool.start(endpoint)
+        start = time.perf_counter()
+        latency = None
+        failed = False
+        try:
+            result = getattr(endpoint.client, method)(*args, **kwargs)
+            latency = time.perf_counter() - start
+            return result
+        except ENDPOINT_ERRORS:
+            failed = True
+            raise
+        finally:
+            self.pool.finish(endpoint, latency, failed)
+
+    def _call(self, method: str, key: Optional[bytes], *args, **kwargs):
+        tried = set()
+        while True:
+            endpoint = self.pool.select(tried, key)
+            tried.add(endpoint)
+            try:
+                return self._send(endpoint, method, *args, **kwargs)
+            except ENDPOINT_ERRORS:
+                if len(tried) > self.retries or len(tried) == len(self.pool.endpoints):
+                    raise
+
+    def _stream(self, method: str, key: Optional[bytes], *args, **kwargs) -> Iterator:
+        # Streams are not retried once started and do not update the latency averages
+        endpoint = self.pool.select(key=key)
+        self.pool.start(endpoint)
+        failed = False
+        try:
+            yield from getattr(endpoint.client, method)(*args, **kwargs)
+        except ENDPOINT_ERRORS:
+            failed = True
+            raise
+        finally:
+            self.pool.finish(endpoint, None, failed)
+
+    def generate(self, prompt: str, **kwargs) -> Response:
+        """Same as `Client.generate`, on the selected endpoint"""
+        return self._call("generate", self._key(prompt), prompt, **kwargs)
+
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator:
+        """Same as `Client.generate_stream`, on the selected endpoint"""
+        return self._stream("generate_stream", self._key(prompt), prompt, **kwargs)
+
+    def chat(self, messages, stream: bool = False, **kwargs):
+        """Same as `Client.chat`, on the selected endpoint"""
+        if stream:
+            return self._stream(
+                "chat", self._key(messages), messages, stream=True, **kwargs
+            )
+        return self._call("chat", self._key(messages), messages, **kwargs)
+
+    def completion(self, prompt: str, stream: bool = False, **kwargs):
+        """Same as `Client.completion`, on the selected endpoint"""
+        if stream:
+            return self._stream(
+                "completion", self._key(prompt), prompt, stream=True, **kwargs
+            )
+        return self._call("completion", self._key(prompt), prompt, **kwargs)
+
+
+class AsyncMultiEndpointClient:
+    """Asynchronous client spreading the requests over several text-generation-inference replicas
+
+    Balances and ejects endpoints like `MultiEndpointClient`. With `hedge=True`, a
+    request still running after the `hedge_quantile` of the recent latencies is sent
+    again to another endpoint; the first response wins and the other request is
+    cancelled, which makes the server stop its generation.
+
+     Example:
+
+     ```python
+     >>> from text_generation import AsyncMultiEndpointClient
+
+     >>> client = AsyncMultiEndpointClient(
+     >>>     ["http://replica-0:8080", "http://replica-1:8080"], hedge=True
+     >>> )
+     >>> response = await client.generate("Why is the sky blue?")
+     >>> response.generated_text
+     ' Rayleigh scattering'
+     ```
+    """
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        headers: Optional[Dict[str, str]] = None,
+        cookies: Optional[Dict[str, str]] = None,
+        timeout: int = 10,
+        connection_limit: int = 100,
+        retries: int = 1,
+        max_failures: int = 3,
+        ejection_time: float = 30.0,
+        health_check_interval: Optional[float] = 5.0,
+        health_check_timeout: float = 2.0,
+        ewma_alpha: float = 0.3,
+        affinity: bool = False,
+        affinity_prefix_length: int = 256,
+        affinity_load_factor: float = 1.25,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+    ):
+        """
+        Args:
+            base_urls (`List[str]`):
+                text-generation-inference instance base urls
+            headers (`Optional[Dict[str, str]]`):
+                Additional headers
+            cookies (`Optional[Dict[str, str]]`):
+                Cookies to include in the requests
+            timeout (`int`):
+                Timeout in seconds
+            connection_limit (`int`):
+                Maximum number of simultaneous connections per endpoint, 0 for no limit
+            retries (`int`):
+                Number of other endpoints to try when a request fails because of its endpoint
+            max_failures (`int`):
+                Consecutive failures after which an endpoint is ejected
+            ejection_time (`float`):
+                Time in seconds during which an ejected endpoint is not selected
+            health_check_interval (`Optional[float]`):
+                Interval in seconds between two `/health` probes of the endpoints, None to disable them
+            health_check_timeout (`float`):
+                Timeout of the health probes in seconds
+            ewma_alpha (`float`):
+                Smoothing factor of the latency moving averages
+            affinity (`bool`):
+                Send the prompts sharing a prefix to the same endpoint, to hit its prefix cache
+            affinity_prefix_length (`int`):
+                Number of characters of the prompt, or of the serialized chat messages, used as affinity key
+            affinity_load_factor (`float`):
+                An endpoint with more than this factor times the average outstanding requests
+                does not receive the requests of its prefixes
+            hedge (`bool`):
+                Send a duplicate of the non streaming requests that are slower than `hedge_quantile`
+            hedge_quantile (`float`):
+                Quantile of the recent latencies after which a request is hedged
+            hedge_min_samples (`int`):
+                Number of latency samples needed before hedging
+        """
+        warnings.warn(DEPRECATION_WARNING, DeprecationWarning)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            endpoints = [
+                Endpoint(
+                    url,
+                    AsyncClient(
+                        url,
+                        headers,
+                        cookies,
+                        timeout,
+                        connection_limit=connection_limit,
+                    ),
+                )
+                for url in base_urls
+            ]
+        self.pool = EndpointPool(
+            endpoints,
+            ewma_alpha=ewma_alpha,
+            max_failures=max_failures,
+            ejection_time=ejection_time,
+            affinity_load_factor=affinity_load_factor,
+        )
+        self.retries = retries
+        self.affinity = affinity
+        self.affinity_prefix_length = affinity_prefix_length
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = ClientTimeout(health_check_timeout)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def close(self):
+        """Stop the health probes and close the pooled connections"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for endpoint in self.pool.endpoints:
+            await endpoint.client.close()
+
+    async def __aenter__(self):
+        for endpoint in self.pool.endpoints:
+            await endpoint.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Per endpoint load, latency and failure statistics, and affinity hit rate"""
+        return self.pool.stats()
+
+    def _key(self, prompt: Union[str, List]) -> Optional[bytes]:
+        if not self.affinity:
+            return None
+        return affinity_key(prompt, self.affinity_prefix_length)
+
+    def _start_health_checks(self):
+        # Started on the first request, as it needs a running event loop
+        if self.health_check_interval is None:
+            return
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.ensure_future(self._health_checks())
+
+    async def _health_checks(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await asyncio.gather(
+                *[self._probe(endpoint) for endpoint in self.pool.endpoints]
+            )
+
+    async def _probe(self, endpoint: Endpoint):
+        try:
+            async with endpoint.client._session_scope() as session:
+                async with session.get(
+                    f"{endpoint.url}/health", timeout=self.health_check_timeout
+                ) as resp:
+                    healthy = resp.status == 200
+        except (ClientError, asyncio.TimeoutError):
+            healthy = False
+        self.pool.set_health(endpoint, healthy)
+
+    async def _send(self, endpoint: Endpoint, method: str, args, kwargs):
+        self.pool.start(endpoint)
+        start = time.perf_counter()
+        latency = None
+        failed = False
+        try:
+            result = await getattr(endpoint.client, method)(*args, **kwargs)
+            latency = time.perf_counter() - start
+            return result
+        except ASYNC_ENDPOINT_ERRORS:
+            failed = True
+            raise
+        finally:
+            # Cancelled hedges end here without a latency sample
+            self.pool.finish(endpoint, latency, failed)
+
+    async def _hedged(
+        self,
+        endpoint: Endpoint,
+        tried: Set[Endpoint],
+        key: Optional[bytes],
+        method: str,
+        args,
+        kwargs,
+    ):
+        delay = None
+        if self.hedge:
+            delay = self.pool.hedge_delay(self.hedge_quantile, self.hedge_min_samples)
+        if delay is None:
+            return await self._send(endpoint, method, args, kwargs)
+
+        tasks = [asyncio.ensure_future(self._send(endpoint, method, args, kwargs))]
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                backup = self.pool.select(tried, key)
+                if backup is not None:
+                    tried.add(backup)
+                    with self.pool.lock:
+                        self.pool.hedges += 1
+                    tasks.append(
+                        asyncio.ensure_future(self._send(backup, method, args, kwargs))
+                    )
+                    pending = set(tasks)
+            while True:
+                if not done:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    # Wait for the other request if this one failed because of the
+                    # endpoint
+                    if not pending or not isinstance(error, ASYNC_ENDPOINT_ERRORS):
+                        raise error
+                done = set()
+        finally:
+            # Cancel the slower request
+            for task in tasks:
+                task.cancel()
+
+    async def _call(self, method: str, key: Optional[bytes], *args, **kwargs):
+        self._start_health_checks()
+        tried = set()
+        while True:
+            endpoint = self.pool.select(tried, key)
+            tried.add(endpoint)
+            try:
+                return await self._hedged(endpoint, tried, key, method, args, kwargs)
+            except ASYNC_ENDPOINT_ERRORS:
+                if len(tried) > self.retries or len(tried) == len(self.pool.endpoints):
+                    raise
+
+    async def _stream(
+        self, method: str, key: Optional[bytes], *args, **kwargs
+    ) -> AsyncIterator:
+        # Streams are neither hedged nor retried and do not update the latency averages
+        self._start_health_checks()
+        endpoint = self.pool.select(key=key)
+        self.pool.start(endpoint)
+        failed = False
+        try:
+            responses = getattr(endpoint.client, method)(*args, **kwargs)
+            if inspect.isawaitable(responses):
+                responses = await responses
+            async for response in responses:
+                yield response
+        except ASYNC_ENDPOINT_ERRORS:
+            failed = True
+            raise
+        finally:
+            self.pool.finish(endpoint, None, failed)
+
+    async def generate(self, prompt: str, **kwargs) -> Response:
+        """Same as `AsyncClient.generate`, on the selected endpoint"""
+        return await self._call("generate", self._key(prompt), prompt, **kwargs)
+
+    def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator:
+        """Same as `AsyncClient.generate_stream`, on the selected endpoint"""
+        return self._stream("generate_stream", self._key(prompt), prompt, **kwargs)
+
+    async def generate_many(
+        self,
+        prompts: List[str],
+        concurrency: int = 100,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> List[Union[Response, BaseException]]:
+        """Same as `AsyncClient.generate_many`, spread over the endpoints"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate(prompt: str) -> Response:
+            async with semaphore:
+                return await self.generate(prompt, **kwargs)
+
+        return await asyncio.gather(
+            *[generate(prompt) for prompt in prompts],
+            return_exceptions=return_exceptions,
+        )
+
+    async def chat(self, messages, stream: bool = False, **kwargs):
+        """Same as `AsyncClient.chat`, on the selected endpoint"""
+        if stream:
+            return self._stream(
+                "chat", self._key(messages), messages, stream=True, **kwargs
+            )
+        return await self._call("chat", self._key(messages), messages, **kwargs)
+
+    async def completion(self, prompt: str, stream: bool = False, **kwargs):
+        """Same as `AsyncClient.completion`, on the selected endpoint"""
+        if stream:
+            return self._stream(
+                "completion", self._key(prompt), prompt, stream=True, **kwargs
+            )
+        return await self._call("completion", self._key(prompt), prompt, **kwargs)
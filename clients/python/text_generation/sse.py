@@ -0,0 +1,99 @@
+from pydantic import BaseModel, ValidationError
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable
+from typing import Iterator, List, Type, Union
+
+from text_generation.errors import parse_error
+
+# Use orjson when it is installed, it is several times faster than the json module
+try:
+    import orjson
+
+    loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:
+    import json
+
+    loads = json.loads
+
+# Sent by the chat completions endpoint after the last chunk
+DONE = b"[DONE]"
+
+
+class ServerSentEvents:
+    """Incremental Server-Sent Events parser
+
+    Bytes are fed in chunks of any size and the `data` field of each complete event
+    is returned as bytes, without decoding the lines that carry other fields.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        events = []
+        buffer = self.buffer + chunk if self.buffer else chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = buffer[start:end]
+            start = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                # A blank line dispatches the event
+                if self.data:
+                    events.append(
+                        self.data[0] if len(self.data) == 1 else b"\n".join(self.data)
+                    )
+                    self.data = []
+            elif line.startswith(b"data:"):
+                value = line[5:]
+                if value.startswith(b" "):
+                    value = value[1:]
+                self.data.append(value)
+        self.buffer = buffer[start:]
+        return events
+
+    def flush(self) -> List[bytes]:
+        """Return the last event if the stream did not end with a blank line"""
+        events = self.feed(b"\n\n") if self.buffer or self.data else []
+        self.buffer = b""
+        return events
+
+
+def iter_sse_data(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    parser = ServerSentEvents()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.flush()
+
+
+async def aiter_sse_data(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    parser = ServerSentEvents()
+    async for chunk in chunks:
+        for data in parser.feed(chunk):
+            yield data
+    for data in parser.flush():
+        yield data
+
+
+def parse_event(
+    data: bytes, status: int, model: Type[BaseModel], raw: bool
+) -> Union[BaseModel, Dict]:
+    """Decode the data of a stream event
+
+    Returns the decoded dict if `raw` and the validated model otherwise. Error events
+    raise.
+    """
+    payload = loads(data)
+    if raw:
+        if "error" in payload:
+            raise parse_error(status, payload)
+        return payload
+    try:
+        return model(**payload)
+    except ValidationError:
+        # If we failed to parse the payload, then it is an error payload
+        raise parse_error(status, payload)
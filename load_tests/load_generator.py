@@ -0,0 +1,372 @@
+"""Asyncio load generator replaying a conversation dataset against a TGI endpoint.
+
+Prompts are read from the ShareGPT/Orca style JSON written by `filter.py` and
+`orca.py` (`small.json`). Requests arrive following a Poisson process at each of
+the requested rates, or at the timestamps of the dataset entries (`--arrival
+trace`), and are streamed with `text_generation.AsyncClient`.
+
+Each dataset entry can set:
+- `max_new_tokens`: number of tokens to generate for this entry. Otherwise the
+  length of the reference answer (first `gpt` turn) is used with
+  `--answer-length`, and `--max-new-tokens` as a last resort.
+- `timestamp`: arrival time in seconds, used with `--arrival trace`.
+
+TTFT, inter token latency (ITL), end to end latency and goodput are measured.
+Goodput only counts the requests meeting every SLO that is set: TTFT
+(`--slo-ttft-ms`), mean ITL of the request (`--slo-itl-ms`) and end to end
+latency (`--slo-e2e-ms`).
+
+Results are written in the format of `text-generation-inference-benchmark`
+reports used by `benchmarks.py`: a JSON report and/or one CSV or Parquet row per
+rate.
+
+    python load_generator.py --url http://localhost:8080 --rates 1 2 4 \\
+        --num-requests 200 --results-file results.parquet
+
+`mock_server.py` serves a fake streaming endpoint for local runs and tests.
+Requires the `text-generation` client (`pip install ../clients/python`).
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import math
+import random
+import statistics
+import time
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from text_generation import AsyncClient
+
+# Rough conversion used to derive max_new_tokens from the reference answers
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class Request:
+    prompt: str
+    max_new_tokens: int
+    timestamp: Optional[float] = None
+
+
+@dataclass
+class RequestResult:
+    # Relative to the start of the run
+    sent_at: float
+    ttft: Optional[float] = None
+    e2e_latency: Optional[float] = None
+    inter_token_latencies: List[float] = field(default_factory=list)
+    generated_tokens: int = 0
+    error: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None and self.ttft is not None
+
+    @property
+    def mean_itl(self) -> Optional[float]:
+        if not self.inter_token_latencies:
+            return None
+        return statistics.mean(self.inter_token_latencies)
+
+
+@dataclass
+class SLO:
+    ttft_ms: Optional[float] = None
+    itl_ms: Optional[float] = None
+    e2e_ms: Optional[float] = None
+
+    def met(self, result: RequestResult) -> bool:
+        if not result.success:
+            return False
+        if self.ttft_ms is not None and result.ttft * 1e3 > self.ttft_ms:
+            return False
+        if self.itl_ms is not None:
+            mean_itl = result.mean_itl
+            if mean_itl is not None and mean_itl * 1e3 > self.itl_ms:
+                return False
+        if self.e2e_ms is not None and result.e2e_latency * 1e3 > self.e2e_ms:
+            return False
+        return True
+
+
+def load_dataset(path: str, max_new_tokens: int, answer_length: bool) -> List[Request]:
+    with open(path, "r") as f:
+        data = json.load(f)
+
+    requests = []
+    for item in data:
+        turns = item.get("conversations", [])
+        prompt = next((t["value"] for t in turns if t["from"] == "human"), None)
+        if not prompt:
+            continue
+        request_max_new_tokens = item.get("max_new_tokens")
+        if request_max_new_tokens is None and answer_length:
+            answer = next((t["value"] for t in turns if t["from"] == "gpt"), None)
+            if answer:
+                request_max_new_tokens = max(1, len(answer) // CHARS_PER_TOKEN)
+        requests.append(
+            Request(
+                prompt=prompt,
+                max_new_tokens=request_max_new_tokens or max_new_tokens,
+                timestamp=item.get("timestamp"),
+            )
+        )
+    if not requests:
+        raise ValueError(f"No prompt found in {path}")
+    return requests
+
+
+def poisson_offsets(rng: random.Random, rate: float, n: int) -> List[float]:
+    """Arrival times in seconds of `n` requests at `rate` requests per second."""
+    if math.isinf(rate):
+        return [0.0] * n
+    offsets = []
+    t = 0.0
+    for _ in range(n):
+        offsets.append(t)
+        t += rng.expovariate(rate)
+    return offsets
+
+
+def trace_offsets(requests: List[Request], time_scale: float) -> List[float]:
+    if any(r.timestamp is None for r in requests):
+        raise ValueError("`--arrival trace` needs a `timestamp` on every entry")
+    first = min(r.timestamp for r in requests)
+    return [(r.timestamp - first) / time_scale for r in requests]
+
+
+async def send(
+    client: AsyncClient, request: Request, run_start: float
+) -> RequestResult:
+    start = time.perf_counter()
+    result = RequestResult(sent_at=start - run_start)
+    last = start
+    try:
+        async for response in client.generate_stream(
+            request.prompt, max_new_tokens=request.max_new_tokens
+        ):
+            now = time.perf_counter()
+            if result.ttft is None:
+                result.ttft = now - start
+            else:
+                result.inter_token_latencies.append(now - last)
+            last = now
+            result.generated_tokens += 1
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.e2e_latency = time.perf_counter() - start
+    return result
+
+
+async def run(
+    client: AsyncClient,
+    requests: List[Request],
+    offsets: List[float],
+    max_concurrency: Optional[int],
+) -> Tuple[List[RequestResult], float]:
+    """Send `requests` at `offsets` seconds from now and wait for all of them."""
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    run_start = time.perf_counter()
+
+    async def launch(request: Request, offset: float) -> RequestResult:
+        delay = run_start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if semaphore is None:
+            return await send(client, request, run_start)
+        async with semaphore:
+            return await send(client, request, run_start)
+
+    results = await asyncio.gather(
+        *(launch(request, offset) for request, offset in zip(requests, offsets))
+    )
+    return list(results), time.perf_counter() - run_start
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    """Average and percentiles of `values` given in seconds, in milliseconds."""
+    if not values:
+        return {}
+    values = sorted(v * 1e3 for v in values)
+    stats = {"avg": statistics.mean(values)}
+    for q in (50, 60, 70, 80, 90, 95, 99):
+        stats[f"p{q}"] = values[min(int(len(values) * q / 100), len(values) - 1)]
+    return stats
+
+
+def summarize(
+    benchmark_id: str,
+    config: Dict,
+    results: List[RequestResult],
+    duration: float,
+    slo: SLO,
+) -> Dict:
+    successful = [r for r in results if r.success]
+    good = [r for r in successful if slo.met(r)]
+    total_tokens = sum(r.generated_tokens for r in successful)
+    summary = {
+        "id": benchmark_id,
+        "executor_type": config["arrival"],
+        "config": config,
+        "total_requests": len(results),
+        "successful_requests": len(successful),
+        "failed_requests": len(results) - len(successful),
+        "total_tokens": total_tokens,
+        "token_throughput_secs": total_tokens / duration,
+        "duration_ms": duration * 1e3,
+        "request_rate": len(successful) / duration,
+        "goodput_request_rate": len(good) / duration,
+        "goodput_token_throughput_secs": sum(r.generated_tokens for r in good)
+        / duration,
+        "slo_attainment": len(good) / len(results) if results else 0.0,
+    }
+    # Flat columns so that every percentile gets its own CSV/Parquet column
+    for name, values in [
+        ("time_to_first_token_ms", [r.ttft for r in successful]),
+        (
+            "inter_token_latency_ms",
+            [itl for r in successful for itl in r.inter_token_latencies],
+        ),
+        ("e2e_latency_ms", [r.e2e_latency for r in successful]),
+    ]:
+        for stat, value in distribution(values).items():
+            summary[f"{name}_{stat}"] = value
+    return summary
+
+
+def write_results(
+    reports: List[Dict],
+    meta: Dict,
+    json_file: Optional[str],
+    results_file: Optional[str],
+):
+    if json_file is not None:
+        with open(json_file, "w") as f:
+            json.dump({"config": {"meta": meta}, "results": reports}, f, indent=2)
+
+    if results_file is not None:
+        # Same row layout as `benchmarks.build_df`
+        import pandas as pd
+
+        created_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rows = []
+        for report in reports:
+            row = {k: v for k, v in report.items() if k != "config"}
+            row.update(report["config"])
+            row.update(meta)
+            row["created_at"] = created_at
+            row["error_rate"] = (
+                row["failed_requests"] / max(row["total_requests"], 1) * 100.0
+            )
+            rows.append(row)
+        df = pd.DataFrame(rows)
+        if results_file.endswith(".csv"):
+            df.to_csv(results_file, index=False)
+        else:
+            df.to_parquet(results_file)
+
+
+async def benchmark(args) -> List[Dict]:
+    dataset = load_dataset(args.dataset, args.max_new_tokens, args.answer_length)
+    slo = SLO(args.slo_ttft_ms, args.slo_itl_ms, args.slo_e2e_ms)
+    client = AsyncClient(args.url, timeout=args.timeout)
+
+    if args.arrival == "trace":
+        runs = [("trace", None)]
+    else:
+        runs = [(f"poisson@{rate}", rate) for rate in args.rates]
+
+    reports = []
+    for i, (benchmark_id, rate) in enumerate(runs):
+        rng = random.Random(args.seed + i)
+        if args.arrival == "trace":
+            requests = dataset[: args.num_requests]
+            offsets = trace_offsets(requests, args.time_scale)
+        else:
+            requests = list(
+                itertools.islice(itertools.cycle(dataset), args.num_requests)
+            )
+            offsets = poisson_offsets(rng, rate, len(requests))
+
+        results, duration = await run(client, requests, offsets, args.max_concurrency)
+        config = {
+            "arrival": args.arrival,
+            "rate": rate,
+            "time_scale": args.time_scale if args.arrival == "trace" else None,
+            "num_requests": len(requests),
+            "max_concurrency": args.max_concurrency,
+            "slo_ttft_ms": args.slo_ttft_ms,
+            "slo_itl_ms": args.slo_itl_ms,
+            "slo_e2e_ms": args.slo_e2e_ms,
+        }
+        report = summarize(benchmark_id, config, results, duration, slo)
+        reports.append(report)
+        print(
+            f"{benchmark_id:>16}: {report['successful_requests']}/"
+            f"{report['total_requests']} ok, "
+            f"{report['token_throughput_secs']:.1f} tokens/s, "
+            f"goodput {report['goodput_request_rate']:.2f} req/s, "
+            f"TTFT p50 {report.get('time_to_first_token_ms_p50', math.nan):.1f}ms, "
+            f"ITL p50 {report.get('inter_token_latency_ms_p50', math.nan):.1f}ms"
+        )
+    return reports
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--dataset", default="small.json")
+    parser.add_argument("--arrival", choices=["poisson", "trace"], default="poisson")
+    parser.add_argument(
+        "--rates",
+        type=float,
+        nargs="+",
+        default=[1.0],
+        help="Requests per second, `inf` sends all the requests at once",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="Speed up factor of the trace timestamps",
+    )
+    parser.add_argument("--num-requests", type=int, default=100)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument(
+        "--answer-length",
+        action="store_true",
+        help="Generate as many tokens as the reference answer of each entry",
+    )
+    parser.add_argument("--slo-ttft-ms", type=float, default=None)
+    parser.add_argument("--slo-itl-ms", type=float, default=None)
+    parser.add_argument("--slo-e2e-ms", type=float, default=None)
+    parser.add_argument("--timeout", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--engine", default="TGI")
+    parser.add_argument("--tp", type=int, default=1)
+    parser.add_argument("--version", default=None, help="SHA of the tested commit")
+    parser.add_argument("--json-file", default=None)
+    parser.add_argument(
+        "--results-file", default=None, help="`.csv` or `.parquet` results file"
+    )
+    args = parser.parse_args(argv)
+
+    reports = asyncio.run(benchmark(args))
+    meta = {
+        "engine": args.engine,
+        "tp": args.tp,
+        "version": args.version,
+        "model": args.model,
+    }
+    write_results(reports, meta, args.json_file, args.results_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Fake TGI streaming endpoint with configurable latencies.
+
+Every request streams `max_new_tokens` tokens as server sent events, the first
+one after `--ttft-ms` and the next ones every `--itl-ms`, so that the load
+generator can be run and tested without a model.
+
+    python mock_server.py --port 8080 --ttft-ms 50 --itl-ms 10
+"""
+
+import argparse
+import asyncio
+import json
+
+from aiohttp import web
+
+DEFAULT_MAX_NEW_TOKENS = 20
+
+
+def make_app(ttft: float, itl: float) -> web.Application:
+    async def generate_stream(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        parameters = body.get("parameters") or {}
+        max_new_tokens = parameters.get("max_new_tokens") or DEFAULT_MAX_NEW_TOKENS
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(ttft)
+        for i in range(max_new_tokens):
+            if i > 0:
+                await asyncio.sleep(itl)
+            last = i == max_new_tokens - 1
+            event = {
+                "token": {"id": i, "text": " a", "logprob": -0.1, "special": False},
+                "generated_text": " a" * max_new_tokens if last else None,
+                "details": (
+                    {
+                        "finish_reason": "length",
+                        "generated_tokens": max_new_tokens,
+                        "seed": None,
+                    }
+                    if last
+                    else None
+                ),
+            }
+            await response.write(f"data:{json.dumps(event)}\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/", generate_stream)
+    app.router.add_post("/generate_stream", generate_stream)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--ttft-ms", type=float, default=50.0)
+    parser.add_argument("--itl-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    web.run_app(
+        make_app(args.ttft_ms / 1e3, args.itl_ms / 1e3), host=args.host, port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
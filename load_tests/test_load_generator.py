@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+from aiohttp import web
+from text_generation import AsyncClient
+
+from load_generator import SLO, load_dataset, run, summarize, write_results
+from mock_server import make_app
+
+
+async def _run_against_mock_server(requests, ttft, itl):
+    runner = web.AppRunner(make_app(ttft, itl))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        host, port = runner.addresses[0][:2]
+        client = AsyncClient(f"http://{host}:{port}")
+        return await run(client, requests, [0.0] * len(requests), None)
+    finally:
+        await runner.cleanup()
+
+
+def test_load_dataset(tmp_path):
+    dataset = tmp_path / "small.json"
+    dataset.write_text(
+        json.dumps(
+            [
+                {"conversations": [{"from": "human", "value": "Hi"}]},
+                {
+                    "conversations": [
+                        {"from": "human", "value": "Hello"},
+                        {"from": "gpt", "value": "x" * 40},
+                    ]
+                },
+                {
+                    "conversations": [{"from": "human", "value": "Hey"}],
+                    "max_new_tokens": 3,
+                },
+                {"conversations": [{"from": "gpt", "value": "no prompt"}]},
+            ]
+        )
+    )
+
+    requests = load_dataset(str(dataset), max_new_tokens=7, answer_length=True)
+
+    assert [r.prompt for r in requests] == ["Hi", "Hello", "Hey"]
+    assert [r.max_new_tokens for r in requests] == [7, 10, 3]
+
+
+def test_load_generator_against_mock_server(tmp_path):
+    dataset = tmp_path / "small.json"
+    dataset.write_text(
+        json.dumps(
+            [
+                {"conversations": [{"from": "human", "value": f"prompt {i}"}]}
+                for i in range(8)
+            ]
+        )
+    )
+    requests = load_dataset(str(dataset), max_new_tokens=5, answer_length=False)
+
+    results, duration = asyncio.run(
+        _run_against_mock_server(requests, ttft=0.05, itl=0.01)
+    )
+
+    assert all(r.success for r in results)
+    assert all(r.generated_tokens == 5 for r in results)
+    assert all(len(r.inter_token_latencies) == 4 for r in results)
+    assert all(r.ttft >= 0.05 for r in results)
+
+    report = summarize("test", {"arrival": "poisson"}, results, duration, SLO())
+    assert report["successful_requests"] == 8
+    assert report["failed_requests"] == 0
+    assert report["total_tokens"] == 40
+    assert report["time_to_first_token_ms_p50"] >= 50
+    assert report["goodput_request_rate"] == report["request_rate"]
+
+    # Nobody meets an impossible TTFT SLO
+    strict = summarize(
+        "test", {"arrival": "poisson"}, results, duration, SLO(ttft_ms=1)
+    )
+    assert strict["goodput_request_rate"] == 0
+    assert strict["slo_attainment"] == 0
+
+    results_file = tmp_path / "results.csv"
+    write_results([report], {"engine": "TGI"}, None, str(results_file))
+    header = results_file.read_text().splitlines()[0].split(",")
+    assert "time_to_first_token_ms_p50" in header
+    assert "error_rate" in header
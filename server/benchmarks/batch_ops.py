@@ -0,0 +1,592 @@
+"""Micro-benchmarks of the Python hot paths of the shard on CPU.
+
+Batches are built from synthetic requests tokenized with a generated word level
+tokenizer, and model outputs (logits, past key values, encoder states) are random
+tensors, so no model weights are needed. Past key values use small shapes so
+that the measured time is dominated by the host code of each operation.
+
+Every benchmark is run over the cartesian product of the sweep axes it depends on
+and the results are written as JSON. Two runs can then be compared:
+
+    python benchmarks/batch_ops.py --output before.json
+    git checkout my-branch
+    python benchmarks/batch_ops.py --output after.json --compare before.json
+
+`--benchmarks` selects a subset of the benchmarks, `--list` prints them.
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+# Plain PyTorch attention runs the flash batches without a GPU
+os.environ.setdefault("ATTENTION", "paged" if torch.cuda.is_available() else "torch")
+os.environ.setdefault("PREFIX_CACHING", "0")
+
+from tokenizers import Tokenizer  # noqa: E402
+from tokenizers.models import WordLevel  # noqa: E402
+from tokenizers.pre_tokenizers import WhitespaceSplit  # noqa: E402
+from transformers import PreTrainedTokenizerFast  # noqa: E402
+
+from text_generation_server.models.causal_lm import CausalLMBatch  # noqa: E402
+from text_generation_server.models.globals import set_adapter_to_index  # noqa: E402
+from text_generation_server.models.model import Model  # noqa: E402
+from text_generation_server.models.seq2seq_lm import Seq2SeqLMBatch  # noqa: E402
+from text_generation_server.pb import generate_pb2  # noqa: E402
+from text_generation_server.utils.speculate import set_speculate  # noqa: E402
+from text_generation_server.utils.tokens import (  # noqa: E402
+    HeterogeneousNextTokenChooser,
+    StoppingCriteria,
+    batch_top_tokens,
+)
+
+# Flash batches need an attention backend and Mamba batches need `mamba_ssm`.
+# Their benchmarks are skipped when they cannot be imported.
+try:
+    from text_generation_server.models.flash_causal_lm import FlashCausalLMBatch
+    from text_generation_server.utils.segments import segment_bounds
+except ImportError as e:
+    FlashCausalLMBatch = None
+    FLASH_IMPORT_ERROR = e
+
+try:
+    from text_generation_server.models.mamba import (
+        MambaBatch,
+        new_inference_params,
+    )
+except ImportError as e:
+    MambaBatch = None
+    MAMBA_IMPORT_ERROR = e
+
+# As in `server.serve`, the batches look up the adapter of their requests
+set_adapter_to_index({})
+
+DEVICE = torch.device("cpu")
+DTYPE = torch.float32
+
+# Shapes of the synthetic model states
+NUM_LAYERS = 4
+NUM_HEADS = 8
+HEAD_DIM = 64
+MAMBA_D_INNER = 512
+MAMBA_D_CONV = 4
+MAMBA_D_STATE = 16
+
+# Vocabulary used by the batch benchmarks, which do not depend on its size
+BATCH_VOCAB_SIZE = 32000
+MAX_NEW_TOKENS = 256
+SPECIAL_TOKENS = ["<pad>", "</s>", "<s>", "<unk>"]
+
+
+@functools.lru_cache(maxsize=None)
+def make_tokenizer(vocab_size: int) -> PreTrainedTokenizerFast:
+    """Word level tokenizer where the word `w{i}` is the token `i`."""
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS)}
+    for i in range(len(SPECIAL_TOKENS), vocab_size):
+        vocab[f"w{i}"] = i
+    tokenizer = Tokenizer(WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = WhitespaceSplit()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        pad_token="<pad>",
+        eos_token="</s>",
+        bos_token="<s>",
+        unk_token="<unk>",
+        padding_side="left",
+    )
+
+
+def random_token_ids(rng: random.Random, length: int, vocab_size: int) -> List[int]:
+    return [rng.randrange(len(SPECIAL_TOKENS), vocab_size) for _ in range(length)]
+
+
+def chooser_parameters(mix: str, i: int) -> generate_pb2.NextTokenChooserParameters:
+    """Greedy parameters, or every other request sampling with all warpers on."""
+    if mix == "greedy" or i % 2 == 0:
+        return generate_pb2.NextTokenChooserParameters(
+            temperature=1.0,
+            repetition_penalty=1.0,
+            top_k=0,
+            top_p=1.0,
+            typical_p=1.0,
+            do_sample=False,
+        )
+    return generate_pb2.NextTokenChooserParameters(
+        temperature=0.7,
+        repetition_penalty=1.1,
+        frequency_penalty=0.1,
+        top_k=50,
+        top_p=0.9,
+        typical_p=0.95,
+        do_sample=True,
+        seed=i,
+    )
+
+
+def make_pb_batch(
+    batch_id: int,
+    batch_size: int,
+    seq_len: int,
+    mix: str = "mixed",
+    first_request_id: int = 0,
+) -> generate_pb2.Batch:
+    rng = random.Random(batch_id)
+    requests = []
+    for i in range(batch_size):
+        text = " ".join(
+            f"w{t}" for t in random_token_ids(rng, seq_len, BATCH_VOCAB_SIZE)
+        )
+        requests.append(
+            generate_pb2.Request(
+                id=first_request_id + i,
+                inputs=text,
+                input_chunks=generate_pb2.Input(
+                    chunks=[generate_pb2.InputChunk(text=text)]
+                ),
+                truncate=seq_len,
+                parameters=chooser_parameters(mix, i),
+                stopping_parameters=generate_pb2.StoppingCriteriaParameters(
+                    max_new_tokens=MAX_NEW_TOKENS, stop_sequences=["w4 w5"]
+                ),
+                top_n_tokens=5 if i % 4 == 0 else 0,
+            )
+        )
+    return generate_pb2.Batch(id=batch_id, requests=requests, size=batch_size)
+
+
+def random_past(batch_size: int, *lengths: int) -> List[List[torch.Tensor]]:
+    """One `[batch_size, NUM_HEADS, length, HEAD_DIM]` tensor per length and layer."""
+    return [
+        [
+            torch.randn(batch_size, NUM_HEADS, length, HEAD_DIM, dtype=DTYPE)
+            for length in lengths
+        ]
+        for _ in range(NUM_LAYERS)
+    ]
+
+
+def next_input_ids(batch_size: int) -> torch.Tensor:
+    return torch.randint(len(SPECIAL_TOKENS), BATCH_VOCAB_SIZE, (batch_size, 1))
+
+
+# The `*_decode_state` helpers update a batch fresh out of `from_pb` the way the
+# first `generate_token` call would, so that `filter` and `concatenate` see the
+# same state as in a running server.
+
+
+def causal_lm_decode_state(batch: CausalLMBatch) -> CausalLMBatch:
+    batch.past_key_values = random_past(
+        len(batch), batch.max_input_length, batch.max_input_length
+    )
+    batch.input_ids = next_input_ids(len(batch))
+    batch.attention_mask[:, -batch.padding_right_offset] = 1
+    batch.padding_right_offset -= 1
+    batch.position_ids = batch.position_ids[:, -1:] + 1
+    batch.input_lengths = [length + 1 for length in batch.input_lengths]
+    batch.max_input_length += 1
+    return batch
+
+
+def seq2seq_lm_decode_state(batch: Seq2SeqLMBatch) -> Seq2SeqLMBatch:
+    batch.past_key_values = random_past(
+        len(batch),
+        batch.max_decoder_input_length,
+        batch.max_decoder_input_length,
+        batch.max_input_length,
+        batch.max_input_length,
+    )
+    batch.encoder_last_hidden_state = torch.randn(
+        len(batch), batch.max_input_length, NUM_HEADS * HEAD_DIM, dtype=DTYPE
+    )
+    batch.input_ids = None
+    batch.decoder_input_ids = next_input_ids(len(batch))
+    batch.decoder_input_lengths = [length + 1 for length in batch.decoder_input_lengths]
+    batch.max_decoder_input_length += 1
+    batch.padding_right_offset -= 1
+    return batch
+
+
+def mamba_decode_state(batch: "MambaBatch") -> "MambaBatch":
+    batch.inference_params = new_inference_params(
+        n_blocks=NUM_LAYERS,
+        batch_size=len(batch),
+        d_inner=MAMBA_D_INNER,
+        d_conv=MAMBA_D_CONV,
+        d_state=MAMBA_D_STATE,
+        seqlen_offset=batch.max_input_length,
+        dtype=DTYPE,
+        device=DEVICE,
+    )
+    batch.input_ids = next_input_ids(len(batch))
+    batch.input_lengths = [length + 1 for length in batch.input_lengths]
+    batch.max_input_length += 1
+    return batch
+
+
+def flash_decode_state(batch: "FlashCausalLMBatch") -> "FlashCausalLMBatch":
+    batch.prepare_for_prefill()
+    indices = batch.cu_seqlen_prefill[1:] - 1
+    batch.position_ids = batch.position_ids[indices] + 1
+    batch.slot_indices = batch.slot_indices[indices] + 1
+    batch.adapter_meta.adapter_indices = batch.adapter_meta.adapter_indices[indices]
+    batch.adapter_meta.adapter_segments = segment_bounds(
+        batch.adapter_meta.adapter_indices, len(batch.adapter_meta.segment_indices)
+    )
+    batch.input_ids = next_input_ids(len(batch)).view(-1)
+    batch.cache_lengths_tensor += batch.input_lengths_tensor
+    batch.input_lengths_tensor = torch.ones_like(batch.input_lengths_tensor)
+    for i, input_length in enumerate(batch.input_lengths):
+        batch.cache_lengths[i] += input_length
+        batch.input_lengths[i] = 1
+        batch.max_current_length = max(
+            batch.max_current_length, batch.cache_lengths[i] + 1
+        )
+    batch.prefilling = False
+    batch.prefilling_mask = [False] * len(batch)
+    batch.cu_seqlen_prefill = None
+    batch.prefill_cache_indices = None
+    batch.prefill_cu_outlens = None
+    batch.prefill_head_indices = None
+    batch.prefill_next_token_indices = None
+    return batch
+
+
+# A benchmark returns `(run, setup)`: `setup()` builds a fresh input before every
+# iteration, outside of the timed region, and `run(setup())` is timed.
+Benchmark = Tuple[Callable, Optional[Callable]]
+
+
+def bench_next_token_chooser(
+    batch_size: int, vocab_size: int, speculate: int, mix: str
+) -> Benchmark:
+    tokenizer = make_tokenizer(vocab_size)
+    chooser = HeterogeneousNextTokenChooser.from_pb(
+        [chooser_parameters(mix, i) for i in range(batch_size)],
+        DTYPE,
+        DEVICE,
+        tokenizer,
+    )
+    input_ids = torch.randint(len(SPECIAL_TOKENS), vocab_size, (batch_size, 256))
+    scores = torch.randn(batch_size * (speculate + 1), vocab_size, dtype=DTYPE)
+    speculated_ids = (
+        torch.randint(len(SPECIAL_TOKENS), vocab_size, (batch_size, speculate))
+        if speculate > 0
+        else None
+    )
+
+    def run(scores):
+        chooser(input_ids, scores, speculate, speculated_ids)
+
+    # Warpers update the scores in place
+    return run, scores.clone
+
+
+def bench_batch_top_tokens(
+    batch_size: int, vocab_size: int, speculate: int
+) -> Benchmark:
+    top_n_tokens = [5] * batch_size
+    top_n_tokens_tensor = torch.tensor(top_n_tokens, dtype=torch.int64)
+    logprobs = torch.log_softmax(
+        torch.randn(batch_size * (speculate + 1), vocab_size, dtype=DTYPE), -1
+    )
+    accepted_ids = torch.randint(1, speculate + 2, (batch_size,))
+
+    def run(_):
+        batch_top_tokens(top_n_tokens, top_n_tokens_tensor, logprobs, accepted_ids)
+
+    return run, None
+
+
+def bench_stopping_criteria(batch_size: int) -> Benchmark:
+    tokenizer = make_tokenizer(BATCH_VOCAB_SIZE)
+    pb = make_pb_batch(0, batch_size, 1)
+    rng = random.Random(0)
+    token_ids = random_token_ids(rng, batch_size, BATCH_VOCAB_SIZE)
+    texts = [f" w{token_id}" for token_id in token_ids]
+
+    def setup():
+        return [
+            StoppingCriteria.from_pb(r.stopping_parameters, tokenizer)
+            for r in pb.requests
+        ]
+
+    def run(stopping_criterias):
+        for stopping_criteria, token_id, text in zip(
+            stopping_criterias, token_ids, texts
+        ):
+            stopping_criteria(token_id, text)
+
+    return run, setup
+
+
+def bench_decode_token(batch_size: int, seq_len: int) -> Benchmark:
+    # `decode_token` only uses the tokenizer of the model
+    model = SimpleNamespace(tokenizer=make_tokenizer(BATCH_VOCAB_SIZE))
+    rng = random.Random(0)
+    all_input_ids = [
+        random_token_ids(rng, seq_len, BATCH_VOCAB_SIZE) for _ in range(batch_size)
+    ]
+
+    def run(_):
+        for input_ids in all_input_ids:
+            Model.decode_token(model, input_ids, seq_len - 6, seq_len - 1)
+
+    return run, None
+
+
+def batch_benchmarks(
+    batch_type, decode_state: Callable
+) -> Dict[str, Callable[..., Benchmark]]:
+    """`from_pb`, `filter` and `concatenate` benchmarks for `batch_type`.
+
+    `filter` drops one finished request from a running batch and `concatenate`
+    adds a freshly prefilled batch of `batch_size // 4` requests to it.
+    """
+    tokenizer = make_tokenizer(BATCH_VOCAB_SIZE)
+
+    def from_pb(pb):
+        return batch_type.from_pb(pb, tokenizer, DTYPE, DEVICE)
+
+    def bench_from_pb(batch_size: int, seq_len: int, speculate: int = 0) -> Benchmark:
+        set_speculate(speculate)
+        pb = make_pb_batch(0, batch_size, seq_len)
+
+        def setup():
+            # `from_pb` mutates the requests of the protobuf batch
+            batch = generate_pb2.Batch()
+            batch.CopyFrom(pb)
+            return batch
+
+        return from_pb, setup
+
+    def bench_filter(batch_size: int, seq_len: int, speculate: int = 0) -> Benchmark:
+        set_speculate(speculate)
+        pb = make_pb_batch(0, batch_size, seq_len)
+        request_ids = [r.id for r in pb.requests[1:]]
+
+        def run(batch):
+            batch.filter(request_ids)
+
+        return run, lambda: decode_state(from_pb(pb))
+
+    def bench_concatenate(
+        batch_size: int, seq_len: int, speculate: int = 0
+    ) -> Benchmark:
+        set_speculate(speculate)
+        running = make_pb_batch(0, batch_size, seq_len)
+        new = make_pb_batch(
+            1, max(batch_size // 4, 1), seq_len // 2, first_request_id=batch_size
+        )
+
+        def setup():
+            return [decode_state(from_pb(running)), decode_state(from_pb(new))]
+
+        return batch_type.concatenate, setup
+
+    return {
+        "from_pb": bench_from_pb,
+        "filter": bench_filter,
+        "concatenate": bench_concatenate,
+    }
+
+
+# name -> (sweep axes, benchmark factory)
+BENCHMARKS: Dict[str, Tuple[Tuple[str, ...], Callable[..., Benchmark]]] = {
+    "next_token_chooser": (
+        ("batch_size", "vocab_size", "speculate", "mix"),
+        bench_next_token_chooser,
+    ),
+    "batch_top_tokens": (
+        ("batch_size", "vocab_size", "speculate"),
+        bench_batch_top_tokens,
+    ),
+    "stopping_criteria": (("batch_size",), bench_stopping_criteria),
+    "decode_token": (("batch_size", "seq_len"), bench_decode_token),
+}
+
+_BATCH_TYPES = [
+    ("causal_lm", CausalLMBatch, causal_lm_decode_state),
+    ("seq2seq_lm", Seq2SeqLMBatch, seq2seq_lm_decode_state),
+    ("mamba", MambaBatch, mamba_decode_state),
+    ("flash_causal_lm", FlashCausalLMBatch, flash_decode_state),
+]
+for _prefix, _batch_type, _decode_state in _BATCH_TYPES:
+    if _batch_type is None:
+        continue
+    # Speculation only changes the allocation of flash batches
+    _axes = ("batch_size", "seq_len")
+    if _prefix == "flash_causal_lm":
+        _axes += ("speculate",)
+    for _name, _factory in batch_benchmarks(_batch_type, _decode_state).items():
+        BENCHMARKS[f"{_prefix}.{_name}"] = (_axes, _factory)
+
+
+def measure(
+    run: Callable,
+    setup: Optional[Callable],
+    min_time: float,
+    min_iterations: int,
+    max_iterations: int,
+    warmup: int,
+) -> List[float]:
+    timings = []
+    total = 0.0
+    for i in range(warmup + max_iterations):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        run(state)
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        timings.append(elapsed)
+        total += elapsed
+        if len(timings) >= min_iterations and total >= min_time:
+            break
+    return timings
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    timings = sorted(timings)
+    return {
+        "iterations": len(timings),
+        "mean_us": statistics.mean(timings) * 1e6,
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p90_us": timings[int(len(timings) * 0.9)] * 1e6,
+        "min_us": timings[0] * 1e6,
+    }
+
+
+def case_key(name: str, params: Dict) -> str:
+    return name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+
+def metadata() -> Dict:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "git_revision": revision,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results: List[Dict], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {
+            case_key(r["name"], r["params"]): r for r in json.load(f)["results"]
+        }
+    print(f"\n{'case':<70} {'baseline':>10} {'current':>10} {'ratio':>7}  (p50 us)")
+    for result in results:
+        key = case_key(result["name"], result["params"])
+        if key not in baseline:
+            continue
+        before = baseline[key]["p50_us"]
+        after = result["p50_us"]
+        print(f"{key:<70} {before:>10.1f} {after:>10.1f} {after / before:>7.2f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmarks", nargs="+", default=None)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[32000, 128256])
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[128, 1024])
+    parser.add_argument("--speculate", type=int, nargs="+", default=[0, 2])
+    parser.add_argument("--mixes", nargs="+", default=["greedy", "mixed"])
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--min-iterations", type=int, default=5)
+    parser.add_argument("--max-iterations", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args(argv)
+
+    if FlashCausalLMBatch is None:
+        print(f"Skipping flash_causal_lm: {FLASH_IMPORT_ERROR}", file=sys.stderr)
+    if MambaBatch is None:
+        print(f"Skipping mamba: {MAMBA_IMPORT_ERROR}", file=sys.stderr)
+
+    if args.list:
+        for name, (axes, _) in BENCHMARKS.items():
+            print(f"{name}: {', '.join(axes)}")
+        return
+
+    names = args.benchmarks if args.benchmarks is not None else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+
+    sweep = {
+        "batch_size": args.batch_sizes,
+        "vocab_size": args.vocab_sizes,
+        "seq_len": args.seq_lens,
+        "speculate": args.speculate,
+        "mix": args.mixes,
+    }
+
+    results = []
+    for name in names:
+        axes, factory = BENCHMARKS[name]
+        for values in itertools.product(*(sweep[axis] for axis in axes)):
+            params = dict(zip(axes, values))
+            # `filter` and `concatenate` need at least two requests
+            if params.get("batch_size") == 1 and name.endswith(
+                (".filter", ".concatenate")
+            ):
+                continue
+            run, setup = factory(**params)
+            timings = measure(
+                run,
+                setup,
+                args.min_time,
+                args.min_iterations,
+                args.max_iterations,
+                args.warmup,
+            )
+            result = {"name": name, "params": params, **summarize(timings)}
+            results.append(result)
+            print(
+                f"{case_key(name, params):<70} p50={result['p50_us']:10.1f}us "
+                f"mean={result['mean_us']:10.1f}us n={result['iterations']}"
+            )
+    set_speculate(0)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
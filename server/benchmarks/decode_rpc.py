@@ -0,0 +1,190 @@
+"""Compare the fixed per-step cost of unary `Decode` calls and the `DecodeStream` RPC.
+
+The shard is served over a local unix socket with a model stub that returns
+immediately, so the measured time is the RPC overhead alone (interceptors,
+message allocation, serialization and socket round trip).
+
+    python benchmarks/decode_rpc.py --batch-size 1 --steps 2000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from typing import List, Optional
+
+os.environ.setdefault("ATTENTION", "paged")
+os.environ.setdefault("PREFIX_CACHING", "0")
+
+import torch  # noqa: E402
+
+from grpc import aio  # noqa: E402
+
+from text_generation_server.cache import Cache  # noqa: E402
+from text_generation_server.executor import ModelExecutor  # noqa: E402
+from text_generation_server.interceptor import ExceptionInterceptor  # noqa: E402
+from text_generation_server.models.types import (  # noqa: E402
+    Batch,
+    Generation,
+    Tokens,
+)
+from text_generation_server.pb import generate_pb2, generate_pb2_grpc  # noqa: E402
+from text_generation_server.server import TextGenerationService  # noqa: E402
+from text_generation_server.tracing import (  # noqa: E402
+    UDSOpenTelemetryAioServerInterceptor,
+)
+
+
+class StubBatch(Batch):
+    def __init__(self, batch_id: int, request_ids: List[int]):
+        self.batch_id = batch_id
+        self.request_ids = request_ids
+
+    def to_pb(self) -> generate_pb2.CachedBatch:
+        return generate_pb2.CachedBatch(
+            id=self.batch_id,
+            request_ids=self.request_ids,
+            size=len(self),
+            max_tokens=len(self),
+            current_tokens=len(self),
+        )
+
+    @classmethod
+    def from_pb(cls, pb, tokenizer, dtype, device) -> "StubBatch":
+        return cls(pb.id, [r.id for r in pb.requests])
+
+    def filter(self, request_ids: List[int]) -> "StubBatch":
+        return StubBatch(self.batch_id, request_ids)
+
+    @classmethod
+    def concatenate(cls, batches: List["StubBatch"]) -> "StubBatch":
+        request_ids = [i for batch in batches for i in batch.request_ids]
+        return cls(batches[0].batch_id, request_ids)
+
+    def __len__(self):
+        return len(self.request_ids)
+
+
+class StubModel:
+    """Model that generates token 0 for every request without any compute."""
+
+    batch_type = StubBatch
+    support_chunking = False
+    quantize = None
+    device = torch.device("cpu")
+    rank = 0
+    world_size = 1
+    adapter_manager = None
+    support_packed_generations = False
+    tokenizer = None
+    dtype = torch.float32
+    info = generate_pb2.InfoResponse(
+        requires_padding=False, dtype="torch.float32", device_type="cpu"
+    )
+
+    def generate_token(self, batch: StubBatch):
+        generations = [
+            Generation(
+                request_id,
+                None,
+                Tokens([0], [-0.1], ["a"], [False]),
+                None,
+                None,
+            )
+            for request_id in batch.request_ids
+        ]
+        return generations, batch, (0, 0)
+
+
+async def run(batch_size: int, steps: int, warmup: int, socket: str):
+    executor = ModelExecutor(torch.device("cpu"))
+    server = aio.server(
+        interceptors=[
+            ExceptionInterceptor(lambda: None),
+            UDSOpenTelemetryAioServerInterceptor(),
+        ]
+    )
+    generate_pb2_grpc.add_TextGenerationServiceServicer_to_server(
+        TextGenerationService(StubModel(), Cache(), [socket], executor), server
+    )
+    server.add_insecure_port(socket)
+    await server.start()
+
+    batch = generate_pb2.Batch(
+        id=0,
+        requests=[generate_pb2.Request(id=i) for i in range(batch_size)],
+        size=batch_size,
+    )
+
+    async with aio.insecure_channel(socket) as channel:
+        stub = generate_pb2_grpc.TextGenerationServiceStub(channel)
+        response = await stub.Prefill(generate_pb2.PrefillRequest(batch=batch))
+        cached_batch = response.batch
+
+        async def unary_step(cached_batch):
+            response = await stub.Decode(
+                generate_pb2.DecodeRequest(batches=[cached_batch])
+            )
+            return response.batch
+
+        unary = await measure(unary_step, cached_batch, steps, warmup)
+
+        call = stub.DecodeStream()
+
+        async def stream_step(cached_batch):
+            await call.write(
+                generate_pb2.DecodeStreamRequest(
+                    decode=generate_pb2.DecodeRequest(batches=[cached_batch])
+                )
+            )
+            response = await call.read()
+            return response.decode.batch
+
+        stream = await measure(stream_step, cached_batch, steps, warmup)
+        await call.done_writing()
+
+    await server.stop(None)
+    executor.shutdown()
+
+    print(f"batch_size={batch_size} steps={steps}")
+    report("unary Decode", unary)
+    report("DecodeStream", stream)
+
+
+async def measure(step, cached_batch, steps: int, warmup: int) -> List[float]:
+    timings = []
+    for i in range(warmup + steps):
+        start = time.perf_counter()
+        cached_batch = await step(cached_batch)
+        if i >= warmup:
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: List[float]):
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2]
+    p99 = timings[int(len(timings) * 0.99)]
+    print(
+        f"{name:>14}: mean={statistics.mean(timings) * 1e6:8.1f}us "
+        f"p50={p50 * 1e6:8.1f}us p99={p99 * 1e6:8.1f}us"
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        socket = f"unix://{tmpdir}/text-generation-server-bench"
+        asyncio.run(run(args.batch_size, args.steps, args.warmup, socket))
+
+
+if __name__ == "__main__":
+    main()
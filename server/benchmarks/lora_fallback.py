@@ -0,0 +1,166 @@
+"""Benchmark of the LoRA layers on devices without the punica SGMV kernels.
+
+Compares the previous fallback, which runs every adapter on the whole batch and
+masks the rows of the other adapters, with the grouped path, which runs each
+adapter on its own rows only. Rows are assigned to the adapters either
+interleaved (round robin, rows must be sorted) or grouped (contiguous, as after a
+concatenation of single adapter batches).
+
+    python benchmarks/lora_fallback.py --adapters 1 8 64 --rows 64 1024
+"""
+
+import argparse
+import itertools
+import statistics
+import time
+
+from typing import Callable, List
+from unittest.mock import Mock
+
+import torch
+
+from text_generation_server.adapters import AdapterBatchData, AdapterBatchMetadata
+from text_generation_server.adapters.lora import LoraConfig, LoraWeights
+from text_generation_server.adapters.weights import LayerAdapterWeights
+from text_generation_server.layers.lora import LoraLinear
+from text_generation_server.utils.segments import find_segments
+
+
+def make_adapter_data(
+    num_adapters: int,
+    rows: int,
+    layout: str,
+    hidden_size: int,
+    rank: int,
+    dtype: torch.dtype,
+) -> AdapterBatchData:
+    layer_weights = LayerAdapterWeights()
+    config = LoraConfig(
+        base_model_name_or_path=None,
+        r=rank,
+        target_modules=["q_proj"],
+        fan_in_fan_out=False,
+        lora_alpha=rank,
+        use_rslora=False,
+    )
+    for adapter_index in range(1, num_adapters + 1):
+        weights_a = [torch.randn(hidden_size, rank, dtype=dtype) / hidden_size**0.5]
+        weights_b = [torch.randn(rank, hidden_size, dtype=dtype) / rank**0.5]
+        layer_weights.add_adapter(
+            adapter_index, LoraWeights(weights_a, weights_b, config)
+        )
+
+    if layout == "interleaved":
+        adapter_indices = [1 + i % num_adapters for i in range(rows)]
+    else:
+        adapter_indices = [1 + i * num_adapters // rows for i in range(rows)]
+    segments, segment_indices = find_segments(adapter_indices)
+    meta = AdapterBatchMetadata(
+        adapter_indices=torch.tensor(adapter_indices),
+        adapter_set=set(adapter_indices),
+        adapter_segments=torch.tensor(segments, dtype=torch.int32),
+        segment_indices=segment_indices,
+    )
+    data = layer_weights.get_data(meta, prefill=False, prefill_head_indices=None)
+    return AdapterBatchData(meta=meta, data={"q_proj": data}, prefill=False)
+
+
+def masked(
+    result: torch.Tensor, input: torch.Tensor, adapter_data: AdapterBatchData
+) -> torch.Tensor:
+    # The fallback of `LoraLinear.forward_layer_type` before the grouped path
+    data = adapter_data.data["q_proj"]
+    for adapter_index in adapter_data.meta.adapter_set:
+        adapter_mask = (
+            (adapter_data.meta.adapter_indices == adapter_index)
+            .to(input.dtype)
+            .view(-1, 1)
+        )
+        lora_a = data.lora_a[adapter_index][0]
+        lora_b = data.lora_b[adapter_index][0]
+        result += ((input @ lora_a) @ lora_b) * adapter_mask
+    return result
+
+
+def measure(fn: Callable[[], None], min_time: float, warmup: int) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time or len(timings) < 5:
+        step = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - step)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--adapters", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--rows", type=int, nargs="+", default=[64, 1024])
+    parser.add_argument("--layouts", nargs="+", default=["interleaved", "grouped"])
+    parser.add_argument("--hidden-size", type=int, default=4096)
+    parser.add_argument("--rank", type=int, default=16)
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+    torch.manual_seed(0)
+    dtype = getattr(torch, args.dtype)
+    layer = LoraLinear(torch.nn.Identity(), 0, Mock(size=Mock(return_value=1)))
+
+    print(
+        f"{'adapters':>8} {'rows':>6} {'layout':>12} {'masked':>12} "
+        f"{'grouped':>12} {'speedup':>8}"
+    )
+    for num_adapters, rows, layout in itertools.product(
+        args.adapters, args.rows, args.layouts
+    ):
+        if num_adapters > rows:
+            continue
+        adapter_data = make_adapter_data(
+            num_adapters, rows, layout, args.hidden_size, args.rank, dtype
+        )
+        if adapter_data.data["q_proj"].groups is None:
+            parser.error("this device runs the LoRA kernels, not the fallback")
+        input = torch.randn(rows, args.hidden_size, dtype=dtype)
+        result = torch.zeros(rows, args.hidden_size, dtype=dtype)
+
+        def run_grouped():
+            layer.forward_layer_type(
+                result, input, adapter_data, "q_proj", 0, args.hidden_size
+            )
+
+        def run_masked():
+            masked(result, input, adapter_data)
+
+        expected = masked(torch.zeros_like(result), input, adapter_data)
+        actual = layer.forward_layer_type(
+            torch.zeros_like(result),
+            input,
+            adapter_data,
+            "q_proj",
+            0,
+            args.hidden_size,
+        )
+        torch.testing.assert_close(actual, expected, rtol=1e-3, atol=1e-3)
+
+        masked_ms = 1e3 * statistics.median(
+            measure(run_masked, args.min_time, args.warmup)
+        )
+        grouped_ms = 1e3 * statistics.median(
+            measure(run_grouped, args.min_time, args.warmup)
+        )
+        print(
+            f"{num_adapters:>8} {rows:>6} {layout:>12} {masked_ms:>10.3f}ms "
+            f"{grouped_ms:>10.3f}ms {masked_ms / grouped_ms:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Benchmark of the MoE layer used when no fused MoE kernels are available.
+
+Compares the previous dense path, which applies every expert to every token and
+weights the outputs by the routing, with the sorted path, which groups the
+tokens by selected expert and applies each expert to its own tokens only.
+
+    python benchmarks/moe_fallback.py --experts 8 64 --topk 2 8 --tokens 16 512
+"""
+
+import argparse
+import itertools
+import statistics
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Callable, List
+from unittest.mock import Mock
+
+import torch
+from safetensors.torch import save_file
+
+from text_generation_server.layers.moe import DenseMoELayer
+from text_generation_server.utils.weights import (
+    DefaultWeightsLoader,
+    UnquantizedWeight,
+    Weights,
+)
+
+
+def make_layer(
+    directory: str,
+    n_experts: int,
+    topk: int,
+    hidden_size: int,
+    intermediate_size: int,
+    dtype: torch.dtype,
+) -> DenseMoELayer:
+    tensors = {}
+    for i in range(n_experts):
+        for name, shape in [
+            ("gate_proj", (intermediate_size, hidden_size)),
+            ("up_proj", (intermediate_size, hidden_size)),
+            ("down_proj", (hidden_size, intermediate_size)),
+        ]:
+            tensors[f"experts.{i}.{name}.weight"] = (
+                torch.randn(shape, dtype=dtype) / shape[1] ** 0.5
+            )
+    filename = Path(directory) / f"experts-{n_experts}.safetensors"
+    save_file(tensors, filename)
+    weights = Weights(
+        [filename],
+        device=torch.device("cpu"),
+        dtype=dtype,
+        process_group=Mock(size=Mock(return_value=1), rank=Mock(return_value=0)),
+        weights_loader=DefaultWeightsLoader(UnquantizedWeight),
+    )
+    return DenseMoELayer(
+        n_expert_group=None,
+        n_experts=n_experts,
+        prefix="experts",
+        renormalize=True,
+        topk=topk,
+        topk_group=None,
+        weights=weights,
+    )
+
+
+def measure(fn: Callable[[], None], min_time: float, warmup: int) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time or len(timings) < 5:
+        step = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - step)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--experts", type=int, nargs="+", default=[8, 64])
+    parser.add_argument("--topk", type=int, nargs="+", default=[2, 8])
+    parser.add_argument("--tokens", type=int, nargs="+", default=[16, 512])
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--intermediate-size", type=int, default=512)
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+    torch.manual_seed(0)
+    dtype = getattr(torch, args.dtype)
+
+    print(
+        f"{'experts':>8} {'topk':>5} {'tokens':>6} {'dense':>12} "
+        f"{'sorted':>12} {'speedup':>8}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for n_experts in args.experts:
+            layer = None
+            for topk, tokens in itertools.product(args.topk, args.tokens):
+                if topk > n_experts:
+                    continue
+                if layer is None or layer.topk != topk:
+                    layer = make_layer(
+                        directory,
+                        n_experts,
+                        topk,
+                        args.hidden_size,
+                        args.intermediate_size,
+                        dtype,
+                    )
+                x = torch.randn(tokens, args.hidden_size, dtype=dtype)
+                # The routing of `DenseMoELayer.forward`, without the fused kernels
+                gating_output = torch.randn(tokens, n_experts)
+                topk_weights, topk_ids = torch.topk(
+                    gating_output.softmax(dim=-1), topk, dim=-1
+                )
+                topk_weights /= topk_weights.sum(dim=-1, keepdim=True)
+
+                def run_dense():
+                    layer._apply_all_experts(x, topk_weights, topk_ids)
+
+                def run_sorted():
+                    layer._apply_selected_experts(x, topk_weights, topk_ids)
+
+                torch.testing.assert_close(
+                    layer._apply_selected_experts(x, topk_weights, topk_ids),
+                    layer._apply_all_experts(x, topk_weights, topk_ids),
+                    rtol=1e-3,
+                    atol=1e-3,
+                )
+
+                dense_ms = 1e3 * statistics.median(
+                    measure(run_dense, args.min_time, args.warmup)
+                )
+                sorted_ms = 1e3 * statistics.median(
+                    measure(run_sorted, args.min_time, args.warmup)
+                )
+                print(
+                    f"{n_experts:>8} {topk:>5} {tokens:>6} {dense_ms:>10.3f}ms "
+                    f"{sorted_ms:>10.3f}ms {dense_ms / sorted_ms:>7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""End to end throughput of a shard serving the `synthetic` model.
+
+A shard is started with `text-generation-server serve synthetic` on a unix socket,
+so no GPU and no download is needed, and is driven by `MiniRouter`: a Python
+stand-in for the router running the same continuous batching loop. Queued requests
+are prefilled as a new batch that is then decoded together with the running
+batch, and finished requests are filtered out of the running batch.
+
+Closed loop clients send requests with a fixed prompt length and number of new
+tokens, and tokens/s, time to first token (TTFT) and inter token latency (ITL)
+are reported for each concurrency level:
+
+    python benchmarks/synthetic_e2e.py --concurrency 1 4 16 --requests 64
+
+The size of the synthetic model is set with SYNTHETIC_MODEL_CONFIG, see
+`text_generation_server.models.synthetic`.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from grpc import aio
+
+from text_generation_server.pb import generate_pb2, generate_pb2_grpc
+
+GREEDY = generate_pb2.NextTokenChooserParameters(
+    temperature=1.0,
+    repetition_penalty=1.0,
+    top_k=0,
+    top_p=1.0,
+    typical_p=1.0,
+    do_sample=False,
+)
+
+
+@dataclass
+class RequestState:
+    id: int
+    prompt: str
+    max_new_tokens: int
+    queued_at: float
+    done: asyncio.Future
+    blocks: List[int] = field(default_factory=list)
+    token_times: List[float] = field(default_factory=list)
+
+    def to_pb(self, block_size: int) -> generate_pb2.Request:
+        slots = [
+            slot
+            for block in self.blocks
+            for slot in range(block * block_size, (block + 1) * block_size)
+        ]
+        return generate_pb2.Request(
+            id=self.id,
+            inputs=self.prompt,
+            input_chunks=generate_pb2.Input(
+                chunks=[generate_pb2.InputChunk(text=self.prompt)]
+            ),
+            truncate=len(self.prompt),
+            parameters=GREEDY,
+            stopping_parameters=generate_pb2.StoppingCriteriaParameters(
+                max_new_tokens=self.max_new_tokens, ignore_eos_token=True
+            ),
+            blocks=self.blocks,
+            slots=slots,
+        )
+
+
+class BlockAllocator:
+    def __init__(self, num_blocks: int, block_size: int):
+        self.block_size = block_size
+        self.free_blocks = list(range(num_blocks))
+
+    def allocate(self, tokens: int) -> Optional[List[int]]:
+        needed = math.ceil(tokens / self.block_size)
+        if needed > len(self.free_blocks):
+            return None
+        blocks = self.free_blocks[-needed:]
+        del self.free_blocks[-needed:]
+        return blocks
+
+    def free(self, blocks: List[int]):
+        self.free_blocks.extend(blocks)
+
+
+class MiniRouter:
+    """Continuous batching over the shard RPCs, without any tokenization."""
+
+    def __init__(
+        self,
+        stub: generate_pb2_grpc.TextGenerationServiceStub,
+        info: generate_pb2.InfoResponse,
+        max_batch_size: int,
+        allocator: Optional[BlockAllocator],
+    ):
+        self.stub = stub
+        self.info = info
+        self.max_batch_size = max_batch_size
+        self.allocator = allocator
+        self.queue: Deque[RequestState] = collections.deque()
+        # Requests in the running batch
+        self.running: Dict[int, RequestState] = {}
+        self.wakeup = asyncio.Event()
+        self.next_request_id = 0
+        self.next_batch_id = 0
+
+    async def generate(self, prompt: str, max_new_tokens: int) -> RequestState:
+        state = RequestState(
+            id=self.next_request_id,
+            prompt=prompt,
+            max_new_tokens=max_new_tokens,
+            queued_at=time.perf_counter(),
+            done=asyncio.get_running_loop().create_future(),
+        )
+        self.next_request_id += 1
+        self.queue.append(state)
+        self.wakeup.set()
+        return await state.done
+
+    def _next_batch(self) -> Optional[generate_pb2.Batch]:
+        requests = []
+        max_tokens = 0
+        while self.queue and len(self.running) < self.max_batch_size:
+            state = self.queue[0]
+            tokens = len(state.prompt) + state.max_new_tokens + self.info.speculate
+            if self.allocator is not None:
+                blocks = self.allocator.allocate(tokens)
+                if blocks is None:
+                    if not self.running:
+                        raise RuntimeError(
+                            f"A request of {tokens} tokens does not fit in the KV cache"
+                        )
+                    break
+                state.blocks = blocks
+            self.queue.popleft()
+            self.running[state.id] = state
+            requests.append(state.to_pb(self.info.block_size))
+            max_tokens += tokens
+        if not requests:
+            return None
+
+        batch = generate_pb2.Batch(
+            id=self.next_batch_id,
+            requests=requests,
+            size=len(requests),
+            max_tokens=max_tokens,
+            max_blocks=max(len(r.blocks) for r in requests),
+        )
+        self.next_batch_id += 1
+        return batch
+
+    async def _handle(
+        self,
+        generations: List[generate_pb2.Generation],
+        batch: Optional[generate_pb2.CachedBatch],
+    ) -> Optional[generate_pb2.CachedBatch]:
+        """Record the generated tokens and filter the finished requests out."""
+        now = time.perf_counter()
+        for generation in generations:
+            state = self.running[generation.request_id]
+            state.token_times.extend([now] * len(generation.tokens.ids))
+            if generation.HasField("generated_text"):
+                del self.running[state.id]
+                if self.allocator is not None:
+                    self.allocator.free(state.blocks)
+                state.done.set_result(state)
+
+        if batch is None:
+            return None
+        keep = [i for i in batch.request_ids if i in self.running]
+        if len(keep) == len(batch.request_ids):
+            return batch
+        if not keep:
+            await self.stub.ClearCache(generate_pb2.ClearCacheRequest(id=batch.id))
+            return None
+        response = await self.stub.FilterBatch(
+            generate_pb2.FilterBatchRequest(batch_id=batch.id, request_ids=keep)
+        )
+        return response.batch
+
+    async def run(self):
+        batch = None
+        while True:
+            if batch is None and not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            batches = [batch] if batch is not None else []
+            new_batch = self._next_batch()
+            if new_batch is not None:
+                response = await self.stub.Prefill(
+                    generate_pb2.PrefillRequest(batch=new_batch)
+                )
+                new_batch = await self._handle(
+                    response.generations,
+                    response.batch if response.HasField("batch") else None,
+                )
+                if new_batch is not None:
+                    batches.append(new_batch)
+            if not batches:
+                batch = None
+                continue
+
+            response = await self.stub.Decode(
+                generate_pb2.DecodeRequest(batches=batches)
+            )
+            batch = await self._handle(
+                response.generations,
+                response.batch if response.HasField("batch") else None,
+            )
+
+
+def random_prompt(rng: random.Random, length: int) -> str:
+    # The synthetic tokenizer maps every byte to a token
+    return "".join(rng.choice(string.ascii_lowercase + " ") for _ in range(length))
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": float("nan"), "p90": float("nan"), "p99": float("nan")}
+    values = sorted(values)
+    return {
+        f"p{q}": values[min(int(len(values) * q / 100), len(values) - 1)]
+        for q in (50, 90, 99)
+    }
+
+
+async def run_level(
+    router: MiniRouter,
+    concurrency: int,
+    num_requests: int,
+    input_length: int,
+    max_new_tokens: int,
+) -> Dict:
+    rng = random.Random(concurrency)
+    prompts = [random_prompt(rng, input_length) for _ in range(num_requests)]
+    states = []
+
+    async def client():
+        while prompts:
+            states.append(await router.generate(prompts.pop(), max_new_tokens))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    ttft = [(s.token_times[0] - s.queued_at) * 1e3 for s in states]
+    itl = [
+        (after - before) * 1e3
+        for s in states
+        for before, after in zip(s.token_times, s.token_times[1:])
+    ]
+    generated_tokens = sum(len(s.token_times) for s in states)
+    return {
+        "concurrency": concurrency,
+        "requests": len(states),
+        "duration_s": duration,
+        "tokens_per_s": generated_tokens / duration,
+        "requests_per_s": len(states) / duration,
+        "ttft_ms": percentiles(ttft),
+        "itl_ms": percentiles(itl),
+    }
+
+
+async def wait_for_shard(
+    socket: str, process: subprocess.Popen, timeout: float
+) -> generate_pb2.InfoResponse:
+    deadline = time.monotonic() + timeout
+    path = socket[len("unix://") :]
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Shard exited with code {process.returncode}")
+        if os.path.exists(path):
+            async with aio.insecure_channel(socket) as channel:
+                stub = generate_pb2_grpc.TextGenerationServiceStub(channel)
+                try:
+                    return await stub.Info(generate_pb2.InfoRequest(), timeout=5)
+                except aio.AioRpcError:
+                    pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"Shard did not start in {timeout}s")
+
+
+async def benchmark(args, socket: str, process: subprocess.Popen) -> List[Dict]:
+    info = await wait_for_shard(socket, process, args.startup_timeout)
+    max_total_tokens = args.input_length + args.max_new_tokens
+
+    async with aio.insecure_channel(socket) as channel:
+        stub = generate_pb2_grpc.TextGenerationServiceStub(channel)
+        await stub.ClearCache(generate_pb2.ClearCacheRequest())
+
+        rng = random.Random(0)
+        warmup_requests = [
+            RequestState(
+                id=i,
+                prompt=random_prompt(rng, args.input_length),
+                max_new_tokens=2,
+                queued_at=0.0,
+                done=None,
+            ).to_pb(info.block_size)
+            for i in range(max(args.concurrency))
+        ]
+        warmup = await stub.Warmup(
+            generate_pb2.WarmupRequest(
+                batch=generate_pb2.Batch(
+                    id=0, requests=warmup_requests, size=len(warmup_requests)
+                ),
+                max_input_tokens=args.input_length,
+                max_prefill_tokens=args.input_length * len(warmup_requests),
+                max_total_tokens=max_total_tokens,
+            )
+        )
+
+        allocator = None
+        if not info.requires_padding and warmup.HasField("max_supported_total_tokens"):
+            allocator = BlockAllocator(
+                warmup.max_supported_total_tokens // info.block_size,
+                info.block_size,
+            )
+
+        print(
+            f"device={info.device_type} dtype={info.dtype} "
+            f"attention={info.attention_impl} paged={allocator is not None} "
+            f"input_length={args.input_length} max_new_tokens={args.max_new_tokens}"
+        )
+        print(
+            f"{'concurrency':>11} {'tokens/s':>10} {'req/s':>8} "
+            f"{'ttft p50':>10} {'ttft p99':>10} {'itl p50':>10} {'itl p99':>10}  (ms)"
+        )
+
+        results = []
+        for concurrency in args.concurrency:
+            router = MiniRouter(stub, info, concurrency, allocator)
+            router_task = asyncio.create_task(router.run())
+            num_requests = max(args.requests, concurrency)
+            result = await run_level(
+                router,
+                concurrency,
+                num_requests,
+                args.input_length,
+                args.max_new_tokens,
+            )
+            router_task.cancel()
+            await stub.ClearCache(generate_pb2.ClearCacheRequest())
+            results.append(result)
+            print(
+                f"{concurrency:>11} {result['tokens_per_s']:>10.1f} "
+                f"{result['requests_per_s']:>8.2f} "
+                f"{result['ttft_ms']['p50']:>10.1f} {result['ttft_ms']['p99']:>10.1f} "
+                f"{result['itl_ms']['p50']:>10.1f} {result['itl_ms']['p99']:>10.1f}"
+            )
+        return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--input-length", type=int, default=128)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.setdefault("ATTENTION", "paged")
+    env.setdefault("PREFIX_CACHING", "0")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uds_path = f"{tmpdir}/text-generation-server"
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "text_generation_server.cli",
+                "serve",
+                "synthetic",
+                "--uds-path",
+                uds_path,
+                "--max-input-tokens",
+                str(args.input_length),
+            ],
+            env=env,
+        )
+        try:
+            results = asyncio.run(benchmark(args, f"unix://{uds_path}-0", process))
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
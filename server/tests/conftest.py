@@ -3,7 +3,8 @@ import os
 from text_generation_server.pb import generate_pb2
 
 os.environ["PREFIX_CACHING"] = "1"
-os.environ["ATTENTION"] = "flashinfer"
+# Plain PyTorch attention, the tests run without attention kernels
+os.environ["ATTENTION"] = "torch"
 
 
 @pytest.fixture
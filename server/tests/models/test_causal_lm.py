@@ -352,3 +352,18 @@ def test_batch_concatenate(
         generations[0].generated_text.generated_tokens
         == default_multi_requests_causal_lm_batch.stopping_criterias[0].max_new_tokens
     )
+
+
+def test_causal_lm_score(default_causal_lm, default_pb_request):
+    request = copy(default_pb_request)
+    request.inputs = "Test request"
+    request.input_chunks.chunks[0].text = "Test request"
+    batch_pb = generate_pb2.Batch(id=0, requests=[request], size=1)
+
+    scores = default_causal_lm.score(batch_pb, [])
+
+    assert len(scores) == 1
+    assert scores[0].request_id == request.id
+    assert scores[0].tokens.token_ids == [14402, 2581]
+    assert scores[0].tokens.logprobs[1] < 0
+    assert scores[0].to_pb().scored_tokens == 1
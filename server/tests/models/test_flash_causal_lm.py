@@ -0,0 +1,161 @@
+import math
+import pytest
+
+from text_generation_server.models import flash_causal_lm, get_model, globals
+from text_generation_server.models.globals import BLOCK_SIZE
+from text_generation_server.models.synthetic import SYNTHETIC_MODEL_ID
+from text_generation_server.pb import generate_pb2
+from text_generation_server.utils import prefill_chunking
+
+PROMPT = "The quick brown fox jumps over the lazy dog."
+
+
+@pytest.fixture(scope="session")
+def synthetic_flash_lm():
+    model = get_model(
+        SYNTHETIC_MODEL_ID, None, None, False, None, None, None, None, False, 256
+    )
+    model.init_kv_cache(
+        32,
+        model.num_layers,
+        model.num_kv_heads,
+        model.head_size,
+        model.kv_cache_dtype,
+        model.device,
+    )
+    return model
+
+
+@pytest.fixture
+def flash_pb_request(default_pb_parameters, default_pb_stop_parameters):
+    def pb_request(
+        id: int, blocks, cache_len: int = 0, prompt: str = PROMPT, adapter_id: str = ""
+    ):
+        return generate_pb2.Request(
+            id=id,
+            inputs=prompt,
+            input_chunks=generate_pb2.Input(
+                chunks=[generate_pb2.InputChunk(text=prompt)]
+            ),
+            prefill_logprobs=True,
+            truncate=100,
+            parameters=default_pb_parameters,
+            stopping_parameters=default_pb_stop_parameters,
+            blocks=blocks,
+            slots=[b * BLOCK_SIZE + s for b in blocks for s in range(BLOCK_SIZE)],
+            cache_len=cache_len,
+            adapter_id=adapter_id,
+        )
+
+    return pb_request
+
+
+def pb_batch(id: int, requests) -> generate_pb2.Batch:
+    return generate_pb2.Batch(
+        id=id,
+        requests=requests,
+        size=len(requests),
+        max_tokens=sum(len(r.slots) for r in requests),
+        max_blocks=sum(len(r.blocks) for r in requests),
+    )
+
+
+def test_flash_causal_lm_score(synthetic_flash_lm, flash_pb_request, monkeypatch):
+    model = synthetic_flash_lm
+    monkeypatch.setattr(flash_causal_lm, "REQUEST_LOGPROBS", True)
+    monkeypatch.setattr(prefill_chunking, "MAX_PREFILL_TOKENS", 1024)
+
+    batch = model.batch_type.from_pb(
+        pb_batch(0, [flash_pb_request(0, [1, 2, 3])]),
+        model.tokenizer,
+        model.dtype,
+        model.device,
+    )
+    generations, _, _ = model.generate_token(batch)
+    expected = generations[0].prefill_tokens.logprobs
+
+    # Several chunks of both requests
+    monkeypatch.setattr(prefill_chunking, "MAX_PREFILL_TOKENS", 7)
+    scores = model.score(
+        pb_batch(1, [flash_pb_request(1, [4, 5, 6]), flash_pb_request(2, [7, 8, 9])]),
+        [],
+    )
+
+    for score in scores:
+        assert math.isnan(score.tokens.logprobs[0])
+        assert score.tokens.logprobs[1:] == pytest.approx(expected[1:], abs=1e-5)
+        pb = score.to_pb()
+        assert pb.scored_tokens == len(expected) - 1
+        assert pb.nll == pytest.approx(-sum(expected[1:]), abs=1e-4)
+
+    # The first block is read from the prefix cache written by the previous call
+    cache_len = BLOCK_SIZE
+    (score,) = model.score(
+        pb_batch(2, [flash_pb_request(1, [4, 5, 6], cache_len=cache_len)]), []
+    )
+    logprobs = score.tokens.logprobs
+    assert all(math.isnan(logprob) for logprob in logprobs[: cache_len + 1])
+    assert logprobs[cache_len + 1 :] == pytest.approx(
+        expected[cache_len + 1 :], abs=1e-5
+    )
+    assert score.to_pb().scored_tokens == len(expected) - cache_len - 1
+
+
+def test_flash_causal_lm_score_without_blocks(synthetic_flash_lm, flash_pb_request):
+    with pytest.raises(ValueError, match="blocks"):
+        synthetic_flash_lm.score(pb_batch(0, [flash_pb_request(0, [])]), [])
+
+
+def test_flash_causal_lm_group_by_adapter(
+    synthetic_flash_lm, flash_pb_request, monkeypatch
+):
+    model = synthetic_flash_lm
+    monkeypatch.setattr(prefill_chunking, "MAX_PREFILL_TOKENS", 1024)
+    monkeypatch.setattr(globals, "ADAPTER_TO_INDEX", {"a": 1, "b": 2})
+    prompts = ["Hello world", "The quick brown fox", "Lorem ipsum dolor", "1 2 3 4"]
+    adapters = ["a", "b", "a", "b"]
+
+    def generate(group_adapter_rows: bool, first_block: int):
+        monkeypatch.setattr(flash_causal_lm, "GROUP_ADAPTER_ROWS", group_adapter_rows)
+        tokens = {i: [] for i in range(len(prompts))}
+
+        def step(batch):
+            generations, next_batch, _ = model.generate_token(batch)
+            for generation in generations:
+                tokens[generation.request_id].append(
+                    (generation.tokens.token_ids[0], generation.tokens.logprobs[0])
+                )
+            return next_batch
+
+        batches = []
+        for batch_id, ids in enumerate([[0, 1], [2, 3]]):
+            requests = [
+                flash_pb_request(
+                    i,
+                    [first_block + 2 * i, first_block + 2 * i + 1],
+                    prompt=prompts[i],
+                    adapter_id=adapters[i],
+                )
+                for i in ids
+            ]
+            batch = model.batch_type.from_pb(
+                pb_batch(batch_id, requests), model.tokenizer, model.dtype, model.device
+            )
+            batches.append(step(batch))
+
+        batch = model.batch_type.concatenate(batches)
+        order = [r.id for r in batch.requests]
+        assert batch.requests_idx_mapping == {id: i for i, id in enumerate(order)}
+        for _ in range(3):
+            batch = step(batch)
+        batch = batch.filter([0, 1, 3])
+        for _ in range(3):
+            batch = step(batch)
+        return order, tokens
+
+    grouped_order, grouped_tokens = generate(True, 10)
+    order, tokens = generate(False, 20)
+
+    assert grouped_order == [0, 2, 1, 3]
+    assert order == [0, 1, 2, 3]
+    assert grouped_tokens == tokens
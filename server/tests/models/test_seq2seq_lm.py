@@ -1,3 +1,4 @@
+import math
 import pytest
 import torch
 
@@ -363,3 +364,34 @@ def test_batch_concatenate(
         == default_multi_requests_seq2seq_lm_batch.requests[0].id
     )
     assert generations[0].generated_text.generated_tokens == 7
+
+
+def test_seq2seq_lm_score(default_seq2seq_lm, default_pb_request):
+    model = default_seq2seq_lm
+    request_0 = copy(default_pb_request)
+    request_1 = copy(default_pb_request)
+    request_1.id = 1
+    batch_pb = generate_pb2.Batch(id=0, requests=[request_0, request_1], size=2)
+    # Targets of different lengths are right padded in the same forward
+    targets = ["Test", "Test Test Test"]
+
+    scores = model.score(batch_pb, targets)
+
+    start_id = model.tokenizer.bos_token_id
+    input_ids = model.tokenizer(["Test"], return_tensors="pt")["input_ids"]
+    for score, target in zip(scores, targets):
+        ids = model.tokenizer(target)["input_ids"]
+        logits = model.model(
+            input_ids=input_ids, decoder_input_ids=torch.tensor([[start_id] + ids[:-1]])
+        ).logits
+        expected = logits[0].log_softmax(-1)[torch.arange(len(ids)), ids]
+
+        assert score.tokens.token_ids == [start_id] + ids
+        assert math.isnan(score.tokens.logprobs[0])
+        assert score.tokens.logprobs[1:] == pytest.approx(expected.tolist(), abs=1e-4)
+        pb = score.to_pb()
+        assert pb.scored_tokens == len(ids)
+        assert pb.nll == pytest.approx(-expected.sum().item(), abs=1e-3)
+
+    with pytest.raises(ValueError, match="one target per request"):
+        model.score(batch_pb, targets[:1])
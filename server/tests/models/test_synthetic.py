@@ -0,0 +1,21 @@
+from text_generation_server.models.synthetic import synthetic_tokenizer
+
+
+def test_synthetic_tokenizer_round_trip():
+    tokenizer = synthetic_tokenizer()
+    text = "Hello, wörld"
+
+    input_ids = tokenizer(text)["input_ids"]
+
+    # One token per utf-8 byte and no special tokens added
+    assert len(input_ids) == len(text.encode("utf-8"))
+    assert tokenizer.decode(input_ids) == text
+
+
+def test_synthetic_tokenizer_special_tokens():
+    tokenizer = synthetic_tokenizer()
+
+    assert tokenizer.pad_token_id == 0
+    assert tokenizer.eos_token_id == 1
+    assert tokenizer.bos_token_id == 2
+    assert len(tokenizer) == 4 + 256
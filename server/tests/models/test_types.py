@@ -0,0 +1,72 @@
+from text_generation_server.models.types import (
+    GeneratedText,
+    Generation,
+    PackedGenerations,
+    Score,
+    Tokens,
+)
+from text_generation_server.pb.generate_pb2 import FinishReason
+
+
+def test_packed_generations_from_generations():
+    generations = [
+        Generation(
+            3,
+            None,
+            Tokens([10], [-0.1], ["a "], [False]),
+            None,
+            None,
+        ),
+        Generation(
+            7,
+            None,
+            Tokens([11, 12], [-0.2, -0.3], ["bé", "</s>"], [False, True]),
+            GeneratedText("bé</s>", 2, FinishReason.FINISH_REASON_EOS_TOKEN, None),
+            None,
+        ),
+    ]
+
+    pb = PackedGenerations.from_generations(generations).to_pb()
+
+    assert list(pb.request_ids) == [3, 7]
+    assert list(pb.token_counts) == [1, 2]
+    assert list(pb.token_ids) == [10, 11, 12]
+    assert list(pb.is_special) == [False, False, True]
+    assert list(pb.text_offsets) == [0, 2, 5, 9]
+    assert pb.texts.decode("utf-8") == "a bé</s>"
+
+    # Only the finished request gets a sparse entry
+    assert len(pb.generations) == 1
+    assert pb.generations[0].request_id == 7
+    assert pb.generations[0].generated_text.text == "bé</s>"
+    assert len(pb.generations[0].tokens.ids) == 0
+
+
+def test_packed_generations_empty():
+    pb = PackedGenerations().to_pb()
+
+    assert len(pb.request_ids) == 0
+    assert list(pb.text_offsets) == [0]
+    assert pb.texts == b""
+
+
+def test_tokens_extend():
+    tokens = Tokens([1], [float("nan")], ["<s>"], [True])
+
+    tokens.extend(Tokens([5, 6], [-0.5, -1.0], ["a", "b"], [False, False]))
+
+    assert tokens.token_ids == [1, 5, 6]
+    assert tokens.logprobs[1:] == [-0.5, -1.0]
+    assert tokens.texts == ["<s>", "a", "b"]
+    assert tokens.is_special == [True, False, False]
+
+
+def test_score_to_pb():
+    tokens = Tokens([1, 5, 6], [float("nan"), -0.5, -1.0], ["<s>", "a", "b"], [])
+
+    pb = Score(3, tokens).to_pb()
+
+    assert pb.request_id == 3
+    assert list(pb.tokens.ids) == [1, 5, 6]
+    assert pb.nll == 1.5
+    assert pb.scored_tokens == 2
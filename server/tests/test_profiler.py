@@ -0,0 +1,47 @@
+import time
+
+from pathlib import Path
+
+from text_generation_server.profiler import Profiler
+
+
+def busy_step(duration: float = 0.05):
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        pass
+
+
+def test_profiler_steps(tmp_path):
+    profiler = Profiler(rank=1, output_dir=str(tmp_path))
+
+    capture_dir = profiler.start(steps=2, duration=None)
+    assert Path(capture_dir).parent == tmp_path
+    assert profiler.active
+    busy_step()
+    profiler.step()
+    assert profiler.active
+    busy_step()
+    profiler.step()
+
+    assert not profiler.active
+    files = {path.name for path in Path(capture_dir).iterdir()}
+    assert files == {"trace.json", "python_stacks.folded", "host_memory.txt"}
+    stacks = (Path(capture_dir) / "python_stacks.folded").read_text()
+    assert "busy_step" in stacks
+
+
+def test_profiler_capture_dirs(tmp_path):
+    profiler = Profiler(rank=0, output_dir=str(tmp_path))
+
+    first = profiler.start(steps=None, duration=0.0)
+    profiler.step()
+    assert not profiler.active
+    # Started within the same second
+    second = profiler.start(steps=1, duration=None)
+    profiler.stop(first)
+    assert profiler.active
+    profiler.stop(second)
+
+    assert not profiler.active
+    assert first != second
+    assert first.endswith("-rank-0-1")
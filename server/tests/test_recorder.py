@@ -0,0 +1,38 @@
+from text_generation_server.pb import generate_pb2
+from text_generation_server.recorder import Recorder, read_recording
+
+
+def test_recording_round_trip(tmp_path):
+    path = tmp_path / "recording"
+    info = generate_pb2.InfoResponse(attention_impl="paged", block_size=16)
+    recorder = Recorder(path, info)
+    recorder.record(decode=generate_pb2.DecodeRequest(batches=[{"id": 3}]))
+    recorder.record(filter_batch=generate_pb2.FilterBatchRequest(batch_id=3))
+    recorder.record(clear_cache=generate_pb2.ClearCacheRequest())
+    recorder.close()
+
+    calls = list(read_recording(path))
+
+    assert [call.WhichOneof("request") for call in calls] == [
+        "info",
+        "decode",
+        "filter_batch",
+        "clear_cache",
+    ]
+    assert calls[0].info == info
+    assert calls[1].decode.batches[0].id == 3
+    timestamps = [call.timestamp_ns for call in calls]
+    assert timestamps == sorted(timestamps)
+
+
+def test_truncated_recording(tmp_path):
+    path = tmp_path / "recording"
+    recorder = Recorder(path, generate_pb2.InfoResponse())
+    recorder.record(clear_cache=generate_pb2.ClearCacheRequest(id=1))
+    recorder.close()
+
+    with open(path, "rb+") as f:
+        f.truncate(path.stat().st_size - 1)
+
+    calls = list(read_recording(path))
+    assert len(calls) == 1
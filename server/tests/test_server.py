@@ -0,0 +1,150 @@
+import asyncio
+import pytest
+import threading
+
+from loguru import logger
+from types import SimpleNamespace
+
+from text_generation_server.cache import Cache
+from text_generation_server.executor import ModelExecutor
+from text_generation_server.pb import generate_pb2
+from text_generation_server.server import TextGenerationService
+
+
+class FakeAdapterManager:
+    def __init__(self):
+        self.adapter_to_index = {"adapter": 1}
+        self.unloaded = []
+
+    def prefetch_cold(self, adapter_ids):
+        pass
+
+    def unload(self, adapter_id, in_use):
+        if self.adapter_to_index[adapter_id] in in_use:
+            raise ValueError(f"Adapter {adapter_id} is used by a running batch")
+        self.unloaded.append(adapter_id)
+
+
+def make_service():
+    model = SimpleNamespace(
+        adapter_manager=FakeAdapterManager(),
+        support_chunking=False,
+        device=SimpleNamespace(type="cpu"),
+    )
+    service = TextGenerationService.__new__(TextGenerationService)
+    service.model = model
+    service.cache = Cache()
+    service.executor = ModelExecutor(model.device)
+    service.recorder = None
+    service._adapters_in_flight = {}
+    service._cleared_in_flight = set()
+    service._batches_lock = threading.Lock()
+    return service
+
+
+def block_prefill(service):
+    """Make the prefills of `service` wait on the returned event once started."""
+    prefill_started = threading.Event()
+    release_prefill = threading.Event()
+
+    def prefill(batch_pb, cached_batch):
+        prefill_started.set()
+        release_prefill.wait()
+        batch = SimpleNamespace(
+            batch_id=batch_pb.id,
+            adapter_meta=SimpleNamespace(adapter_set={1}),
+            to_pb=lambda: None,
+        )
+        return [], batch, (0, 0), None
+
+    service._prefill = prefill
+    return prefill_started, release_prefill
+
+
+def prefill_request(batch_id: int) -> generate_pb2.PrefillRequest:
+    request = generate_pb2.Request(id=0, adapter_id="adapter")
+    return generate_pb2.PrefillRequest(
+        batch=generate_pb2.Batch(id=batch_id, requests=[request], size=1)
+    )
+
+
+def test_unload_adapter_of_queued_prefill():
+    service = make_service()
+    prefill_started, release_prefill = block_prefill(service)
+    unload_request = generate_pb2.UnloadAdapterRequest(adapter_id="adapter")
+
+    async def run():
+        prefill_task = asyncio.ensure_future(service.Prefill(prefill_request(3), None))
+        await asyncio.get_running_loop().run_in_executor(None, prefill_started.wait)
+        # Queued behind the prefill, which is not cached yet
+        unload_task = asyncio.ensure_future(service.UnloadAdapter(unload_request, None))
+        await asyncio.sleep(0.01)
+        release_prefill.set()
+        await prefill_task
+        with pytest.raises(ValueError, match="used by a running batch"):
+            await unload_task
+
+        service.cache.clear()
+        await service.UnloadAdapter(unload_request, None)
+
+    try:
+        asyncio.run(run())
+    finally:
+        service.executor.shutdown()
+
+    assert service.model.adapter_manager.unloaded == ["adapter"]
+    assert service._adapters_in_flight == {}
+
+
+def test_clear_cache_during_prefill():
+    service = make_service()
+    prefill_started, release_prefill = block_prefill(service)
+
+    async def run():
+        prefill_task = asyncio.ensure_future(service.Prefill(prefill_request(3), None))
+        await asyncio.get_running_loop().run_in_executor(None, prefill_started.wait)
+        await service.ClearCache(generate_pb2.ClearCacheRequest(), None)
+        release_prefill.set()
+        await prefill_task
+        # The batch of the step running during the clear is dropped
+        assert service.cache.pop(3) is None
+
+        await service.Prefill(prefill_request(4), None)
+        assert service.cache.pop(4) is not None
+
+    try:
+        asyncio.run(run())
+    finally:
+        service.executor.shutdown()
+
+    assert service._cleared_in_flight == set()
+
+
+def test_profile_stop_error_is_logged():
+    service = make_service()
+    stopped = threading.Event()
+
+    def stop(output_dir):
+        stopped.set()
+        raise RuntimeError(f"cannot write {output_dir}")
+
+    service.profiler = SimpleNamespace(start=lambda steps, duration: "/out", stop=stop)
+    messages = []
+    handler = logger.add(messages.append, level="ERROR")
+
+    async def run():
+        assert await service.start_profile(None, 0.0) == "/out"
+        await asyncio.get_running_loop().run_in_executor(None, stopped.wait)
+        # Let the done callback run
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(run())
+    finally:
+        logger.remove(handler)
+        service.executor.shutdown()
+
+    assert len(messages) == 1
+    assert "Could not stop profile capture" in messages[0]
+    assert "cannot write /out" in messages[0]
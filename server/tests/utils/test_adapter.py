@@ -1,4 +1,6 @@
 import pytest
+import torch
+from collections import defaultdict
 from unittest.mock import Mock
 from text_generation_server.utils.adapter import (
     get_attn_weights,
@@ -6,6 +8,27 @@ from text_generation_server.utils.adapter import (
     parse_lora_adapters,
     AdapterInfo,
 )
+from text_generation_server.adapters import AdapterBatchData, AdapterBatchMetadata
+from text_generation_server.adapters.fold import fold_lora_weights
+from text_generation_server.adapters import lora as adapters_lora
+from text_generation_server.adapters.lora import (
+    AdapterGroups,
+    BatchLoraWeights,
+    IPEXBatchLoraWeights,
+    LoraConfig,
+    LoraWeights,
+    RankSegments,
+)
+from text_generation_server.adapters.manager import AdapterManager
+from text_generation_server.adapters.weights import LayerAdapterWeights
+from text_generation_server.layers.linear import FastLinear
+from text_generation_server.layers import lora as layers_lora
+from text_generation_server.layers.lora import (
+    LoraLinear,
+    TensorParallelAdapterRowLinear,
+    TensorParallelMultiAdapterLinear,
+)
+from text_generation_server.utils.segments import find_segments
 
 
 def test_parse_lora_adapters_empty():
@@ -251,3 +274,267 @@ def test_get_mlp_weights_gemma_compatibility():
         (3, "down_proj"): ("model.layers.3.mlp.down_proj", mock_layer.mlp.down_proj),
     }
     assert result == expected
+
+
+def _decode_adapter_data(adapter_indices, segment_indices, use_sgmv=False):
+    # Row -> position of its adapter in `segment_indices`
+    rank_indices = torch.tensor(
+        [segment_indices.index(i) for i in adapter_indices], dtype=torch.int64
+    )
+    weights = BatchLoraWeights(
+        lora_a={},
+        lora_b={},
+        adapter_index_configs={},
+        rank_data={
+            8: RankSegments(
+                rank=8,
+                lora_a_ptr=torch.zeros(len(segment_indices), dtype=torch.int64),
+                lora_b_ptr=torch.zeros(len(segment_indices), dtype=torch.int64),
+                tmp_shrink=None,
+                tmp_expand=None,
+                segment_starts=None,
+                segment_ends=None,
+                indices=rank_indices,
+            )
+        },
+        use_sgmv=use_sgmv,
+    )
+    meta = AdapterBatchMetadata(
+        adapter_indices=torch.tensor(adapter_indices),
+        adapter_set=set(adapter_indices),
+        adapter_segments=torch.tensor([0, 2, 4], dtype=torch.int32),
+        segment_indices=segment_indices,
+    )
+    return AdapterBatchData(
+        meta=meta, data={"q_proj": weights, "v_proj": {}}, prefill=False
+    )
+
+
+def _meta(adapter_indices, segment_indices):
+    return AdapterBatchMetadata(
+        adapter_indices=torch.tensor(adapter_indices),
+        adapter_set=set(adapter_indices),
+        adapter_segments=torch.tensor([0, 1, 3], dtype=torch.int32),
+        segment_indices=segment_indices,
+    )
+
+
+def test_adapter_batch_data_filter():
+    adapter_data = _decode_adapter_data([1, 1, 2, 2], [1, 2])
+    rows = torch.tensor([0, 2, 3])
+
+    filtered = adapter_data.filter(_meta([1, 2, 2], [1, 2]), rows)
+    assert filtered is not None
+    assert filtered.meta.adapter_indices.tolist() == [1, 2, 2]
+    assert filtered.data["v_proj"] == {}
+    rank_data = filtered.data["q_proj"].rank_data[8]
+    assert rank_data.indices.tolist() == [0, 1, 1]
+    assert rank_data.lora_a_ptr is adapter_data.data["q_proj"].rank_data[8].lora_a_ptr
+
+
+def test_adapter_batch_data_filter_reload():
+    adapter_data = _decode_adapter_data([1, 1, 2, 2], [1, 2])
+    # An adapter is not used anymore: the segments changed
+    assert adapter_data.filter(_meta([2, 2], [2]), torch.tensor([2, 3])) is None
+
+    # Segment based kernels need new segment boundaries
+    adapter_data = _decode_adapter_data([1, 1, 2, 2], [1, 2], use_sgmv=True)
+    filtered = adapter_data.filter(_meta([1, 2, 2], [1, 2]), torch.tensor([0, 2, 3]))
+    assert filtered is None
+
+    adapter_data = _decode_adapter_data([1, 1, 2, 2], [1, 2])
+    adapter_data.prefill = True
+    filtered = adapter_data.filter(_meta([1, 2, 2], [1, 2]), torch.tensor([0, 2, 3]))
+    assert filtered is None
+
+
+def _adapter_manager(max_active):
+    model = Mock()
+    model.layer_to_adapter_weights = defaultdict(LayerAdapterWeights)
+    model.loaded_adapters = set()
+    manager = AdapterManager(model, {}, max_active=max_active)
+
+    def load_device(adapter_id, index):
+        if adapter_id == "broken":
+            raise FileNotFoundError(adapter_id)
+        model.layer_to_adapter_weights["q_proj"].add_adapter(index, Mock())
+        model.loaded_adapters.add(index)
+        manager.active[adapter_id] = index
+
+    manager._load_device = load_device
+    return manager, model
+
+
+def test_adapter_manager_lru():
+    manager, model = _adapter_manager(max_active=2)
+    indices = [manager.register(AdapterInfo(id=id, path=None)) for id in "abc"]
+    assert indices == [1, 2, 3]
+    assert manager.adapter_to_index == {"a": 1, "b": 2, "c": 3}
+
+    assert manager.activate({1})
+    assert manager.activate({2})
+    assert not manager.activate({1})
+    # b is the least recently used adapter
+    assert manager.activate({3})
+    assert list(manager.active) == ["a", "c"]
+    assert set(model.layer_to_adapter_weights["q_proj"].adapter_weights) == {1, 3}
+    assert model.loaded_adapters == {1, 3}
+
+    # The adapters of a step are never evicted to make room for each other
+    assert manager.activate({1, 2, 3})
+    assert set(manager.active) == {"a", "b", "c"}
+
+
+def test_adapter_manager_unload():
+    manager, model = _adapter_manager(max_active=2)
+    assert manager.load(AdapterInfo(id="a", path=None)) == 1
+    with pytest.raises(ValueError):
+        manager.unload("a", in_use={1})
+
+    manager.unload("a", in_use=set())
+    assert manager.adapter_to_index == {}
+    assert model.layer_to_adapter_weights["q_proj"].is_empty()
+    with pytest.raises(ValueError):
+        manager.unload("a", in_use=set())
+
+    # Adapters that cannot be loaded are forgotten, their requests use the base model
+    index = manager.register(AdapterInfo(id="broken", path=None))
+    assert not manager.activate({index})
+    assert "broken" not in manager.adapter_to_index
+    with pytest.raises(FileNotFoundError):
+        manager.load(AdapterInfo(id="broken", path=None))
+
+
+@pytest.mark.parametrize("adapter_indices", [[1, 0, 2, 1, 2, 2], [1, 1, 0, 2, 2, 2]])
+def test_lora_linear_forward_grouped(adapter_indices):
+    torch.manual_seed(0)
+    hidden_size, out_size, rank = 16, 12, 4
+    lora_a = {idx: torch.randn(2, hidden_size, rank) for idx in (1, 2)}
+    lora_b = {idx: torch.randn(2, rank, out_size) for idx in (1, 2)}
+
+    segments, segment_indices = find_segments(adapter_indices)
+    meta = AdapterBatchMetadata(
+        adapter_indices=torch.tensor(adapter_indices),
+        adapter_set=set(adapter_indices),
+        adapter_segments=torch.tensor(segments, dtype=torch.int32),
+        segment_indices=segment_indices,
+    )
+    groups = AdapterGroups.from_meta(meta, {1, 2})
+    # Interleaved rows are sorted, grouped rows are used in place
+    assert (groups.order is None) == (adapter_indices == [1, 1, 0, 2, 2, 2])
+    weights = BatchLoraWeights(
+        lora_a=lora_a,
+        lora_b=lora_b,
+        adapter_index_configs={1: None, 2: None},
+        rank_data={},
+        use_sgmv=False,
+        groups=groups,
+    )
+    adapter_data = AdapterBatchData(meta=meta, data={"q_proj": weights}, prefill=False)
+
+    layer = LoraLinear(torch.nn.Identity(), 1, Mock(size=Mock(return_value=1)))
+    input = torch.randn(len(adapter_indices), hidden_size)
+    base = torch.randn(len(adapter_indices), out_size + 2)
+    result = layer.forward_layer_type(
+        base.clone(), input, adapter_data, "q_proj", 2, out_size + 2
+    )
+
+    expected = base.clone()
+    for row, idx in enumerate(adapter_indices):
+        if idx != 0:
+            expected[row, 2:] += input[row] @ lora_a[idx][1] @ lora_b[idx][1]
+    assert torch.allclose(result, expected, atol=1e-5)
+
+
+def test_lora_linear_ipex_kernels(monkeypatch):
+    monkeypatch.setattr(adapters_lora, "SYSTEM", "ipex")
+    monkeypatch.setattr(layers_lora, "SYSTEM", "ipex")
+    calls = []
+
+    def bgmv_shrink(input, lora_a, v, indices, scale):
+        calls.append("bgmv_shrink")
+        for row, idx in enumerate(indices.tolist()):
+            v[row] += scale * (lora_a[idx] @ input[row])
+
+    def bgmv_expand(v, lora_b, proj, indices, add_inputs):
+        calls.append("bgmv_expand")
+        for row, idx in enumerate(indices.tolist()):
+            proj[row] += lora_b[idx] @ v[row]
+
+    monkeypatch.setattr(layers_lora, "bgmv_shrink", bgmv_shrink, raising=False)
+    monkeypatch.setattr(layers_lora, "bgmv_expand", bgmv_expand, raising=False)
+
+    torch.manual_seed(0)
+    hidden_size, out_size, rank = 16, 12, 4
+    lora_a = [torch.randn(hidden_size, rank) for _ in range(2)]
+    lora_b = [torch.randn(rank, out_size) for _ in range(2)]
+    weights = LoraWeights(lora_a, lora_b, None)
+    assert weights.get_batch_types() == [IPEXBatchLoraWeights]
+
+    adapter_indices = [1, 1, 1]
+    meta = AdapterBatchMetadata(
+        adapter_indices=torch.tensor(adapter_indices),
+        adapter_set={1},
+        adapter_segments=torch.tensor([0, 3], dtype=torch.int32),
+        segment_indices=[1],
+    )
+    data = IPEXBatchLoraWeights.load({1: weights}, meta, False, None)
+    assert data.groups is None
+    adapter_data = AdapterBatchData(meta=meta, data={"q_proj": data}, prefill=False)
+
+    layer = LoraLinear(torch.nn.Identity(), 1, Mock(size=Mock(return_value=1)))
+    input = torch.randn(len(adapter_indices), hidden_size)
+    base = torch.randn(len(adapter_indices), out_size)
+    result = layer.forward_layer_type(
+        base.clone(), input, adapter_data, "q_proj", 0, out_size
+    )
+
+    assert calls == ["bgmv_shrink", "bgmv_expand"]
+    assert torch.allclose(result, base + input @ lora_a[1] @ lora_b[1], atol=1e-5)
+
+
+def test_fold_lora_weights():
+    torch.manual_seed(0)
+    process_group = Mock(size=Mock(return_value=1), rank=Mock(return_value=0))
+    qkv_weight = torch.randn(8, 6)
+    o_weight = torch.randn(6, 4)
+    qkv = TensorParallelMultiAdapterLinear(
+        Mock(linear=FastLinear(qkv_weight.clone(), None)),
+        0,
+        ["q_proj", "k_proj", "v_proj"],
+        [4, 2, 2],
+        process_group,
+    )
+    o_proj = TensorParallelAdapterRowLinear(
+        Mock(linear=FastLinear(o_weight.clone(), None)), 0, "o_proj", process_group
+    )
+    target_to_layer = {
+        (0, "q_proj"): ("model.layers.0.self_attn.q_proj", qkv),
+        (0, "k_proj"): ("model.layers.0.self_attn.k_proj", qkv),
+        (0, "v_proj"): ("model.layers.0.self_attn.v_proj", qkv),
+        (0, "o_proj"): ("model.layers.0.self_attn.o_proj", o_proj),
+    }
+    k_a, k_b = torch.randn(2, 6), torch.randn(2, 2)
+    o_a, o_b = torch.randn(2, 4), torch.randn(6, 2)
+    module_map = {
+        "model.layers.0.self_attn.k_proj": {"lora_A": (k_a, ""), "lora_B": (k_b, "")},
+        "model.layers.0.self_attn.o_proj": {"lora_A": (o_a, ""), "lora_B": (o_b, "")},
+    }
+    config = LoraConfig(
+        base_model_name_or_path=None,
+        r=2,
+        target_modules=["k_proj", "o_proj"],
+        fan_in_fan_out=False,
+        lora_alpha=4,
+        use_rslora=False,
+    )
+
+    folded = fold_lora_weights(
+        module_map, config, target_to_layer, process_group, weight=0.5
+    )
+
+    assert folded == 2
+    expected = qkv_weight.clone()
+    expected[4:6] += k_b @ k_a
+    torch.testing.assert_close(qkv.base_layer.linear.weight, expected)
+    torch.testing.assert_close(o_proj.base_layer.linear.weight, o_weight + o_b @ o_a)
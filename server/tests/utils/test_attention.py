@@ -0,0 +1,146 @@
+import pytest
+import torch
+
+# Before the attention layers, that are imported by the models package
+from text_generation_server.models.globals import BLOCK_SIZE
+from text_generation_server.layers.attention import Seqlen, native
+from text_generation_server.layers.attention.kv_cache import KVCache, KVScales
+
+NUM_HEADS = 4
+NUM_KV_HEADS = 2
+HEAD_SIZE = 8
+SCALE = HEAD_SIZE**-0.5
+
+
+def reference(query, key, value, offset, window_size_left=-1, softcap=None):
+    group = query.shape[1] // key.shape[1]
+    key = key.repeat_interleave(group, dim=1)
+    value = value.repeat_interleave(group, dim=1)
+    scores = torch.einsum("qhd,khd->hqk", query, key) * SCALE
+    if softcap is not None:
+        scores = softcap * torch.tanh(scores / softcap)
+    q_positions = torch.arange(query.shape[0])[:, None] + offset
+    k_positions = torch.arange(key.shape[0])[None, :]
+    mask = k_positions <= q_positions
+    if window_size_left != -1:
+        mask &= k_positions >= q_positions - window_size_left
+    scores = scores.masked_fill(~mask, float("-inf"))
+    return torch.einsum("hqk,khd->qhd", scores.softmax(dim=-1), value)
+
+
+def make_cache(lengths, blocks):
+    """KV cache holding `lengths` positions of each sequence in `blocks`."""
+    kv_cache = KVCache(
+        num_blocks=sum(len(b) for b in blocks) + 1,
+        num_heads=NUM_KV_HEADS,
+        head_size=HEAD_SIZE,
+        dtype=torch.float32,
+        device=torch.device("cpu"),
+    )
+    # The unwritten slots must never be read
+    kv_cache.key.fill_(float("nan"))
+    kv_cache.value.fill_(float("nan"))
+    kv_scales = KVScales(torch.tensor(1.0), torch.tensor(1.0))
+    keys, values = [], []
+    for length, seq_blocks in zip(lengths, blocks):
+        key = torch.randn(length, NUM_KV_HEADS, HEAD_SIZE)
+        value = torch.randn(length, NUM_KV_HEADS, HEAD_SIZE)
+        slots = torch.tensor(
+            [
+                seq_blocks[i // BLOCK_SIZE] * BLOCK_SIZE + i % BLOCK_SIZE
+                for i in range(length)
+            ]
+        )
+        kv_cache.store(key=key, value=value, slots=slots, kv_scales=kv_scales)
+        keys.append(key)
+        values.append(value)
+
+    max_blocks = max(len(b) for b in blocks)
+    block_tables = torch.tensor([b + [0] * (max_blocks - len(b)) for b in blocks])
+    return kv_cache, kv_scales, keys, values, block_tables
+
+
+@pytest.mark.parametrize(
+    "window_size_left,softcap", [(-1, None), (-1, 5.0), (BLOCK_SIZE // 2, None)]
+)
+def test_attention_prefill(window_size_left, softcap):
+    torch.manual_seed(0)
+    # The first sequence continues a cached prefix, the second one has no cache
+    cache_lengths = [5, 0]
+    input_lengths = [3, BLOCK_SIZE + 4]
+    lengths = [c + i for c, i in zip(cache_lengths, input_lengths)]
+    kv_cache, kv_scales, keys, values, block_tables = make_cache(lengths, [[2], [1, 3]])
+    query = torch.randn(sum(input_lengths), NUM_HEADS, HEAD_SIZE)
+    seqlen = Seqlen(
+        input_lengths=torch.tensor(input_lengths, dtype=torch.int32),
+        cache_lengths=torch.tensor(cache_lengths, dtype=torch.int32),
+        cu_seqlen_q=torch.tensor([0, input_lengths[0], sum(input_lengths)]),
+        max_q=max(input_lengths),
+        max_k=max(lengths),
+    )
+
+    out = native.attention(
+        query=query,
+        key=None,
+        value=None,
+        kv_cache=kv_cache,
+        kv_scales=kv_scales,
+        seqlen=seqlen,
+        block_tables=block_tables,
+        softmax_scale=SCALE,
+        window_size_left=window_size_left,
+        softcap=softcap,
+    )
+
+    expected = torch.cat(
+        [
+            reference(
+                query[: input_lengths[0]],
+                keys[0],
+                values[0],
+                cache_lengths[0],
+                window_size_left,
+                softcap,
+            ),
+            reference(
+                query[input_lengths[0] :],
+                keys[1],
+                values[1],
+                cache_lengths[1],
+                window_size_left,
+                softcap,
+            ),
+        ]
+    )
+    torch.testing.assert_close(out, expected)
+
+
+@pytest.mark.parametrize("window_size_left", [-1, 4])
+def test_paged_attention_decode(window_size_left):
+    torch.manual_seed(0)
+    lengths = [BLOCK_SIZE + 3, 2]
+    kv_cache, kv_scales, keys, values, block_tables = make_cache(lengths, [[3, 1], [2]])
+    query = torch.randn(len(lengths), NUM_HEADS, HEAD_SIZE)
+    seqlen = Seqlen(
+        input_lengths=torch.ones(len(lengths), dtype=torch.int32),
+        cache_lengths=torch.tensor(lengths, dtype=torch.int32) - 1,
+        max_k=max(lengths),
+    )
+
+    out = native.paged_attention(
+        query,
+        kv_cache,
+        None,
+        SCALE,
+        block_tables,
+        seqlen,
+        max(lengths),
+        kv_scales=kv_scales,
+        window_size_left=window_size_left,
+    )
+
+    for i, length in enumerate(lengths):
+        expected = reference(
+            query[i : i + 1], keys[i], values[i], length - 1, window_size_left
+        )
+        torch.testing.assert_close(out[i : i + 1], expected)
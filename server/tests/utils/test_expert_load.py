@@ -0,0 +1,138 @@
+import asyncio
+import pytest
+import torch
+
+from prometheus_client import generate_latest
+
+from text_generation_server import metrics
+from text_generation_server.utils import expert_load
+from text_generation_server.utils.expert_placement import (
+    merge_expert_load,
+    parse_expert_load,
+    propose_placement,
+)
+
+
+def test_expert_load(monkeypatch):
+    monkeypatch.setattr(expert_load, "_EXPERT_LOADS", {})
+    monkeypatch.setattr(expert_load, "MOE_EXPERT_LOAD", False)
+    assert expert_load.expert_load("layers.0", 4, torch.device("cpu")) is None
+
+    monkeypatch.setattr(expert_load, "MOE_EXPERT_LOAD", True)
+    first = expert_load.expert_load("layers.0", 4, torch.device("cpu"))
+    second = expert_load.expert_load("layers.1", 2, torch.device("cpu"))
+    first.record(torch.tensor([[0, 3], [3, 1]], dtype=torch.int32))
+    first.record(torch.tensor([[3, 2]]))
+    second.record(torch.tensor([[1], [1]]))
+
+    assert expert_load.read_expert_load() == {
+        "layers.0": [1, 1, 1, 3],
+        "layers.1": [0, 2],
+    }
+
+    expert_load.reset_expert_load()
+    assert expert_load.read_expert_load() == {
+        "layers.0": [0, 0, 0, 0],
+        "layers.1": [0, 0],
+    }
+
+
+def test_expert_load_graph_padding(monkeypatch):
+    monkeypatch.setattr(expert_load, "_EXPERT_LOADS", {})
+    monkeypatch.setattr(expert_load, "_GRAPH_TOKENS", {})
+    monkeypatch.setattr(expert_load, "MOE_EXPERT_LOAD", True)
+    load = expert_load.expert_load("layers.0", 4, torch.device("cpu"))
+    # Recorded as in a CUDA graph captured for 3 rows
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: True)
+    monkeypatch.setattr(torch.cuda, "is_current_stream_capturing", lambda: True)
+    topk_ids = torch.tensor([[0, 1], [2, 1], [0, 0]])
+
+    # The batch replayed on the graph only has 2 real rows
+    expert_load.set_graph_tokens(2)
+    load.record(topk_ids)
+    expert_load.set_graph_tokens(3)
+    load.record(topk_ids)
+
+    assert expert_load.read_expert_load() == {"layers.0": [4, 4, 2, 0]}
+
+
+def test_parse_expert_load():
+    text = """# HELP tgi_shard_moe_expert_tokens_total Tokens routed to each expert
+# TYPE tgi_shard_moe_expert_tokens_total counter
+tgi_shard_moe_expert_tokens_total{expert="0",layer="layers.0"} 5.0
+tgi_shard_moe_expert_tokens_total{expert="2",layer="layers.0"} 7.0
+tgi_shard_moe_expert_tokens_created{expert="0",layer="layers.0"} 1.7e+09
+tgi_shard_moe_expert_tokens_total{expert="1",layer="layers.1"} 3.0
+"""
+
+    assert parse_expert_load(text) == {"layers.0": [5, 0, 7], "layers.1": [0, 3]}
+
+
+def test_monitor_expert_load_exports_cold_experts(monkeypatch):
+    monkeypatch.setattr(metrics, "MOE_EXPERT_LOAD_INTERVAL", 0)
+
+    async def read():
+        return {"test.cold": [0, 4, 0, 0]}
+
+    async def monitor():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(metrics.monitor_expert_load(read), 0.01)
+
+    asyncio.run(monitor())
+
+    loads = parse_expert_load(generate_latest().decode("utf-8"))
+    assert loads["test.cold"] == [0, 4, 0, 0]
+
+
+def test_monitor_expert_load_read_error(monkeypatch):
+    monkeypatch.setattr(metrics, "MOE_EXPERT_LOAD_INTERVAL", 0)
+    reads = []
+
+    async def read():
+        reads.append(None)
+        if len(reads) == 1:
+            raise RuntimeError("device lost")
+        return {"test.error": [2, 1]}
+
+    async def monitor():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(metrics.monitor_expert_load(read), 0.01)
+
+    asyncio.run(monitor())
+
+    assert len(reads) > 1
+    loads = parse_expert_load(generate_latest().decode("utf-8"))
+    assert loads["test.error"] == [2, 1]
+
+
+def test_merge_expert_load():
+    loads = merge_expert_load(
+        [{"layers.0": [1, 2]}, {"layers.0": [3, 0, 0, 5], "layers.1": [1]}]
+    )
+
+    assert loads == {"layers.0": [4, 2, 0, 5], "layers.1": [1]}
+
+
+def test_propose_placement():
+    # The two hot experts are contiguous
+    counts = [100, 90, 10, 10, 10, 10, 5, 5]
+
+    placement = propose_placement(counts, num_ranks=4)
+
+    assert placement.contiguous_imbalance == 190 / 60
+    assert [len(experts) for experts in placement.experts] == [2, 2, 2, 2]
+    assert sorted(sum(placement.experts, [])) == list(range(8))
+    assert placement.experts[0] == [0, 7]
+    assert placement.experts[1] == [1, 6]
+    assert placement.imbalance == 105 / 60
+
+
+def test_propose_placement_replicas():
+    counts = [120, 10, 10, 10]
+
+    placement = propose_placement(counts, num_ranks=2, replicas=1)
+
+    assert placement.copies == [2, 1, 1, 1]
+    # The copies of an expert are on different ranks
+    assert all(experts.count(0) == 1 for experts in placement.experts)
+    assert sorted(placement.rank_loads) == [70.0, 80.0]
@@ -80,3 +80,118 @@ def test_weight_hub_files_offline_error():
     output_tp_1 = embeddings_1_2.forward(input_ids)
 
     torch.testing.assert_close(output, output_tp_0 + output_tp_1)
+
+
+def test_dense_moe_selected_experts(tmp_path):
+    from safetensors.torch import save_file
+
+    from text_generation_server.layers.moe import DenseMoELayer
+    from text_generation_server.utils.weights import (
+        DefaultWeightsLoader,
+        UnquantizedWeight,
+        Weights as SafetensorsWeights,
+    )
+
+    n_experts, hidden_dim, intermediate_dim = 4, 8, 16
+    torch.manual_seed(0)
+    tensors = {}
+    for i in range(n_experts):
+        for name, shape in [
+            ("gate_proj", (intermediate_dim, hidden_dim)),
+            ("up_proj", (intermediate_dim, hidden_dim)),
+            ("down_proj", (hidden_dim, intermediate_dim)),
+        ]:
+            tensors[f"experts.{i}.{name}.weight"] = torch.randn(shape)
+    save_file(tensors, tmp_path / "model.safetensors")
+    weights = SafetensorsWeights(
+        [tmp_path / "model.safetensors"],
+        device=torch.device("cpu"),
+        dtype=torch.float32,
+        process_group=ProcessGroup(rank=0, world_size=1),
+        weights_loader=DefaultWeightsLoader(UnquantizedWeight),
+    )
+    layer = DenseMoELayer(
+        n_expert_group=None,
+        n_experts=n_experts,
+        prefix="experts",
+        renormalize=True,
+        topk=2,
+        topk_group=None,
+        weights=weights,
+    )
+
+    x = torch.randn(5, hidden_dim)
+    # Expert 3 is not selected
+    topk_ids = torch.tensor([[0, 1], [1, 0], [2, 0], [1, 2], [0, 2]])
+    topk_weights = torch.rand(5, 2)
+
+    torch.testing.assert_close(
+        layer._apply_selected_experts(x, topk_weights, topk_ids),
+        layer._apply_all_experts(x, topk_weights, topk_ids),
+    )
+
+
+def test_apply_rotary():
+    from text_generation_server.layers.rotary import _apply_rotary
+
+    positions = torch.arange(5, dtype=torch.float32)
+    inv_freq = 1.0 / (10000 ** (torch.arange(0, 8, 2).float() / 8))
+    freqs = torch.outer(positions, inv_freq)
+    cos, sin = torch.cos(freqs).unsqueeze(1), torch.sin(freqs).unsqueeze(1)
+    x = torch.randn(5, 2, 8)
+
+    # Rotation of the two halves, as in the GPT-NeoX implementation
+    x1, x2 = x[..., :4], x[..., 4:]
+    expected = torch.cat([x1 * cos - x2 * sin, x1 * sin + x2 * cos], dim=-1)
+    _apply_rotary(x, cos, sin)
+
+    torch.testing.assert_close(x, expected)
+
+
+def test_shared_rotary_tables(monkeypatch):
+    from types import SimpleNamespace
+
+    from text_generation_server.layers import rotary
+
+    monkeypatch.setattr(rotary, "_ROTARY_EMBEDDINGS", {})
+    config = SimpleNamespace(rope_scaling=None, max_position_embeddings=64)
+    device = torch.device("cpu")
+    first = rotary.PositionRotaryEmbedding.static(config, 8, 10000.0, device)
+    second = rotary.PositionRotaryEmbedding.static(config, 8, 10000.0, device)
+    other = rotary.PositionRotaryEmbedding.static(config, 8, 1000.0, device)
+
+    assert first is second
+    assert other is not first
+
+    position_ids = torch.tensor([0, 3, 7])
+    cos, sin = first.get_cos_sin(position_ids, 8, torch.float32)
+
+    # The tables cover all the positions of the model from the first call
+    assert first._cos_cached.shape == (64, 4)
+    freqs = torch.outer(position_ids.float(), first.inv_freq)
+    torch.testing.assert_close(cos, torch.cos(freqs).unsqueeze(1))
+    torch.testing.assert_close(sin, torch.sin(freqs).unsqueeze(1))
+
+
+def test_prompt_logprobs_chunks():
+    from text_generation_server.layers.prompt_logprobs import PromptLogprobs
+
+    torch.manual_seed(0)
+    weight = torch.randn(11, 8)
+    hidden_states = torch.randn(7, 8)
+    target_ids = torch.tensor([3, 0, 10, 5, 5, 1, 0])
+    next_token_indices = torch.tensor([2, 6])
+
+    def head(x):
+        return x @ weight.T
+
+    def softcap(logits):
+        return torch.tanh(logits / 2.0) * 2.0
+
+    prompt_logprobs = PromptLogprobs(target_ids, next_token_indices, chunk_size=3)
+    next_hidden_states = prompt_logprobs.score(head, hidden_states, softcap)
+
+    expected = torch.log_softmax(softcap(head(hidden_states)), -1)
+    expected = expected.gather(1, target_ids.view(-1, 1)).view(-1)
+    torch.testing.assert_close(prompt_logprobs.logprobs, expected)
+    assert torch.equal(next_hidden_states, hidden_states[next_token_indices])
@@ -0,0 +1,130 @@
+import pytest
+import torch
+
+from text_generation_server.adapters.lora import LoraConfig
+from text_generation_server.utils.adapter import AdapterInfo, AdapterParameters
+from text_generation_server.utils.merges import cache
+from text_generation_server.utils.merges.strategies import merge_adapters
+from text_generation_server.utils.merges.utils import (
+    calculate_majority_sign_mask,
+    disjoint_merge,
+    prune,
+)
+
+
+def test_magnitude_pruning_per_task():
+    tensor = torch.tensor([[[1.0, -4.0], [2.0, 0.5]], [[-0.1, 0.2], [3.0, -0.25]]])
+
+    pruned = prune(tensor, 0.5, method="magnitude")
+
+    assert pruned.tolist() == [[[0.0, -4.0], [2.0, 0.0]], [[0.0, 0.0], [3.0, -0.25]]]
+
+
+def test_random_pruning_rescale():
+    tensor = torch.ones(2, 1000)
+    generator = torch.Generator().manual_seed(0)
+
+    pruned = prune(tensor, 0.25, method="random", rescale=True, generator=generator)
+
+    assert set(pruned.unique().tolist()) == {0.0, 4.0}
+    assert pruned.mean().item() == pytest.approx(1.0, rel=0.2)
+
+
+def test_random_pruning_seeded():
+    tensor = torch.randn(3, 64)
+
+    first = prune(tensor, 0.5, "random", generator=torch.Generator().manual_seed(1))
+    second = prune(tensor, 0.5, "random", generator=torch.Generator().manual_seed(1))
+
+    assert torch.equal(first, second)
+
+
+@pytest.mark.parametrize(
+    "method,expected",
+    [
+        ("total", [[1, 0, 0], [0, 1, 0], [1, 0, 0]]),
+        ("frequency", [[1, 1, 0], [0, 0, 0], [1, 1, 0]]),
+    ],
+)
+def test_majority_sign_mask(method, expected):
+    tensor = torch.tensor([[1.0, 1.0, 0.0], [-0.5, -5.0, 0.0], [2.0, 1.0, 0.0]])
+
+    assert calculate_majority_sign_mask(tensor, method).int().tolist() == expected
+
+
+def test_disjoint_merge():
+    tensor = torch.tensor([[1.0, -2.0], [3.0, 4.0]])
+    mask = torch.tensor([[True, False], [True, True]])
+
+    assert disjoint_merge(tensor, mask).tolist() == [2.0, 4.0]
+
+
+def _config(target_modules=None):
+    return LoraConfig(
+        base_model_name_or_path=None,
+        r=2,
+        target_modules=target_modules or ["q_proj"],
+        fan_in_fan_out=False,
+        lora_alpha=4,
+        use_rslora=False,
+    )
+
+
+def test_merge_adapters_ties():
+    weight_name = "model.layers.0.self_attn.q_proj"
+    a = torch.tensor([[1.0, -2.0], [0.1, 3.0]])
+    b = torch.tensor([[-1.0, -2.0], [0.2, 1.5]])
+    adapters = [
+        ({weight_name: {"lora_A": (a, "a"), "lora_B": (a, "b")}}, _config()),
+        ({weight_name: {"lora_A": (b, "a"), "lora_B": (b, "b")}}, _config()),
+    ]
+    params = AdapterParameters(
+        adapter_info=(AdapterInfo("a", None), AdapterInfo("b", None)),
+        weights=(1.0, 1.0),
+        merge_strategy="ties",
+        density=0.5,
+    )
+
+    module_map, config = merge_adapters(adapters, params, device=torch.device("cpu"))
+
+    merged, param_name = module_map[weight_name]["lora_A"]
+    assert param_name == "a"
+    # Keeps [[_, -2], [_, 3]] and [[_, -2], [_, 1.5]]
+    assert merged.tolist() == [[0.0, -2.0], [0.0, 2.25]]
+    assert config.target_modules == ["q_proj"]
+
+
+def test_merge_adapters_unknown_strategy():
+    params = AdapterParameters(adapter_info=(), weights=(), merge_strategy="unknown")
+    with pytest.raises(ValueError, match="Unknown merge strategy"):
+        merge_adapters([], params)
+
+
+def test_merge_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "ADAPTER_MERGE_CACHE", str(tmp_path))
+    adapter_file = tmp_path / "adapter_model.safetensors"
+    adapter_file.write_bytes(b"")
+    params = AdapterParameters(
+        adapter_info=(AdapterInfo("a", str(tmp_path)), AdapterInfo("b", None)),
+        weights=(0.5, 0.5),
+    )
+    key = cache.merge_key("model", params, [[str(adapter_file)], []], ("w",))
+
+    assert key != cache.merge_key(
+        "model",
+        AdapterParameters(params.adapter_info, (0.6, 0.4)),
+        [[str(adapter_file)], []],
+        ("w",),
+    )
+    assert cache.load_merge(key) is None
+
+    module_map = {
+        "w": {"lora_A": (torch.ones(2, 3), "a"), "lora_B": (torch.ones(3, 2), "b")}
+    }
+    cache.save_merge(key, module_map, _config(target_modules={"q_proj"}), {"a", "b"})
+    loaded_map, loaded_config, weight_names = cache.load_merge(key)
+
+    assert torch.equal(loaded_map["w"]["lora_A"][0], torch.ones(2, 3))
+    assert loaded_map["w"]["lora_B"][1] == "b"
+    assert loaded_config == _config()
+    assert weight_names == {"a", "b"}
@@ -0,0 +1,55 @@
+import pytest
+import torch
+
+from text_generation_server.utils.segments import (
+    SegmentConcatBuilder,
+    find_segments,
+    group_by_adapter,
+    segment_bounds,
+)
+
+
+@pytest.mark.parametrize("as_tensor", [False, True])
+def test_find_segments(as_tensor):
+    adapter_indices = [1, 1, 0, 2, 2, 1]
+    if as_tensor:
+        adapter_indices = torch.tensor(adapter_indices)
+
+    segments, segment_indices = find_segments(adapter_indices)
+
+    assert segments == [0, 2, 3, 5, 6]
+    assert segment_indices == [1, 0, 2, 1]
+
+
+def test_find_segments_single():
+    assert find_segments(torch.zeros(4, dtype=torch.int64)) == ([0, 4], [0])
+
+
+def test_segment_bounds():
+    adapter_indices = torch.tensor([3, 0, 0, 3, 3, 3, 1])
+    segments, segment_indices = find_segments(adapter_indices)
+
+    bounds = segment_bounds(adapter_indices, len(segment_indices))
+
+    assert bounds.dtype == torch.int32
+    assert bounds.tolist() == segments
+
+
+def test_group_by_adapter():
+    assert group_by_adapter([1, 1, 0, 2]) is None
+
+    order = group_by_adapter([1, 0, 2, 1, 0])
+    assert order == [1, 4, 0, 3, 2]
+    _, segment_indices = find_segments([[1, 0, 2, 1, 0][i] for i in order])
+    assert segment_indices == [0, 1, 2]
+
+
+def test_segment_concat_builder():
+    builder = SegmentConcatBuilder()
+    builder.concat(torch.tensor([0, 2, 3]), [1, 2])
+    builder.concat(torch.tensor([0, 1, 4]), [2, 0])
+
+    adapter_segments, segment_indices = builder.build()
+
+    assert adapter_segments.tolist() == [0, 2, 4, 7]
+    assert segment_indices == [1, 2, 0]
@@ -0,0 +1,159 @@
+import os
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import torch
+from loguru import logger
+from torch.distributed import ProcessGroup
+
+from text_generation_server.adapters.lora import (
+    LoraConfig,
+    get_scaling_factor,
+    shard_on_dim,
+)
+from text_generation_server.layers.lora import (
+    TensorParallelAdapterRowLinear,
+    TensorParallelMultiAdapterLinear,
+)
+from text_generation_server.utils.adapter import (
+    AdapterInfo,
+    AdapterParameters,
+    build_layer_weight_lookup,
+    load_and_merge_adapters,
+    parse_lora_adapters,
+)
+
+if TYPE_CHECKING:
+    from text_generation_server.adapters.config import ModuleMap
+    from text_generation_server.models.model import Model
+
+# Adapters folded into the base weights at load time, in the `LORA_ADAPTERS` format.
+# Several adapters are merged first, with `FOLD_LORA_STRATEGY`.
+FOLD_LORA_ADAPTERS = parse_lora_adapters(os.getenv("FOLD_LORA_ADAPTERS"))
+# Comma separated weights of the folded adapters, 1 by default
+FOLD_LORA_WEIGHTS = [
+    float(w) for w in os.getenv("FOLD_LORA_WEIGHTS", "").split(",") if w.strip()
+]
+FOLD_LORA_STRATEGY = os.getenv("FOLD_LORA_STRATEGY", "linear")
+FOLD_LORA_DENSITY = float(os.getenv("FOLD_LORA_DENSITY", "1.0"))
+
+
+def fold_lora_weights(
+    module_map: "ModuleMap",
+    config: LoraConfig,
+    target_to_layer: Dict[Tuple[int, str], Tuple[str, torch.nn.Module]],
+    process_group: ProcessGroup,
+    weight: float = 1.0,
+) -> int:
+    """Add the LoRA weights of `module_map`, times `weight`, to the base weights.
+
+    Returns the number of folded weights. The base weights must not be quantized.
+    """
+    scale = weight * get_scaling_factor(config.lora_alpha, config.r, config.use_rslora)
+    world_size = process_group.size()
+
+    folded = 0
+    for (_, layer_type), (weight_name, layer) in target_to_layer.items():
+        if weight_name not in module_map:
+            continue
+
+        if isinstance(layer, TensorParallelAdapterRowLinear):
+            if layer.layer_name != layer_type:
+                continue
+            # The input dimension is sharded
+            split_dim = 1
+            start = 0
+        elif isinstance(layer, TensorParallelMultiAdapterLinear):
+            if layer.layer_names is None or layer_type not in layer.layer_names:
+                continue
+            # The output dimension is sharded, fused layers stack the shards of
+            # their projections
+            split_dim = 0
+            i = layer.layer_names.index(layer_type)
+            start = sum(layer.sizes[:i]) // world_size if layer.sizes else 0
+        else:
+            logger.warning(f"Cannot fold LoRA weights into {weight_name}")
+            continue
+
+        linear = layer.base_layer.linear
+        base_weight = getattr(linear, "weight", None)
+        if (
+            not isinstance(base_weight, torch.Tensor)
+            or not base_weight.dtype.is_floating_point
+            or base_weight.element_size() < 2
+        ):
+            raise ValueError(
+                f"Cannot fold LoRA weights into the {type(linear).__name__} "
+                f"weights of {weight_name}, folding needs unquantized weights"
+            )
+
+        lora_a, _ = module_map[weight_name]["lora_A"]
+        lora_b, _ = module_map[weight_name]["lora_B"]
+        # [out_features, in_features]
+        delta = scale * (
+            lora_b.to(base_weight.device, torch.float32)
+            @ lora_a.to(base_weight.device, torch.float32)
+        )
+        delta = shard_on_dim(delta, dim=split_dim, process_group=process_group)
+
+        if split_dim == 0:
+            base = base_weight.data[start : start + delta.shape[0]]
+        else:
+            base = base_weight.data
+        if base.shape != delta.shape:
+            raise ValueError(
+                f"LoRA weights of {weight_name} have shape {tuple(delta.shape)}, "
+                f"expected {tuple(base.shape)}"
+            )
+        base.copy_((base.float() + delta).to(base.dtype))
+        folded += 1
+
+    return folded
+
+
+def fold_adapters(
+    model: "Model",
+    adapters: List[AdapterInfo],
+    weights: Optional[List[float]] = None,
+    merge_strategy: str = "linear",
+    density: float = 1.0,
+):
+    """Fold `adapters`, merged if there are several, into the weights of `model`.
+
+    Requests then get the adapted model without any LoRA computation.
+    """
+    if weights and len(weights) != len(adapters):
+        raise ValueError(
+            f"Got {len(weights)} weights for {len(adapters)} adapters to fold"
+        )
+    target_to_layer = build_layer_weight_lookup(model.model)
+    weight_names = tuple([v[0] for v in target_to_layer.values()])
+    adapter_parameters = AdapterParameters(
+        adapter_info=tuple(adapters),
+        weights=tuple(weights) if weights else None,
+        merge_strategy=merge_strategy,
+        density=density,
+    )
+    module_map, adapter_config, _, _ = load_and_merge_adapters(
+        model.model_id,
+        adapter_parameters,
+        0,
+        weight_names,
+        device=model.device,
+    )
+
+    folded = fold_lora_weights(
+        module_map,
+        adapter_config,
+        target_to_layer,
+        model.process_group,
+        # A single adapter is not merged, its weight is applied here
+        weight=weights[0] if weights and len(adapters) == 1 else 1.0,
+    )
+    if folded == 0:
+        raise ValueError(
+            f"No weights of {[a.id for a in adapters]} match the layers of the model"
+        )
+    logger.info(
+        f"Folded {[a.id for a in adapters]} into {folded} weights of the base model"
+    )
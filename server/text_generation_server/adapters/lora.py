@@ -3,7 +3,7 @@
 # License:  Apache License Version 2.0, January 2004
 
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import Dict, List, Optional, Set, Tuple, Type, Union
 
 from loguru import logger
@@ -137,6 +137,13 @@ class LoraWeights(AdapterWeights):
             # [num_layers, hidden_size, r]
             weights_b = [w.transpose(0, 1).contiguous() for w in weights_b]
             self._weights_b = torch.stack(weights_b)
+        elif punica_sgmv is None and SYSTEM != "ipex":
+            self._use_cutlass_shrink = False
+            # [num_layers, hidden_size, r]
+            self._weights_a = torch.stack(weights_a)
+
+            # [num_layers, r, hidden_size]
+            self._weights_b = torch.stack(weights_b)
         else:
             self._use_cutlass_shrink = punica_sgmv.use_cutlass_shrink(self.lora_a_r)
             # [num_layers, hidden_size, r]
@@ -257,7 +264,7 @@ class LoraWeights(AdapterWeights):
             lora_b_list[layer_id] = lora_b.transpose(0, 1) * scale
 
         # pad lora ranks to be compatible with sgmv
-        if SYSTEM != "ipex":
+        if SYSTEM != "ipex" and punica_sgmv is not None:
             lora_a_list = [
                 punica_sgmv.pad_rank(w, dim=1, world_size=world_size)
                 for w in lora_a_list
@@ -300,6 +307,47 @@ class RankSegments:
     indices: torch.Tensor
 
 
+@dataclass
+class AdapterGroups:
+    """Rows of a batch grouped by adapter, used when the SGMV kernels are missing."""
+
+    # Permutation of the rows that makes the rows of each adapter contiguous,
+    # None if they already are
+    order: Optional[torch.Tensor]
+    # (adapter index, start, end) of the rows of each adapter, after `order`
+    groups: List[Tuple[int, int, int]]
+
+    @classmethod
+    def from_meta(
+        cls, meta: AdapterBatchMetadata, adapters: Set[int]
+    ) -> "AdapterGroups":
+        segment_indices = meta.segment_indices
+        if len(set(segment_indices)) == len(segment_indices):
+            # One segment per adapter, the rows do not need to move
+            order = None
+            bounds = meta.adapter_segments.tolist()
+            groups = [
+                (adapter_index, bounds[i], bounds[i + 1])
+                for i, adapter_index in enumerate(segment_indices)
+            ]
+        else:
+            order = torch.argsort(meta.adapter_indices, stable=True)
+            adapter_indices, counts = torch.unique_consecutive(
+                meta.adapter_indices[order], return_counts=True
+            )
+            ends = counts.cumsum(0).tolist()
+            groups = [
+                (adapter_index, end - count, end)
+                for adapter_index, count, end in zip(
+                    adapter_indices.tolist(), counts.tolist(), ends
+                )
+            ]
+        return cls(
+            order=order,
+            groups=[group for group in groups if group[0] in adapters],
+        )
+
+
 @dataclass
 class BatchLoraWeights(BatchAdapterWeights):
     lora_a: Dict[int, torch.Tensor]
@@ -307,10 +355,24 @@ class BatchLoraWeights(BatchAdapterWeights):
     adapter_index_configs: Dict[int, LoraConfig]
     rank_data: Dict[int, RankSegments]
     use_sgmv: bool
+    # Set instead of `rank_data` when the punica kernels are not available
+    groups: Optional[AdapterGroups] = None
 
     def has_adapter(self, adapter_index: int) -> bool:
         return adapter_index in self.adapter_index_configs
 
+    def filter(self, indices: torch.Tensor) -> Optional["BatchLoraWeights"]:
+        if self.use_sgmv or self.groups is not None:
+            # Segment starts and ends would have to be recomputed
+            return None
+        return replace(
+            self,
+            rank_data={
+                rank: replace(rank_data, indices=rank_data.indices[indices])
+                for rank, rank_data in self.rank_data.items()
+            },
+        )
+
     def can_vectorize(self, pg: ProcessGroup) -> bool:
         return all(
             rank_data.rank // pg.size() <= punica_sgmv.MAX_RANK_CUSTOM
@@ -347,6 +409,19 @@ class BatchLoraWeights(BatchAdapterWeights):
             if idx in adapter_weights
         }
 
+        if punica_sgmv is None and SYSTEM != "ipex":
+            # Without the kernels, the layers run one matmul per adapter
+            return BatchLoraWeights(
+                lora_a=lora_a,
+                lora_b=lora_b,
+                adapter_index_configs={
+                    idx: adapter_weights[idx].adapter_config for idx in lora_a
+                },
+                rank_data={},
+                use_sgmv=False,
+                groups=AdapterGroups.from_meta(meta, set(lora_a)),
+            )
+
         max_rank = max(
             (
                 adapter_weights[idx].lora_a_r
@@ -416,8 +491,6 @@ class BatchLoraWeights(BatchAdapterWeights):
             if idx in adapter_weights
         }
 
-        adapter_to_segment = {v: k for k, v in enumerate(segment_indices)}
-
         rank_indices = defaultdict(list)
         for segment_idx, adapter_idx in enumerate(segment_indices):
             if adapter_idx not in adapter_weights:
@@ -425,15 +498,26 @@ class BatchLoraWeights(BatchAdapterWeights):
             rank_indices[adapter_weights[adapter_idx].lora_a_r].append(segment_idx)
 
         if prefill_head_indices is not None:
-            j, prefill_head_segment_starts, prefill_head_segment_ends = 1, [0], [0]
-            for head_index in prefill_head_indices:
-                # j cannot go out of bounds as that would mean there are tokens without corresponding adapters
-                if head_index < meta.adapter_segments[j]:
-                    prefill_head_segment_ends[-1] += 1
-                else:
-                    prefill_head_segment_starts.append(prefill_head_segment_ends[-1])
-                    prefill_head_segment_ends.append(prefill_head_segment_ends[-1] + 1)
-                    j += 1
+            # Segments of the rows kept by `prefill_head_indices`, found on the device
+            head_segments = torch.bucketize(
+                prefill_head_indices,
+                meta.adapter_segments[1:].to(prefill_head_indices.dtype),
+                right=True,
+            )
+            head_counts = torch.zeros(
+                len(segment_indices), dtype=torch.int32, device=device
+            )
+            head_counts.index_add_(
+                0, head_segments, torch.ones_like(head_segments, dtype=torch.int32)
+            )
+            prefill_head_segment_ends = head_counts.cumsum(0, dtype=torch.int32)
+            prefill_head_segment_starts = prefill_head_segment_ends - head_counts
+
+        if not use_sgmv:
+            # Adapter index -> segment, looked up for every row on the device
+            adapter_to_segment = torch.empty(
+                max(segment_indices) + 1, dtype=torch.int64, device=device
+            )
 
         rank_data = {}
         for rank, indices in rank_indices.items():
@@ -448,23 +532,21 @@ class BatchLoraWeights(BatchAdapterWeights):
                 tmp_shrink, tmp_expand = punica_sgmv.get_tmp_tensors(
                     lora_a_ptr_indices.size(0), rank, device
                 )
-                segment_starts = meta.adapter_segments[indices]
-                segment_ends = meta.adapter_segments[[i + 1 for i in indices]]
                 if prefill_head_indices is not None:
-                    for i, segment_index in enumerate(indices):
-                        segment_starts[i] = prefill_head_segment_starts[segment_index]
-                        segment_ends[i] = prefill_head_segment_ends[segment_index]
+                    segment_starts = prefill_head_segment_starts[indices]
+                    segment_ends = prefill_head_segment_ends[indices]
+                else:
+                    segment_starts = meta.adapter_segments[indices]
+                    segment_ends = meta.adapter_segments[[i + 1 for i in indices]]
             else:
-                rank_indices = set(indices)
-                batch_indices = [
-                    adapter_to_segment[idx] for idx in meta.adapter_indices.tolist()
-                ]
-                batch_indices = [
-                    idx if idx in rank_indices else -1 for idx in batch_indices
-                ]
-                batch_indices = torch.tensor(
-                    batch_indices, dtype=torch.int64, device=device
+                # The rows of the adapters of the other ranks are skipped (-1), the
+                # rows of an adapter use its last segment
+                rank_segments = {segment_indices[i]: i for i in indices}
+                adapter_to_segment.fill_(-1)
+                adapter_to_segment[list(rank_segments)] = torch.tensor(
+                    list(rank_segments.values()), dtype=torch.int64, device=device
                 )
+                batch_indices = adapter_to_segment[meta.adapter_indices]
 
             rank_data[rank] = RankSegments(
                 rank=rank,
@@ -0,0 +1,316 @@
+import copy
+import os
+import threading
+
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Set, Union
+
+import torch
+from loguru import logger
+from safetensors import safe_open
+from transformers import PreTrainedTokenizer
+
+from text_generation_server.adapters.lora import LoraConfig, LoraWeights
+from text_generation_server.metrics import ADAPTER_EVENTS
+from text_generation_server.utils.adapter import (
+    BASE_MODEL_ADAPTER_ID,
+    AdapterInfo,
+    build_layer_weight_lookup,
+    load_adapter_files,
+)
+
+if TYPE_CHECKING:
+    from text_generation_server.models.model import Model
+
+# Number of adapters kept in device memory. Loading one more adapter evicts the
+# least recently used one, its weights stay in the host tier.
+MAX_ACTIVE_ADAPTERS = int(os.getenv("MAX_ACTIVE_ADAPTERS", "16"))
+# Threads reading adapters into the host tier
+ADAPTER_PREFETCH_THREADS = int(os.getenv("ADAPTER_PREFETCH_THREADS", "4"))
+
+ADAPTER_LAYERS = [
+    "q_proj",
+    "k_proj",
+    "v_proj",
+    "o_proj",
+    "gate_proj",
+    "up_proj",
+    "down_proj",
+    "qkv_proj",
+    # add c_* layers used in starcoder2
+    "c_proj",
+    "c_fc",
+]
+
+
+class MappedAdapterWeights(Mapping):
+    """Tensors of memory mapped safetensors files, read when they are accessed."""
+
+    def __init__(self, filenames: List[Union[str, Path]]):
+        self.files = [safe_open(str(f), framework="pt") for f in filenames]
+        self.key_to_file = {key: f for f in self.files for key in f.keys()}
+
+    def __getitem__(self, key: str) -> torch.Tensor:
+        return self.key_to_file[key].get_tensor(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.key_to_file
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.key_to_file)
+
+    def __len__(self) -> int:
+        return len(self.key_to_file)
+
+    def warm(self):
+        """Read every tensor once to bring the mapped pages into host memory."""
+        for key in self:
+            self[key]
+
+
+@dataclass
+class HostAdapter:
+    info: AdapterInfo
+    config: LoraConfig
+    weights: MappedAdapterWeights
+    tokenizer: Optional[PreTrainedTokenizer]
+
+
+class AdapterManager:
+    """Loads LoRA adapters into a model while it is serving.
+
+    Registered adapters live in two tiers. The host tier keeps the safetensors
+    files of the adapter memory mapped, the device tier holds the prepared weights
+    in `model.layer_to_adapter_weights`. At most `max_active` adapters are on the
+    device: the model steps page in the adapters they use with `activate` and
+    evict the least recently used ones.
+
+    `register` and `prefetch` are called from the event loop, the other methods
+    run on the model executor thread.
+    """
+
+    def __init__(
+        self,
+        model: "Model",
+        adapter_to_index: Dict[str, int],
+        max_active: int = MAX_ACTIVE_ADAPTERS,
+    ):
+        if max_active < 1:
+            raise ValueError("MAX_ACTIVE_ADAPTERS must be at least 1")
+        self.model = model
+        # Shared with `FlashCausalLMBatch` through `set_adapter_to_index`
+        self.adapter_to_index = adapter_to_index
+        self.max_active = max_active
+
+        self.adapters: Dict[str, AdapterInfo] = {}
+        self.index_to_adapter: Dict[int, str] = {}
+        self.host: Dict[str, Future] = {}
+        # Adapters on the device, least recently used first
+        self.active: OrderedDict[str, int] = OrderedDict()
+
+        self._next_index = max(adapter_to_index.values(), default=0) + 1
+        self._target_to_layer = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=ADAPTER_PREFETCH_THREADS,
+            thread_name_prefix="adapter-prefetch",
+        )
+
+    def register(self, adapter: AdapterInfo) -> int:
+        """Assign an index to `adapter`, kept until the adapter is unloaded."""
+        if adapter.id == BASE_MODEL_ADAPTER_ID:
+            raise ValueError(f"{BASE_MODEL_ADAPTER_ID} is reserved for the base model")
+        with self._lock:
+            known = self.adapters.get(adapter.id)
+            if known is not None and known != adapter:
+                if adapter.id in self.active:
+                    raise ValueError(
+                        f"Adapter {adapter.id} is already loaded from "
+                        f"{known.path or known.id}, unload it first"
+                    )
+                self.host.pop(adapter.id, None)
+            self.adapters[adapter.id] = adapter
+
+            index = self.adapter_to_index.get(adapter.id)
+            if index is None:
+                index = self._next_index
+                self._next_index += 1
+                self.adapter_to_index[adapter.id] = index
+                self.index_to_adapter[index] = adapter.id
+            return index
+
+    def prefetch(self, adapter_id: str) -> Future:
+        """Read a registered adapter into the host tier in the background."""
+        with self._lock:
+            future = self.host.get(adapter_id)
+            if future is None:
+                future = self._pool.submit(self._load_host, self.adapters[adapter_id])
+                self.host[adapter_id] = future
+            return future
+
+    def prefetch_cold(self, adapter_ids: Iterable[str]) -> List[Future]:
+        """Prefetch the registered adapters of `adapter_ids` that are not on the device.
+
+        Unknown adapter ids are ignored, their requests use the base model.
+        """
+        return [
+            self.prefetch(adapter_id)
+            for adapter_id in set(adapter_ids)
+            if adapter_id in self.adapters and adapter_id not in self.active
+        ]
+
+    # The methods below run on the model executor thread
+
+    def load(self, adapter: AdapterInfo) -> int:
+        """Register `adapter` and page it into device memory."""
+        index = self.register(adapter)
+        if adapter.id in self.active:
+            self.active.move_to_end(adapter.id)
+        else:
+            self._page_in(adapter.id, index, {index})
+        return index
+
+    def unload(self, adapter_id: str, in_use: Set[int]):
+        """Forget an adapter. Adapters used by a cached batch cannot be unloaded."""
+        if adapter_id not in self.adapters:
+            raise ValueError(f"Adapter {adapter_id} is not loaded")
+        index = self.adapter_to_index[adapter_id]
+        if index in in_use:
+            raise ValueError(f"Adapter {adapter_id} is used by a running batch")
+        if self.active.pop(adapter_id, None) is not None:
+            self._remove_device(index)
+        with self._lock:
+            del self.adapters[adapter_id]
+            del self.adapter_to_index[adapter_id]
+            del self.index_to_adapter[index]
+            self.host.pop(adapter_id, None)
+        logger.info(f"Unloaded adapter {adapter_id}")
+
+    def activate(self, indices: Set[int]) -> bool:
+        """Make sure the registered adapters of `indices` are on the device.
+
+        Adapters that fail to load are unregistered and their requests use the
+        base model. Returns True if any adapter weights were paged in.
+        """
+        changed = False
+        for index in indices:
+            adapter_id = self.index_to_adapter.get(index)
+            if adapter_id is None:
+                continue
+            if adapter_id in self.active:
+                self.active.move_to_end(adapter_id)
+                continue
+            try:
+                self._page_in(adapter_id, index, indices)
+            except Exception:
+                logger.exception(f"Could not load adapter {adapter_id}")
+                continue
+            changed = True
+        return changed
+
+    def _page_in(self, adapter_id: str, index: int, keep: Set[int]):
+        self._make_room(keep)
+        try:
+            self._load_device(adapter_id, index)
+        except Exception:
+            # Unregister the adapter so that its requests use the base model
+            self._remove_device(index)
+            self.unload(adapter_id, set())
+            raise
+
+    def _make_room(self, keep: Set[int]):
+        while len(self.active) >= self.max_active:
+            victim = next(
+                (
+                    adapter_id
+                    for adapter_id, index in self.active.items()
+                    if index not in keep
+                ),
+                None,
+            )
+            if victim is None:
+                logger.warning(
+                    f"The batch uses more than {self.max_active} adapters, "
+                    "exceeding MAX_ACTIVE_ADAPTERS"
+                )
+                return
+            self._remove_device(self.active.pop(victim))
+            ADAPTER_EVENTS.labels("eviction").inc()
+            logger.info(f"Evicted adapter {victim} from device memory")
+
+    def _load_host(self, adapter: AdapterInfo) -> HostAdapter:
+        adapter_config, filenames, tokenizer = load_adapter_files(
+            self.model.model_id, adapter.revision, adapter.id, adapter.path
+        )
+        weights = MappedAdapterWeights(filenames)
+        weights.warm()
+        ADAPTER_EVENTS.labels("host_load").inc()
+        return HostAdapter(adapter, adapter_config, weights, tokenizer)
+
+    def _load_device(self, adapter_id: str, index: int):
+        future = self.prefetch(adapter_id)
+        try:
+            host = future.result()
+        except Exception:
+            # Allow a later load to try again
+            with self._lock:
+                if self.host.get(adapter_id) is future:
+                    del self.host[adapter_id]
+            raise
+
+        if self._target_to_layer is None:
+            self._target_to_layer = build_layer_weight_lookup(self.model.model)
+        target_to_layer = self._target_to_layer
+
+        logger.info(f"Loading adapter weights into model: {adapter_id}")
+        # `prepare_weights` updates the rank of the config with the padded rank
+        adapter_config = copy.copy(host.config)
+        weight_names = tuple([v[0] for v in target_to_layer.values()])
+        module_map, adapter_weight_names = adapter_config.map_weights_for_model(
+            host.weights, weight_names
+        )
+
+        unused_weight_names = adapter_weight_names.copy()
+        for layer_name in ADAPTER_LAYERS:
+            nlayers = (
+                1 if layer_name == "lm_head" else len(self.model.model.model.layers)
+            )
+            adapter_weights = LoraWeights.prepare_weights(
+                config=adapter_config,
+                module_map=module_map,
+                layer_type=layer_name,
+                unused_weight_names=unused_weight_names,
+                nlayers=nlayers,
+                dtype=self.model.dtype,
+                world_size=self.model.world_size,
+                process_group=self.model.process_group,
+                target_to_layer=target_to_layer,
+            )
+
+            if adapter_weights is None:
+                continue
+
+            self.model.layer_to_adapter_weights[layer_name].add_adapter(
+                index, adapter_weights
+            )
+
+        if len(unused_weight_names) > 0:
+            logger.warning(
+                f"{adapter_id} unused adapter weights: {unused_weight_names}"
+            )
+
+        if host.tokenizer is not None:
+            self.model.tokenizers.add_tokenizer(index, host.tokenizer)
+
+        self.model.loaded_adapters.add(index)
+        self.active[adapter_id] = index
+        ADAPTER_EVENTS.labels("device_load").inc()
+
+    def _remove_device(self, index: int):
+        for layer_weights in self.model.layer_to_adapter_weights.values():
+            layer_weights.remove_adapter(index)
+        self.model.loaded_adapters.discard(index)
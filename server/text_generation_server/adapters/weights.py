@@ -52,6 +52,10 @@ class BatchAdapterWeights(ABC):
     ) -> Optional["BatchAdapterWeights"]:
         pass
 
+    def filter(self, indices: torch.Tensor) -> Optional["BatchAdapterWeights"]:
+        """Keep the rows `indices` of a decode batch, None if they must be reloaded."""
+        return None
+
 
 class LayerAdapterWeights:
     """Adapter weights that apply to a particular layer."""
@@ -119,6 +123,25 @@ class AdapterBatchData:
             )
         return AdapterBatchData(meta=meta, data=data, prefill=prefill)
 
+    def filter(
+        self, meta: AdapterBatchMetadata, indices: torch.Tensor
+    ) -> Optional["AdapterBatchData"]:
+        """Keep the rows `indices` without loading the weights again.
+
+        Returns None when the segments of `meta` do not map to the same adapters as the
+        current ones, in which case `from_meta` must be used.
+        """
+        if self.prefill or meta.segment_indices != self.meta.segment_indices:
+            return None
+        data = {}
+        for layer_name, layer_data in self.data.items():
+            if isinstance(layer_data, BatchAdapterWeights):
+                layer_data = layer_data.filter(indices)
+                if layer_data is None:
+                    return None
+            data[layer_name] = layer_data
+        return AdapterBatchData(meta=meta, data=data, prefill=False)
+
     def ranks(self) -> Set[int]:
         # TODO(travis): refactor to be less coupled to lora implementation
         ranks = set()
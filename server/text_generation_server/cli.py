@@ -4,7 +4,7 @@ import typer
 
 from pathlib import Path
 from loguru import logger
-from typing import Optional
+from typing import List, Optional
 from enum import Enum
 from huggingface_hub import hf_hub_download
 from text_generation_server.utils.adapter import parse_lora_adapters
@@ -131,6 +131,148 @@ def serve(
     )
 
 
+@app.command()
+def replay(
+    model_id: str,
+    recording: Path,
+    revision: Optional[str] = None,
+    quantize: Optional[Quantization] = None,
+    speculate: Optional[int] = None,
+    dtype: Optional[Dtype] = None,
+    kv_cache_dtype: Optional[KVCacheDtype] = None,
+    trust_remote_code: bool = False,
+    max_input_tokens: Optional[int] = None,
+    realtime: bool = False,
+    logger_level: str = "INFO",
+    json_output: bool = False,
+):
+    """Replay a shard traffic recording (see `SHARD_RECORD_PATH`) on a local model."""
+    # Remove default handler
+    logger.remove()
+    logger.add(
+        sys.stdout,
+        format="{message}",
+        filter="text_generation_server",
+        level=logger_level,
+        serialize=json_output,
+        backtrace=True,
+        diagnose=False,
+    )
+
+    # Never record the replayed traffic over the recording
+    os.environ.pop("SHARD_RECORD_PATH", None)
+
+    from text_generation_server.recorder import read_recording
+
+    calls = read_recording(recording)
+    header = next(calls, None)
+    if header is None or header.WhichOneof("request") != "info":
+        raise RuntimeError(f"{recording} is not a shard traffic recording")
+    info = header.info
+
+    # The recorded batches depend on the attention implementation (block size, slots)
+    os.environ.setdefault("ATTENTION", info.attention_impl)
+    os.environ.setdefault("PREFIX_CACHING", "1" if info.use_prefix_caching else "0")
+    if os.environ["ATTENTION"] != info.attention_impl:
+        logger.warning(
+            f"Replaying a {info.attention_impl} recording with ATTENTION={os.environ['ATTENTION']}"
+        )
+
+    # Import here after the environment is set up
+    import asyncio
+
+    from text_generation_server.cache import Cache
+    from text_generation_server.executor import ModelExecutor
+    from text_generation_server.models import get_model_with_lora_adapters
+    from text_generation_server.models.globals import set_adapter_to_index
+    from text_generation_server.recorder import replay as replay_calls, report
+    from text_generation_server.server import TextGenerationService
+
+    quantize = None if quantize is None else quantize.value
+    dtype = None if dtype is None else dtype.value
+    kv_cache_dtype = None if kv_cache_dtype is None else kv_cache_dtype.value
+
+    adapter_to_index = {}
+    model = get_model_with_lora_adapters(
+        model_id,
+        parse_lora_adapters(os.getenv("LORA_ADAPTERS")),
+        revision,
+        False,
+        quantize,
+        speculate,
+        dtype,
+        kv_cache_dtype,
+        trust_remote_code,
+        max_input_tokens,
+        adapter_to_index,
+    )
+    set_adapter_to_index(adapter_to_index)
+
+    async def replay_inner():
+        executor = ModelExecutor(model.device)
+        service = TextGenerationService(model, Cache(), [], executor)
+        try:
+            return await replay_calls(service, calls, realtime)
+        finally:
+            executor.shutdown()
+
+    report(asyncio.run(replay_inner()))
+
+
+@app.command()
+def expert_placement(
+    ranks: int,
+    metrics: List[str],
+    replicas: int = 0,
+    output: Optional[Path] = None,
+):
+    """Propose an expert parallel placement from the MoE expert counters.
+
+    `metrics` are shard metrics endpoints (`MOE_EXPERT_LOAD=1`) or files saved from
+    them, one shard per replica since the shards of a replica see the same routing.
+    `replicas` additional copies of the hottest experts are placed in each layer.
+    """
+    import json
+
+    from text_generation_server.utils.expert_placement import (
+        merge_expert_load,
+        parse_expert_load,
+        propose_placement,
+        read_metrics,
+    )
+
+    loads = merge_expert_load(
+        [parse_expert_load(read_metrics(source)) for source in metrics]
+    )
+    if not loads:
+        raise RuntimeError(f"No expert counters found in {metrics}")
+
+    placements = {}
+    print(f"{'layer':<48} {'contiguous':>10} {'proposed':>10}  replicated")
+    for layer, counts in sorted(loads.items()):
+        placement = propose_placement(counts, ranks, replicas)
+        replicated = {
+            expert: copies
+            for expert, copies in enumerate(placement.copies)
+            if copies > 1
+        }
+        print(
+            f"{layer:<48} {placement.contiguous_imbalance:>10.2f} "
+            f"{placement.imbalance:>10.2f}  {replicated}"
+        )
+        placements[layer] = {
+            "experts": placement.experts,
+            "copies": placement.copies,
+            "rank_loads": placement.rank_loads,
+            "imbalance": placement.imbalance,
+            "contiguous_imbalance": placement.contiguous_imbalance,
+        }
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(placements, f, indent=2)
+
+
 @app.command()
 def download_weights(
     model_id: str,
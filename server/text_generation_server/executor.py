@@ -0,0 +1,50 @@
+import asyncio
+import time
+import torch
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from text_generation_server.metrics import EXECUTOR_QUEUE_DURATION
+
+T = TypeVar("T")
+
+
+class ModelExecutor:
+    """Runs model steps on a single dedicated thread.
+
+    The gRPC handlers are coroutines: running `generate_token` directly on the
+    event loop blocks every other RPC (`Health`, `Info`, `ClearCache`, ...) for
+    the duration of the step. All model work is submitted here instead and
+    executed in FIFO order, one step at a time.
+    """
+
+    def __init__(self, device: torch.device):
+        self.device = device
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="model-executor",
+            initializer=self._initialize_thread,
+        )
+
+    def _initialize_thread(self):
+        # Grad mode and the current device are thread local
+        torch.set_grad_enabled(False)
+        if self.device.type == "cuda":
+            torch.cuda.set_device(self.device)
+        elif self.device.type == "xpu":
+            torch.xpu.set_device(self.device)
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Schedule `fn(*args, **kwargs)` on the model thread and await its result."""
+        queued = time.perf_counter()
+
+        def _call():
+            EXECUTOR_QUEUE_DURATION.observe(time.perf_counter() - queued)
+            return fn(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _call)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -1,3 +1,4 @@
+import inspect
 import torch
 import grpc
 
@@ -5,7 +6,7 @@ from google.rpc import status_pb2, code_pb2
 from grpc_status import rpc_status
 from grpc_interceptor.server import AsyncServerInterceptor
 from loguru import logger
-from typing import Callable, Any
+from typing import AsyncIterator, Callable, Any
 
 
 class ExceptionInterceptor(AsyncServerInterceptor):
@@ -21,20 +22,40 @@ class ExceptionInterceptor(AsyncServerInterceptor):
     ) -> Any:
         try:
             response = method(request_or_iterator, context)
+            # Streaming handlers are async generators that cannot be awaited
+            if inspect.isasyncgen(response):
+                return self._intercept_stream(response, context, method_name)
             return await response
         except Exception as err:
-            method_name = method_name.split("/")[-1]
-            logger.exception(f"Method {method_name} encountered an error.")
+            await self._handle_error(err, context, method_name)
 
-            # Runtime Error cannot be recovered from
-            if isinstance(err, RuntimeError):
-                self.shutdown_callback()
+    async def _intercept_stream(
+        self,
+        response: AsyncIterator[Any],
+        context: grpc.ServicerContext,
+        method_name: str,
+    ) -> AsyncIterator[Any]:
+        try:
+            async for item in response:
+                yield item
+        except Exception as err:
+            await self._handle_error(err, context, method_name)
+
+    async def _handle_error(
+        self, err: Exception, context: grpc.ServicerContext, method_name: str
+    ):
+        method_name = method_name.split("/")[-1]
+        logger.exception(f"Method {method_name} encountered an error.")
+
+        # Runtime Error cannot be recovered from
+        if isinstance(err, RuntimeError):
+            self.shutdown_callback()
 
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
-            await context.abort_with_status(
-                rpc_status.to_status(
-                    status_pb2.Status(code=code_pb2.INTERNAL, message=str(err))
-                )
+        await context.abort_with_status(
+            rpc_status.to_status(
+                status_pb2.Status(code=code_pb2.INTERNAL, message=str(err))
             )
+        )
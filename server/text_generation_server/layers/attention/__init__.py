@@ -1,12 +1,20 @@
 import os
 
+from text_generation_server.models.globals import ATTENTION
 from text_generation_server.utils.import_utils import SYSTEM
 
 from .common import Seqlen
 
 if os.getenv("USE_FLASH_ATTENTION", "").lower() == "false":
     raise ImportError("`USE_FLASH_ATTENTION` is false.")
-if SYSTEM == "cuda":
+if ATTENTION == "torch":
+    # Plain PyTorch, on any system
+    from .native import (
+        SUPPORTS_WINDOWING,
+        attention,
+        paged_attention,
+    )
+elif SYSTEM == "cuda":
     from .cuda import (
         SUPPORTS_WINDOWING,
         attention,
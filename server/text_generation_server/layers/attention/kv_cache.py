@@ -89,7 +89,7 @@ class KVCache:
         else:
             x = BLOCK_SIZE // element_size
 
-        if ATTENTION in {"flashdecoding", "flashinfer"} or (
+        if ATTENTION in {"flashdecoding", "flashinfer", "torch"} or (
             ATTENTION == "flashdecoding-ipex" and device.type == "xpu"
         ):
             self.kv_cache = (
@@ -197,7 +197,7 @@ class KVCache:
                     scalar=True,
                 )[0]
 
-        if ATTENTION in {"flashdecoding", "flashinfer"}:
+        if ATTENTION in {"flashdecoding", "flashinfer", "torch"}:
             key = key.to(key_cache.dtype)
             value = value.to(value_cache.dtype)
             if key_cache.dtype in {torch.float8_e4m3fn, torch.float8_e5m2}:
@@ -0,0 +1,174 @@
+import torch
+import torch.nn.functional as F
+from typing import Optional
+
+from text_generation_server.layers.attention.kv_cache import KVCache, KVScales
+from text_generation_server.layers.attention import Seqlen
+from text_generation_server.models.globals import BLOCK_SIZE
+
+# Plain PyTorch attention (`ATTENTION=torch`), it runs on any device and does not
+# need any kernel. The KV cache uses the flashdecoding layout
+# `[num_blocks, BLOCK_SIZE, num_heads, head_size]` and the keys/values of a
+# sequence are gathered from its blocks.
+
+SUPPORTS_WINDOWING = True
+
+
+def _gather_kv(kv_cache: KVCache, block_table: torch.Tensor, length: int):
+    """Keys and values of the first `length` positions of a sequence."""
+    num_blocks = (length + BLOCK_SIZE - 1) // BLOCK_SIZE
+    blocks = block_table[:num_blocks].long()
+    key = kv_cache.key[blocks].flatten(0, 1)[:length]
+    value = kv_cache.value[blocks].flatten(0, 1)[:length]
+    return key, value
+
+
+def _attention_mask(
+    q_positions: torch.Tensor,
+    k_positions: torch.Tensor,
+    causal: bool,
+    window_size_left: int,
+) -> Optional[torch.Tensor]:
+    """Boolean mask of the keys each query attends to, None when it is all of them."""
+    mask = None
+    if causal:
+        mask = k_positions <= q_positions
+    if window_size_left != -1:
+        window = k_positions >= q_positions - window_size_left
+        mask = window if mask is None else mask & window
+    return mask
+
+
+def _sdpa(
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+    mask: Optional[torch.Tensor],
+    softmax_scale: float,
+    softcap: Optional[float],
+) -> torch.Tensor:
+    """Attention of `query` [..., q, heads, head_size] over `key`/`value`."""
+    num_heads = query.shape[-2]
+    num_kv_heads = key.shape[-2]
+    query = query.transpose(-3, -2)
+    key = key.transpose(-3, -2)
+    value = value.transpose(-3, -2)
+    if num_kv_heads != num_heads:
+        key = key.repeat_interleave(num_heads // num_kv_heads, dim=-3)
+        value = value.repeat_interleave(num_heads // num_kv_heads, dim=-3)
+    if mask is not None:
+        # Broadcast over the heads
+        mask = mask.unsqueeze(-3)
+
+    if softcap is None:
+        out = F.scaled_dot_product_attention(
+            query, key, value, attn_mask=mask, scale=softmax_scale
+        )
+    else:
+        scores = torch.matmul(query.float(), key.float().transpose(-1, -2))
+        scores = softcap * torch.tanh(scores * softmax_scale / softcap)
+        if mask is not None:
+            scores = scores.masked_fill(~mask, float("-inf"))
+        out = torch.matmul(scores.softmax(dim=-1), value.float()).to(query.dtype)
+    return out.transpose(-3, -2)
+
+
+def attention(
+    *,
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+    kv_cache: KVCache,
+    kv_scales: KVScales,
+    seqlen: Seqlen,
+    block_tables: torch.Tensor,
+    softmax_scale: float,
+    window_size_left: int = -1,
+    causal: bool = True,
+    softcap: Optional[float] = None,
+):
+    """Prefill attention, the keys/values were already stored in the cache.
+
+    The queries of a sequence are its last positions, the first ones come from
+    the prefix cache or from the previous chunks.
+    """
+    if window_size_left <= 0 and window_size_left != -1:
+        raise ValueError("`window_size_left` must be > 0 or -1")
+
+    out = torch.empty_like(query)
+    cu_seqlen_q = seqlen.cu_seqlen_q.tolist()
+    cu_seqlen_k = seqlen.cu_seqlen_k.tolist()
+    for i in range(len(cu_seqlen_q) - 1):
+        q_start, q_end = cu_seqlen_q[i], cu_seqlen_q[i + 1]
+        k_length = cu_seqlen_k[i + 1] - cu_seqlen_k[i]
+        if q_end == q_start:
+            continue
+        seq_key, seq_value = _gather_kv(kv_cache, block_tables[i], k_length)
+        positions = torch.arange(k_length, device=query.device)
+        mask = _attention_mask(
+            positions[k_length - (q_end - q_start) :, None],
+            positions[None, :],
+            causal,
+            window_size_left,
+        )
+        out[q_start:q_end] = _sdpa(
+            query[q_start:q_end],
+            seq_key.to(query.dtype),
+            seq_value.to(query.dtype),
+            mask,
+            softmax_scale,
+            softcap,
+        )
+    return out
+
+
+def paged_attention(
+    query: torch.Tensor,
+    kv_cache: KVCache,
+    kv_head_mapping: torch.Tensor,
+    softmax_scale: float,
+    block_tables: torch.Tensor,
+    seqlen: Seqlen,
+    max_s: int,
+    *,
+    kv_scales: KVScales,
+    softcap: Optional[float] = None,
+    window_size_left: Optional[int] = -1,
+):
+    """Decode attention, one query per sequence.
+
+    The blocks of all the sequences are gathered at once, padded to the longest
+    block table and masked, so that no host synchronization is needed.
+    """
+    # [batch_size, max_blocks * BLOCK_SIZE, num_heads, head_size]
+    blocks = block_tables.long()
+    key = kv_cache.key[blocks].flatten(1, 2).to(query.dtype)
+    value = kv_cache.value[blocks].flatten(1, 2).to(query.dtype)
+
+    lengths = (seqlen.input_lengths + seqlen.cache_lengths).view(-1, 1)
+    positions = torch.arange(key.shape[1], device=query.device).view(1, -1)
+    mask = positions < lengths
+    if window_size_left is not None and window_size_left != -1:
+        # The query is at position `lengths - 1`
+        mask = mask & (positions >= lengths - 1 - window_size_left)
+    # The padding and the unwritten slots of the blocks are not initialized, a
+    # NaN in there would survive the mask of the scores
+    key = key.masked_fill(~mask[..., None, None], 0)
+    value = value.masked_fill(~mask[..., None, None], 0)
+
+    out = _sdpa(
+        query.unsqueeze(1),
+        key,
+        value,
+        mask.unsqueeze(1),
+        softmax_scale,
+        softcap,
+    )
+    return out.squeeze(1)
+
+
+__all__ = [
+    "SUPPORTS_WINDOWING",
+    "attention",
+    "paged_attention",
+]
@@ -97,6 +97,16 @@ elif SYSTEM == "ipex":
             )
             return out, residual if residual is not None else hidden_states
 
+else:
+
+    class FastLayerNorm(nn.LayerNorm):
+        def forward(self, hidden_states, residual=None):
+            if residual is not None:
+                hidden_states += residual
+            residual = hidden_states
+
+            return super().forward(hidden_states), residual
+
 
 class FastRMSNorm(nn.Module):
     def __init__(self, weight: torch.Tensor, eps: float):
@@ -142,7 +152,7 @@ class FastRMSNorm(nn.Module):
                 self.variance_epsilon,
             )
             return out, residual
-        elif hidden_states.shape[-1] > 8192:
+        elif hidden_states.shape[-1] > 8192 or SYSTEM != "cuda":
             if residual is not None:
                 hidden_states += residual
             residual = hidden_states
@@ -158,7 +168,7 @@ class FastRMSNorm(nn.Module):
                 hidden_states = hidden_states.to(self.weight.dtype)
 
             return self.weight * hidden_states, residual
-        elif SYSTEM == "cuda":
+        else:
             # faster post attention rms norm
             (
                 normed_hidden_states,
@@ -185,7 +195,3 @@ class FastRMSNorm(nn.Module):
                 res = hidden_states
 
             return normed_hidden_states, res
-        else:
-            raise ValueError(
-                "Your system seem to be not supported. Please check your install or open an issue at https://github.com/huggingface/text-generation-inference/issues with a clear reproduction."
-            )
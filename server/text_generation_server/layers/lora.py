@@ -194,6 +194,8 @@ class LoraLinear(nn.Module):
 
             if end_idx - start_idx != result.shape[1]:
                 result[:, start_idx:end_idx] += proj
+        elif data is not None and data.groups is not None:
+            self.forward_grouped(result, input, data, start_idx, end_idx)
         else:
             for adapter_index in adapter_data.meta.adapter_set:
                 if data is not None and data.has_adapter(adapter_index):
@@ -209,6 +211,41 @@ class LoraLinear(nn.Module):
 
         return result
 
+    def forward_grouped(
+        self,
+        result: torch.Tensor,
+        input: torch.Tensor,
+        data: "BatchLoraWeights",
+        start_idx: int,
+        end_idx: int,
+    ):
+        # One matmul per adapter on its own rows: the cost grows with the number
+        # of rows instead of the number of adapters times the number of rows
+        order = data.groups.order
+        if order is None:
+            proj = result[:, start_idx:end_idx]
+        else:
+            input = input[order]
+            # Rows without adapter weights keep a zero update
+            proj = torch.zeros(
+                (input.size(0), end_idx - start_idx),
+                dtype=result.dtype,
+                device=result.device,
+            )
+
+        for adapter_index, start, end in data.groups.groups:
+            lora_a = data.lora_a[adapter_index][self.layer_id, :, :]
+            lora_b = data.lora_b[adapter_index][self.layer_id, :, :]
+
+            a_out = input[start:end] @ lora_a
+            if self.process_group.size() > 1:
+                a_out = self.collect_lora_a(a_out)
+            proj[start:end] += a_out @ lora_b
+
+        if order is not None:
+            # Scatter the rows back to their position in the batch
+            result[:, start_idx:end_idx].index_add_(0, order, proj)
+
     def forward_lora(
         self,
         input: torch.Tensor,
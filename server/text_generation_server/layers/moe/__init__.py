@@ -17,6 +17,7 @@ from text_generation_server.layers.moe.gptq_marlin import (
 )
 from text_generation_server.layers.moe.unquantized import UnquantizedSparseMoELayer
 from text_generation_server.layers.moe.fp8 import FP8SparseMoELayer
+from text_generation_server.utils.expert_load import expert_load
 from text_generation_server.utils.import_utils import SYSTEM
 from text_generation_server.utils.kernels import load_kernel
 from text_generation_server.utils.log import log_once
@@ -26,14 +27,15 @@ from text_generation_server.utils.weights import (
     UnquantizedWeight,
 )
 
-if SYSTEM == "ipex":
-    from .fused_moe_ipex import fused_topk, grouped_topk
-elif SYSTEM == "cuda":
+if SYSTEM == "cuda":
     moe_kernels = load_kernel(module="moe", repo_id="kernels-community/moe")
     fused_topk = moe_kernels.fused_topk
     grouped_topk = moe_kernels.grouped_topk
-else:
+elif SYSTEM == "rocm":
     from moe_kernels.fused_moe import fused_topk, grouped_topk
+else:
+    # Plain PyTorch routing, for ipex and for systems without MoE kernels
+    from .fused_moe_ipex import fused_topk, grouped_topk
 
 
 # NOTE: we are using a protocol here, because multiple inherance is not nice.
@@ -68,10 +70,15 @@ class MoELayer(Protocol):
 
 class DenseMoELayer(nn.Module):
     """
-    Layer for MoE that applies *all* experts to each tokens and then weights
-    their outputs based on the calculated routing. This layer is much slower
-    than `SparseMoELayer` and should only be used when no fused kernels are
-    available (e.g. for unsupported quantizers).
+    Layer for MoE that does not need fused kernels (e.g. for unsupported
+    quantizers). Tokens are sorted by their selected experts and each expert
+    is applied to its own tokens only, using the linear layers of the
+    quantizer. This layer is slower than `SparseMoELayer` and should only be
+    used when no fused kernels are available.
+
+    During CUDA graph capture, the number of tokens of each expert cannot be
+    read back, so *all* experts are applied to each token and their outputs
+    are weighted based on the calculated routing.
     """
 
     def __init__(
@@ -98,7 +105,7 @@ class DenseMoELayer(nn.Module):
 
         log_once(
             logger.info,
-            "No fused layers are available for this model type, using (slower) dense MoE layer",
+            "No fused layers are available for this model type, using (slower) unfused MoE layer",
         )
 
         assert (n_expert_group is None) == (
@@ -154,6 +161,7 @@ class DenseMoELayer(nn.Module):
         ]
 
         self.process_group = weights.process_group
+        self.expert_load = expert_load(prefix, n_experts, weights.device)
 
     def forward(self, x: torch.Tensor, *, gating_output: torch.Tensor) -> torch.Tensor:
         """
@@ -179,6 +187,43 @@ class DenseMoELayer(nn.Module):
             )
             topk_weights = topk_weights.to(x.dtype)
 
+        if self.expert_load is not None:
+            self.expert_load.record(topk_ids)
+
+        if torch.cuda.is_available() and torch.cuda.is_current_stream_capturing():
+            return self._apply_all_experts(x, topk_weights, topk_ids)
+        return self._apply_selected_experts(x, topk_weights, topk_ids)
+
+    def _apply_selected_experts(
+        self, x: torch.Tensor, topk_weights: torch.Tensor, topk_ids: torch.Tensor
+    ) -> torch.Tensor:
+        # Sort the (token, expert) pairs by expert, the stable sort keeps the
+        # tokens of an expert in order.
+        flat_ids = topk_ids.reshape(-1).long()
+        order = torch.argsort(flat_ids, stable=True)
+        token_indices = order // topk_ids.shape[1]
+        sorted_weights = topk_weights.reshape(-1)[order].to(x.dtype)
+        # Single synchronization to get the number of tokens of each expert.
+        counts = torch.bincount(flat_ids, minlength=self.n_experts).tolist()
+
+        out = torch.zeros_like(x)
+        start = 0
+        for i, count in enumerate(counts):
+            if count == 0:
+                continue
+            end = start + count
+            indices = token_indices[start:end]
+            h = x[indices]
+            h = self.act(self.gate_proj[i](h)) * self.up_proj[i](h)
+            h = self.down_proj[i](h, reduce=False)
+            out.index_add_(0, indices, h * sorted_weights[start:end].view(-1, 1))
+            start = end
+
+        return out
+
+    def _apply_all_experts(
+        self, x: torch.Tensor, topk_weights: torch.Tensor, topk_ids: torch.Tensor
+    ) -> torch.Tensor:
         weights = torch.zeros(
             topk_ids.shape[0], self.n_experts, dtype=x.dtype, device=x.device
         )
@@ -262,11 +307,48 @@ class SparseMoELayer(nn.Module):
             down_proj_name=down_proj_name,
         )
 
+        self.expert_load = expert_load(prefix, n_experts, weights.device)
+        if self.expert_load is not None:
+            self.n_expert_group = n_expert_group
+            self.renormalize = renormalize
+            self.topk = topk
+            self.topk_group = topk_group
+            self.scoring_func = scoring_func
+            self.e_score_correction_bias = e_score_correction_bias
+
     def forward(self, x: torch.Tensor, *, gating_output: torch.Tensor) -> torch.Tensor:
+        if self.expert_load is not None:
+            self.expert_load.record(self._select_experts(x, gating_output))
         return self.moe(x, gating_output=gating_output)
 
+    def _select_experts(
+        self, x: torch.Tensor, gating_output: torch.Tensor
+    ) -> torch.Tensor:
+        # The fused layers do not return their routing, compute it again
+        if self.n_expert_group is not None and self.topk_group is not None:
+            kwargs = {}
+            if self.scoring_func not in (None, "softmax"):
+                kwargs["scoring_func"] = self.scoring_func
+            if self.e_score_correction_bias is not None:
+                kwargs["e_score_correction_bias"] = self.e_score_correction_bias
+            _, topk_ids = grouped_topk(
+                x,
+                gating_output,
+                self.topk,
+                renormalize=self.renormalize,
+                num_expert_group=self.n_expert_group,
+                topk_group=self.topk_group,
+                **kwargs,
+            )
+        else:
+            _, topk_ids = fused_topk(x, gating_output, self.topk, self.renormalize)
+        return topk_ids
+
     @staticmethod
     def is_supported(weights: Weights) -> bool:
+        if SYSTEM not in {"cuda", "rocm", "ipex"}:
+            # No fused MoE kernels
+            return False
         return (
             (
                 isinstance(weights.loader, DefaultWeightsLoader)
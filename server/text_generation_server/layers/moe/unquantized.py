@@ -11,8 +11,10 @@ if SYSTEM == "ipex":
     from intel_extension_for_pytorch.llm.modules import GatedMLPMOE
 elif SYSTEM == "cuda":
     moe_kernels = load_kernel(module="moe", repo_id="kernels-community/moe")
-else:
+elif SYSTEM == "rocm":
     import moe_kernels
+else:
+    moe_kernels = None
 
 
 class UnquantizedSparseMoELayer(nn.Module):
@@ -0,0 +1,75 @@
+import os
+import torch
+
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from text_generation_server.layers.speculative import SpeculativeHead
+
+# Number of prompt tokens projected on the vocabulary at once when computing the
+# prompt logprobs, 0 materializes the logits of the whole prompt.
+PROMPT_LOGPROBS_CHUNK_SIZE = int(os.getenv("PROMPT_LOGPROBS_CHUNK_SIZE", "512"))
+
+
+def token_logprobs(logits: torch.Tensor, target_ids: torch.Tensor) -> torch.Tensor:
+    """Logprob of `target_ids[i]` under `logits[i]`, in float32."""
+    logits = logits.float()
+    target_logits = logits.gather(1, target_ids.view(-1, 1)).view(-1)
+    return target_logits - torch.logsumexp(logits, -1)
+
+
+class PromptLogprobs:
+    """Logprobs of the prompt tokens, computed in the LM head by chunks of tokens.
+
+    The hidden states of a chunk are projected on the vocabulary and only the
+    logprob of the target token is kept, so that the logits of the whole prompt
+    are never materialized. The head then only returns the logits of the
+    `next_token_indices` rows, that the next tokens are sampled from.
+    """
+
+    def __init__(
+        self,
+        target_ids: torch.Tensor,
+        next_token_indices: torch.Tensor,
+        chunk_size: int = PROMPT_LOGPROBS_CHUNK_SIZE,
+    ):
+        self.target_ids = target_ids
+        self.next_token_indices = next_token_indices
+        self.chunk_size = chunk_size
+        # Logprob of each target token, set when the head ran
+        self.logprobs: Optional[torch.Tensor] = None
+
+    def score(
+        self,
+        head: Callable[[torch.Tensor], torch.Tensor],
+        hidden_states: torch.Tensor,
+        logits_processor: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+    ) -> torch.Tensor:
+        """Score the targets and return the hidden states of the next tokens."""
+        if self.logprobs is not None or len(hidden_states) != len(self.target_ids):
+            # Not the hidden states of the prompt, e.g. another head of the model
+            return hidden_states
+
+        logprobs = torch.empty(
+            len(hidden_states), dtype=torch.float32, device=hidden_states.device
+        )
+        for start in range(0, len(hidden_states), self.chunk_size):
+            end = start + self.chunk_size
+            logits = head(hidden_states[start:end])
+            if logits_processor is not None:
+                logits = logits_processor(logits)
+            logprobs[start:end] = token_logprobs(logits, self.target_ids[start:end])
+        self.logprobs = logprobs
+        return hidden_states[self.next_token_indices]
+
+    @contextmanager
+    def scoring(self, model: torch.nn.Module):
+        """Score the prompt in the LM heads of `model` during the forward."""
+        heads = [m for m in model.modules() if isinstance(m, SpeculativeHead)]
+        for head in heads:
+            head.prompt_logprobs = self
+        try:
+            yield self
+        finally:
+            for head in heads:
+                head.prompt_logprobs = None
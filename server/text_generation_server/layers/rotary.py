@@ -2,6 +2,7 @@ import os
 import math
 import torch
 from torch import nn
+from typing import Dict
 from text_generation_server.utils.import_utils import SYSTEM
 
 if SYSTEM == "cuda":
@@ -14,6 +15,21 @@ elif SYSTEM == "ipex":
     import intel_extension_for_pytorch as ipex
 
 
+def _apply_rotary(x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor):
+    """Rotate the two halves of the first `2 * cos.shape[-1]` dims of `x` in place."""
+    rotary_dim = cos.shape[-1]
+    x1 = x[..., :rotary_dim]
+    x2 = x[..., rotary_dim : 2 * rotary_dim]
+    cos = cos.to(torch.float32)
+    sin = sin.to(torch.float32)
+    x1_float = x1.float()
+    x2_float = x2.float()
+    rotated1 = x1_float * cos - x2_float * sin
+    rotated2 = x1_float * sin + x2_float * cos
+    x1.copy_(rotated1)
+    x2.copy_(rotated2)
+
+
 def _create_inv_freq(dim, base, device):
     inv_freq = 1.0 / (
         base ** (torch.arange(0, dim, 2, device=device, dtype=torch.float32) / dim)
@@ -31,10 +47,20 @@ def _get_rope_config(config):
     return getattr(config, "rope_scaling", None)
 
 
+# The cos/sin tables are computed on the first forward for all the positions of
+# the model, up to this many, so that long requests do not rebuild them.
+ROTARY_PRECOMPUTE_POSITIONS = int(os.getenv("ROTARY_PRECOMPUTE_POSITIONS", "131072"))
+
+# Rotary embeddings built by `PositionRotaryEmbedding.static`, the layers of a
+# model with the same rotary configuration share one embedding and its tables.
+_ROTARY_EMBEDDINGS: Dict[tuple, "PositionRotaryEmbedding"] = {}
+
+
 class PositionRotaryEmbedding(nn.Module):
     def __init__(self, inv_freq, scaling_factor):
         super().__init__()
         self.inv_freq = inv_freq
+        self.max_positions = 0
         self._seq_len_cached = 0
         self._cos_cached = None
         self._sin_cached = None
@@ -75,12 +101,34 @@ class PositionRotaryEmbedding(nn.Module):
                 query, key, sin, cos, query.size(-1), True
             )
         else:
-            raise ValueError(
-                "Your system seem to be not supported. Please check your install or open an issue at https://github.com/huggingface/text-generation-inference/issues with a clear reproduction."
-            )
+            # Plain PyTorch, for systems without rotary kernels
+            _apply_rotary(query, cos, sin)
+            _apply_rotary(key, cos, sin)
 
     @classmethod
     def static(cls, config, dim, base, device):
+        """Rotary embedding of `config`, shared by the layers with the same one."""
+        max_position_embeddings = getattr(config, "max_position_embeddings", None)
+        key = (
+            cls,
+            dim,
+            base,
+            str(device),
+            repr(_get_rope_config(config)),
+            max_position_embeddings,
+            getattr(config, "original_max_position_embeddings", None),
+        )
+        rotary_emb = _ROTARY_EMBEDDINGS.get(key)
+        if rotary_emb is None:
+            rotary_emb = cls._static(config, dim, base, device)
+            rotary_emb.max_positions = min(
+                max_position_embeddings or 0, ROTARY_PRECOMPUTE_POSITIONS
+            )
+            _ROTARY_EMBEDDINGS[key] = rotary_emb
+        return rotary_emb
+
+    @classmethod
+    def _static(cls, config, dim, base, device):
         inv_freq = _create_inv_freq(dim, base, device)
         scaling_factor = None
         rope_scaling = _get_rope_config(config)
@@ -277,7 +325,9 @@ class PositionRotaryEmbedding(nn.Module):
             # But later on goes and cast cos/sin to float anyway: https://github.com/Dao-AILab/flash-attention/blob/017716451d446e464dde9aca3a3c1ed2209caaa9/csrc/rotary/rotary_cuda.cu#L29, which looks suboptimal.
             dtype = torch.float32
 
-        self._update_cos_sin_cache(dtype, position_ids.device, max_s)
+        self._update_cos_sin_cache(
+            dtype, position_ids.device, max(max_s, self.max_positions)
+        )
 
         cos = torch.index_select(self._cos_cached, 0, position_ids)
         sin = torch.index_select(self._sin_cached, 0, position_ids)
@@ -299,6 +349,7 @@ class SuRotaryEmbedding(PositionRotaryEmbedding):
         self.long_inv_freq = long_inv_freq
         self.scaling_factor = scaling_factor
         self.original_max_position_embeddings = original_max_position_embeddings
+        self.max_positions = 0
         self._seq_len_cached = 0
         self._cos_cached = None
         self._sin_cached = None
@@ -352,6 +403,7 @@ class Phi3LongRoPEScaledRotaryEmbedding(PositionRotaryEmbedding):
         self.original_max_position_embeddings = original_max_position_embeddings
 
         # cache
+        self.max_positions = 0
         self._seq_len_cached = 0
         self._cos_cached = None
         self._sin_cached = None
@@ -586,7 +638,6 @@ class RotaryPositionEmbeddingMultimodalSections(PositionRotaryEmbedding):
             freqs = torch.outer(t, self.inv_freq.to(device=t.device))
             self._cos_cached = torch.cos(freqs).to(dtype)
             self._sin_cached = torch.sin(freqs).to(dtype)
-            self._sections = self.section_indices.expand(seqlen, -1, -1)
 
     def get_cos_sin(
         self,
@@ -594,9 +645,11 @@ class RotaryPositionEmbeddingMultimodalSections(PositionRotaryEmbedding):
         max_s: int,
         dtype: torch.dtype,
     ):
-        self._update_cos_sin_cache(dtype, position_ids.device, max_s)
-        slen = position_ids.shape[0]
+        self._update_cos_sin_cache(
+            dtype, position_ids.device, max(max_s, self.max_positions)
+        )
+        sections = self.section_indices.expand(position_ids.shape[0], -1, -1)
 
-        cos = self._cos_cached[position_ids].gather(1, self._sections[:slen])
-        sin = self._sin_cached[position_ids].gather(1, self._sections[:slen])
+        cos = self._cos_cached[position_ids].gather(1, sections)
+        sin = self._sin_cached[position_ids].gather(1, sections)
         return cos, sin
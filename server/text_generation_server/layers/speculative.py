@@ -11,6 +11,11 @@ class SpeculativeHead(torch.nn.Module):
         super().__init__()
         self.head = lm_head
         self.speculator = speculator
+        # Applied to the logits of the prompt tokens when scoring them, for the
+        # models that transform the logits of the head (e.g. softcapping)
+        self.logits_processor = None
+        # `PromptLogprobs` set for the forwards that score the prompt
+        self.prompt_logprobs = None
 
     @staticmethod
     def load(config, prefix: str, weights):
@@ -44,6 +49,10 @@ class SpeculativeHead(torch.nn.Module):
     def forward(
         self, input: torch.Tensor
     ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        if self.prompt_logprobs is not None:
+            lm_head = self.head if self.speculator is None else self.speculator.lm_head
+            input = self.prompt_logprobs.score(lm_head, input, self.logits_processor)
+
         if self.speculator is not None:
             return self.speculator(input)
 
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import threading
+import time
+import torch
+
+from contextlib import nullcontext
+from loguru import logger
+from prometheus_client import Counter, Histogram, start_http_server
+from typing import Awaitable, Callable, Dict, List
+
+from text_generation_server.utils.expert_load import MOE_EXPERT_LOAD_INTERVAL
+
+# Shard metrics are only served when SHARD_METRICS_PORT is set. Each shard listens on
+# SHARD_METRICS_PORT + RANK so that several shards can live on the same host.
+SHARD_METRICS_PORT = os.getenv("SHARD_METRICS_PORT")
+
+EVENT_LOOP_LAG = Histogram(
+    "tgi_shard_event_loop_lag_seconds",
+    "Delay between the scheduled and the actual wake up of the shard event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EXECUTOR_QUEUE_DURATION = Histogram(
+    "tgi_shard_executor_queue_duration_seconds",
+    "Time spent by a model step waiting for the model executor thread",
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+ADAPTER_EVENTS = Counter(
+    "tgi_shard_adapter_events",
+    "LoRA adapter loads and evictions (host_load, device_load, eviction)",
+    ["event"],
+)
+
+MOE_EXPERT_TOKENS = Counter(
+    "tgi_shard_moe_expert_tokens",
+    "Tokens routed to each expert of the MoE layers (MOE_EXPERT_LOAD=1)",
+    ["layer", "expert"],
+)
+
+
+def start_metrics_server(rank: int):
+    if SHARD_METRICS_PORT is None:
+        return
+    port = int(SHARD_METRICS_PORT) + rank
+    start_http_server(port)
+    logger.info(f"Shard metrics served at http://0.0.0.0:{port}/metrics")
+
+
+async def monitor_event_loop_lag(interval: float = 0.1):
+    """Periodically measure how late the event loop wakes up.
+
+    A large lag means that something is blocking the loop and that control RPCs
+    (`Health`, `Info`, ...) cannot be answered in time.
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - start - interval, 0.0)
+        EVENT_LOOP_LAG.observe(lag)
+
+
+async def monitor_expert_load(read: Callable[[], Awaitable[Dict[str, List[int]]]]):
+    """Periodically export the expert counters returned by `read`.
+
+    The counters are accumulated on the device, reading them synchronizes the
+    device, so they are only read every `MOE_EXPERT_LOAD_INTERVAL` seconds.
+    """
+    previous = {}
+    while True:
+        await asyncio.sleep(MOE_EXPERT_LOAD_INTERVAL)
+        try:
+            loads = await read()
+        except Exception:
+            # Nothing awaits the monitor, it keeps exporting after a failed read
+            logger.exception("Could not read the expert load")
+            continue
+        for layer, counts in loads.items():
+            last = previous.get(layer, [0] * len(counts))
+            for expert, (count, last_count) in enumerate(zip(counts, last)):
+                # Every expert is exported, also the ones that did not get any token
+                counter = MOE_EXPERT_TOKENS.labels(layer, str(expert))
+                # The counters restart from 0 when they are reset
+                delta = count - last_count if count >= last_count else count
+                if delta > 0:
+                    counter.inc(delta)
+        previous = loads
+
+
+# Per-phase hot path instrumentation, disabled by default.
+# SHARD_INSTRUMENTATION=1 records wall clock durations, SHARD_INSTRUMENTATION=sync
+# additionally synchronizes the device at the end of each phase so that GPU work
+# is attributed to the phase that launched it (at the cost of throughput).
+_INSTRUMENTATION = os.getenv("SHARD_INSTRUMENTATION", "0").lower()
+INSTRUMENTATION_ENABLED = _INSTRUMENTATION in {"1", "true", "sync"}
+_INSTRUMENTATION_SYNC = _INSTRUMENTATION == "sync"
+
+PHASE_DURATION = Histogram(
+    "tgi_shard_phase_duration_seconds",
+    "Time spent in each phase of a model step",
+    ["phase", "method", "batch_size"],
+    buckets=(
+        0.00001,
+        0.0001,
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+    ),
+)
+
+_step_labels = threading.local()
+
+
+def batch_size_bucket(batch_size: int) -> str:
+    """Round the batch size up to the next power of 2 to bound label cardinality."""
+    bucket = 1
+    while bucket < batch_size:
+        bucket *= 2
+    return str(bucket)
+
+
+def set_step_labels(method: str, batch_size: int):
+    """Label the phases recorded by the current thread until the next call."""
+    if INSTRUMENTATION_ENABLED:
+        _step_labels.method = method
+        _step_labels.batch_size = batch_size_bucket(batch_size)
+
+
+def _observe_phase(phase: str, start_ns: int, end_ns: int):
+    PHASE_DURATION.labels(
+        phase,
+        getattr(_step_labels, "method", "unknown"),
+        getattr(_step_labels, "batch_size", "unknown"),
+    ).observe((end_ns - start_ns) / 1e9)
+
+
+def _synchronize():
+    if _INSTRUMENTATION_SYNC and torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+class _Span:
+    __slots__ = ("phase", "start_ns")
+
+    def __init__(self, phase: str):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _synchronize()
+        _observe_phase(self.phase, self.start_ns, time.perf_counter_ns())
+        return False
+
+
+_NOOP_SPAN = nullcontext()
+
+
+def span(phase: str):
+    """Context manager recording the duration of `phase`. No-op when disabled."""
+    if INSTRUMENTATION_ENABLED:
+        return _Span(phase)
+    return _NOOP_SPAN
+
+
+class PhaseTimer:
+    """Records consecutive phases of a step without nesting the code in `with` blocks.
+
+    Each call to `lap(phase)` records the time elapsed since the previous lap
+    (or since the timer creation) as `phase`.
+    """
+
+    __slots__ = ("last_ns",)
+
+    def __init__(self):
+        _synchronize()
+        self.last_ns = time.perf_counter_ns()
+
+    def lap(self, phase: str):
+        _synchronize()
+        now = time.perf_counter_ns()
+        _observe_phase(phase, self.last_ns, now)
+        self.last_ns = now
+
+    def skip(self):
+        """Restart the timer without recording anything."""
+        self.last_ns = time.perf_counter_ns()
+
+
+class _NoopPhaseTimer:
+    __slots__ = ()
+
+    def lap(self, phase: str):
+        pass
+
+    def skip(self):
+        pass
+
+
+_NOOP_PHASE_TIMER = _NoopPhaseTimer()
+
+
+def phase_timer():
+    if INSTRUMENTATION_ENABLED:
+        return PhaseTimer()
+    return _NOOP_PHASE_TIMER
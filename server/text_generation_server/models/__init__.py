@@ -33,6 +33,10 @@ from text_generation_server.models.custom_modeling.bloom_modeling import (
 )
 from text_generation_server.models.globals import ATTENTION
 from text_generation_server.models.seq2seq_lm import Seq2SeqLM
+from text_generation_server.models.synthetic import (
+    SYNTHETIC_MODEL_ID,
+    synthetic_model_path,
+)
 from text_generation_server.models.galactica import GalacticaCausalLMBatch
 from text_generation_server.models.custom_modeling.neox_modeling import (
     GPTNeoxForCausalLM,
@@ -49,13 +53,15 @@ from text_generation_server.models.custom_modeling.t5_modeling import (
 )
 
 
-from text_generation_server.utils.adapter import (
-    AdapterParameters,
-    build_layer_weight_lookup,
-    load_and_merge_adapters,
-    AdapterInfo,
+from text_generation_server.utils.adapter import AdapterInfo
+from text_generation_server.adapters.manager import AdapterManager, MAX_ACTIVE_ADAPTERS
+from text_generation_server.adapters.fold import (
+    FOLD_LORA_ADAPTERS,
+    FOLD_LORA_DENSITY,
+    FOLD_LORA_STRATEGY,
+    FOLD_LORA_WEIGHTS,
+    fold_adapters,
 )
-from text_generation_server.adapters.lora import LoraWeights
 
 
 from text_generation_server.utils.import_utils import SYSTEM
@@ -436,6 +442,9 @@ def get_model(
 ) -> Model:
     global FLASH_ATTENTION
 
+    if model_id == SYNTHETIC_MODEL_ID:
+        model_id = str(synthetic_model_path())
+
     config_dict, _ = PretrainedConfig.get_config_dict(
         model_id, revision=revision, trust_remote_code=trust_remote_code
     )
@@ -1826,91 +1835,23 @@ def get_model_with_lora_adapters(
         max_input_tokens,
     )
 
-    if len(lora_adapters) > 0:
-        target_to_layer = build_layer_weight_lookup(model.model)
-
-        for index, adapter in enumerate(lora_adapters):
-            # The AdapterParameters object allows for merging multiple adapters into a single adapter.
-            # At the moment, we only support loading a single adapter into the model, but we keep the
-            # AdapterParameters object for easier extension in the future.
-            adapter_parameters = AdapterParameters(
-                adapter_info=[adapter],
-                # when merging multiple adapters we can weight them differently
-                # if this is not set, all adapters will be weighted equally
-                # see: text_generation_server.utils.merges.strategies for impl
-                weights=None,
-                merge_strategy=0,
-                density=1.0,
-                majority_sign_method=0,
-            )
-
-            adapter_index = index + 1
-            adapter_to_index[adapter.id] = adapter_index
-
-            logger.info(
-                f"Loading adapter weights into model: {','.join([adapter.id for adapter in adapter_parameters.adapter_info])}"
-            )
-            weight_names = tuple([v[0] for v in target_to_layer.values()])
-            (
-                module_map,
-                adapter_config,
-                adapter_weight_names,
-                adapter_tokenizer,
-            ) = load_and_merge_adapters(
-                model.model_id,
-                adapter_parameters,
-                adapter_index,
-                weight_names,
-                False,
-            )
-
-            unused_weight_names = adapter_weight_names.copy()
-
-            adapter_layers = [
-                "q_proj",
-                "k_proj",
-                "v_proj",
-                "o_proj",
-                "gate_proj",
-                "up_proj",
-                "down_proj",
-                "qkv_proj",
-                # add c_* layers used in starcoder2
-                "c_proj",
-                "c_fc",
-            ]
-
-            for layer_name in adapter_layers:
-                nlayers = (
-                    1 if layer_name == "lm_head" else len(model.model.model.layers)
-                )
-                adapter_weights = LoraWeights.prepare_weights(
-                    config=adapter_config,
-                    module_map=module_map,
-                    layer_type=layer_name,
-                    unused_weight_names=unused_weight_names,
-                    nlayers=nlayers,
-                    dtype=model.dtype,
-                    world_size=model.world_size,
-                    process_group=model.process_group,
-                    target_to_layer=target_to_layer,
-                )
-
-                if adapter_weights is None:
-                    continue
-
-                model.layer_to_adapter_weights[layer_name].add_adapter(
-                    adapter_index, adapter_weights
-                )
-
-            if len(unused_weight_names) > 0:
-                logger.warning(
-                    f"{','.join([a.id for a in lora_adapters])} unused adapter weights: {unused_weight_names}"
-                )
-
-            if adapter_tokenizer is not None:
-                model.tokenizers.add_tokenizer(adapter_index, adapter_tokenizer)
+    if FOLD_LORA_ADAPTERS:
+        # The folded adapters become part of the base model
+        fold_adapters(
+            model,
+            FOLD_LORA_ADAPTERS,
+            weights=FOLD_LORA_WEIGHTS,
+            merge_strategy=FOLD_LORA_STRATEGY,
+            density=FOLD_LORA_DENSITY,
+        )
 
-            model.loaded_adapters.add(adapter_index)
+    # Adapters can also be loaded while serving with the LoadAdapter RPC
+    model.adapter_manager = AdapterManager(
+        model,
+        adapter_to_index,
+        max_active=max(MAX_ACTIVE_ADAPTERS, len(lora_adapters)),
+    )
+    for adapter in lora_adapters:
+        model.adapter_manager.load(adapter)
 
     return model
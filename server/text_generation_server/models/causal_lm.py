@@ -22,11 +22,13 @@ from text_generation_server.utils.chunks import concat_text_chunks
 from text_generation_server.utils.import_utils import SYSTEM
 from text_generation_server.utils.quantization import get_loader
 from text_generation_server.utils.tokens import batch_top_tokens
+from text_generation_server.layers.prompt_logprobs import token_logprobs
 from text_generation_server.models.types import (
     Batch,
     Tokens,
     Generation,
     GeneratedText,
+    Score,
 )
 from text_generation_server.pb import generate_pb2
 from text_generation_server.utils import NextTokenChooser, StoppingCriteria, Sampling
@@ -682,6 +684,34 @@ class CausalLM(Model):
             speculative_logits = None
         return outputs.logits, speculative_logits, outputs.past_key_values
 
+    @tracer.start_as_current_span("score")
+    def score(self, batch: generate_pb2.Batch, targets: List[str]) -> List[Score]:
+        batch = self.batch_type.from_pb(batch, self.tokenizer, self.dtype, self.device)
+        # Single forward on the prompts, the past is not kept
+        logits, _, _ = self.forward(
+            batch.input_ids,
+            batch.attention_mask[:, : batch.max_input_length],
+            batch.position_ids,
+        )
+
+        scores = []
+        for i, (request, input_length, all_input_ids) in enumerate(
+            zip(batch.requests, batch.input_lengths, batch.all_input_ids)
+        ):
+            # The inputs are left padded, the logits of a token are for the next one
+            token_ids = all_input_ids[-input_length:, 0]
+            request_logprobs = token_logprobs(
+                logits[i, -input_length:-1], token_ids[1:]
+            )
+            scores.append(
+                self._score(
+                    request.id,
+                    token_ids.tolist(),
+                    [float("nan")] + request_logprobs.tolist(),
+                )
+            )
+        return scores
+
     @tracer.start_as_current_span("generate_token")
     def generate_token(
         self, batch: CausalLMBatch
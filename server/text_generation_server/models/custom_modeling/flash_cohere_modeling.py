@@ -518,6 +518,11 @@ class FlashCohereForCausalLM(torch.nn.Module):
                 weights=weights,
             )
         self.logit_scale = config.logit_scale
+        self.lm_head.logits_processor = self.scale_logits
+
+    def scale_logits(self, logits: torch.Tensor) -> torch.Tensor:
+        logits *= self.logit_scale
+        return logits
 
     def forward(
         self,
@@ -546,7 +551,7 @@ class FlashCohereForCausalLM(torch.nn.Module):
         if lm_head_indices is not None:
             hidden_states = hidden_states[lm_head_indices]
         logits, speculative_logits = self.lm_head(hidden_states)
-        logits *= self.logit_scale
+        logits = self.scale_logits(logits)
         if speculative_logits is not None:
-            speculative_logits *= self.logit_scale
+            speculative_logits = self.scale_logits(speculative_logits)
         return logits, speculative_logits
@@ -28,8 +28,10 @@ if SYSTEM == "ipex":
     from intel_extension_for_pytorch.llm.modules import GatedMLPMOE
 elif SYSTEM == "cuda":
     moe_kernels = load_kernel(module="moe", repo_id="kernels-community/moe")
-else:
+elif SYSTEM == "rocm":
     import moe_kernels
+else:
+    moe_kernels = None
 
 from text_generation_server.layers.attention import (
     paged_attention,
@@ -529,6 +529,13 @@ class FlashGemma2ForCausalLM(torch.nn.Module):
         )
         self.softcap = config.final_logit_softcapping
         assert isinstance(self.softcap, float)
+        self.lm_head.logits_processor = self.softcap_logits
+
+    def softcap_logits(self, logits: torch.Tensor) -> torch.Tensor:
+        logits /= self.softcap
+        logits = torch.tanh(logits)
+        logits *= self.softcap
+        return logits
 
     def forward(
         self,
@@ -559,9 +566,6 @@ class FlashGemma2ForCausalLM(torch.nn.Module):
         if lm_head_indices is not None:
             hidden_states = hidden_states[lm_head_indices]
         logits, speculative_logits = self.lm_head(hidden_states)
-
-        logits /= self.softcap
-        logits = torch.tanh(logits)
-        logits *= self.softcap
+        logits = self.softcap_logits(logits)
 
         return logits, speculative_logits
@@ -510,13 +510,18 @@ class FlashGemma3Model(torch.nn.Module):
         hidden_states = inputs_embeds
 
         # Get rotary cos and sin for this forward
-        # Avoid to index in each layer
+        # Avoid to index in each layer, the local and global layers each share
+        # their rotary embedding
+        cos_sin = {}
 
         residual = None
         for i, layer in enumerate(self.layers):
-            cos, sin = self.layers[i].self_attn.rotary_emb.get_cos_sin(
-                position_ids, max_s, hidden_states.dtype
-            )
+            rotary_emb = self.layers[i].self_attn.rotary_emb
+            if rotary_emb not in cos_sin:
+                cos_sin[rotary_emb] = rotary_emb.get_cos_sin(
+                    position_ids, max_s, hidden_states.dtype
+                )
+            cos, sin = cos_sin[rotary_emb]
 
             hidden_states, residual = layer(
                 hidden_states,
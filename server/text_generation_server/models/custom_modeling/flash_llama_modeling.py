@@ -659,6 +659,11 @@ class FlashLlamaForCausalLM(torch.nn.Module):
                 self.logits_scaled = True
             except Exception:
                 self.logits_scaled = False
+                self.lm_head.logits_processor = self.scale_logits
+
+    def scale_logits(self, logits: torch.Tensor) -> torch.Tensor:
+        logits /= self.logits_scaling
+        return logits
 
     def forward(
         self,
@@ -696,8 +701,8 @@ class FlashLlamaForCausalLM(torch.nn.Module):
 
         # Used in Granite
         if self.logits_scaling is not None and not self.logits_scaled:
-            logits /= self.logits_scaling
+            logits = self.scale_logits(logits)
             if speculative_logits is not None:
-                speculative_logits /= self.logits_scaling
+                speculative_logits = self.scale_logits(speculative_logits)
 
         return logits, speculative_logits
@@ -23,7 +23,9 @@ from text_generation_server.utils.import_utils import SYSTEM
 
 if SYSTEM == "ipex":
     import intel_extension_for_pytorch as ipex
-else:
+elif SYSTEM in {"cuda", "rocm"}:
+    # The vision encoders need flash attention, the text models can run with
+    # `ATTENTION=torch` on other systems
     import flash_attn_2_cuda
 
 import numpy as np
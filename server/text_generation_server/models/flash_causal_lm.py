@@ -31,6 +31,7 @@ from typing import (
 from text_generation_server.adapters import AdapterBatchData, AdapterBatchMetadata
 from huggingface_hub.constants import HUGGINGFACE_HUB_CACHE
 from text_generation_server.utils.chunks import concat_text_chunks
+from text_generation_server.utils.expert_load import set_graph_tokens
 from text_generation_server.utils.import_utils import SYSTEM
 from text_generation_server.models import Model
 from text_generation_server.utils.log import log_master
@@ -45,11 +46,14 @@ from text_generation_server.utils import (
     weight_files,
     Weights,
 )
+from text_generation_server.metrics import phase_timer
 from text_generation_server.models.types import (
     Batch,
     Tokens,
     Generation,
     GeneratedText,
+    PackedGenerations,
+    Score,
 )
 from text_generation_server.pb import generate_pb2
 from text_generation_server.models.globals import (
@@ -57,15 +61,26 @@ from text_generation_server.models.globals import (
     ATTENTION,
     BLOCK_SIZE,
     CUDA_GRAPHS,
+    GROUP_ADAPTER_ROWS,
     REQUEST_LOGPROBS,
     TGI_WIGGLE_ROOM,
     get_adapter_to_index,
 )
 from text_generation_server.layers.attention import KVCache, Seqlen
+from text_generation_server.layers.prompt_logprobs import (
+    PROMPT_LOGPROBS_CHUNK_SIZE,
+    PromptLogprobs,
+    token_logprobs,
+)
 from text_generation_server.utils import StoppingCriteria, HeterogeneousNextTokenChooser
 from text_generation_server.utils.dist import MEMORY_FRACTION
 from text_generation_server.utils.quantization import get_loader
-from text_generation_server.utils.segments import SegmentConcatBuilder, find_segments
+from text_generation_server.utils.segments import (
+    SegmentConcatBuilder,
+    find_segments,
+    group_by_adapter,
+    segment_bounds,
+)
 
 from text_generation_server.utils.import_utils import (
     empty_cache,
@@ -122,6 +137,21 @@ def init_cpu_threads_env(rank_id: int, world_size: int):
         )
 
 
+def expand_adapter_meta(
+    adapter_meta: AdapterBatchMetadata, new_length: int
+) -> AdapterBatchMetadata:
+    """Repeat the adapter of each request for its `new_length` speculative rows."""
+    if new_length == 1:
+        return adapter_meta
+    adapter_indices = adapter_meta.adapter_indices.repeat_interleave(new_length)
+    return AdapterBatchMetadata(
+        adapter_indices=adapter_indices,
+        adapter_set=adapter_meta.adapter_set,
+        adapter_segments=adapter_meta.adapter_segments * new_length,
+        segment_indices=adapter_meta.segment_indices,
+    )
+
+
 @dataclass
 class FlashCausalLMBatch(Batch):
     batch_id: int
@@ -207,6 +237,13 @@ class FlashCausalLMBatch(Batch):
     # Maximum number of blocks
     max_blocks: int
 
+    # Adapter weights prepared for the decode steps of this batch, reused until the
+    # batch is filtered or concatenated
+    adapter_data: Optional[AdapterBatchData] = None
+
+    # Whether `concatenate` may reorder the requests, see `group_by_adapter`
+    group_adapter_rows = True
+
     def to_pb(self) -> generate_pb2.CachedBatch:
         return generate_pb2.CachedBatch(
             id=self.batch_id,
@@ -488,7 +525,10 @@ class FlashCausalLMBatch(Batch):
         # We assume that if len(requests) == len(self) then the requests are the same
         if len(request_ids) == len(self):
             return self
+        return self._select(request_ids)
 
+    def _select(self, request_ids: List[int]) -> "FlashCausalLMBatch":
+        """Keep the requests of `request_ids`, in the order of `request_ids`."""
         device = self.block_tables_tensor.device
 
         # New values after filtering
@@ -525,6 +565,7 @@ class FlashCausalLMBatch(Batch):
 
         stopping_criterias = []
         top_n_tokens = []
+        adapter_indices_list = []
         adapter_set = set()
 
         num_blocks = 0
@@ -567,6 +608,7 @@ class FlashCausalLMBatch(Batch):
 
             ADAPTER_TO_INDEX = get_adapter_to_index()
             adapter_index = ADAPTER_TO_INDEX.get(self.requests[idx].adapter_id, 0)
+            adapter_indices_list.append(adapter_index)
             adapter_set.add(adapter_index)
 
             request_block_table = self.block_tables[idx]
@@ -607,7 +649,15 @@ class FlashCausalLMBatch(Batch):
         cu_slots = torch.tensor(cu_slots, dtype=torch.int64)
 
         if not has_triton():
-            slots = self.slots[slot_filtering_indices]
+            if any(i > j for i, j in zip(indices, indices[1:])):
+                # The mask would keep the slots in their previous order
+                cu = self.cu_slots.tolist()
+                slot_order = torch.cat(
+                    [torch.arange(cu[idx], cu[idx + 1]) for idx in indices]
+                )
+                slots = self.slots[slot_order.to(device)]
+            else:
+                slots = self.slots[slot_filtering_indices]
         else:
             slots = self.slots.new_empty(cumulative_slot_tokens)
             gpu_cu_slots = cu_slots.to(device)
@@ -623,6 +673,7 @@ class FlashCausalLMBatch(Batch):
             cache_lengths_tensor = None
             input_lengths_tensor = None
             adapter_meta = None
+            adapter_data = None
         else:
             # Index into tensors
             input_ids = self.input_ids[indices]
@@ -634,7 +685,10 @@ class FlashCausalLMBatch(Batch):
             # Move to GPU now that we have the whole tensor
             slot_indices = slot_indices.to(device)
 
-            adapter_segments, adapter_segment_indices = find_segments(adapter_indices)
+            # Segments of the requests, found on the host
+            adapter_segments, adapter_segment_indices = find_segments(
+                adapter_indices_list
+            )
             adapter_segments = torch.tensor(
                 adapter_segments, dtype=torch.int32, device=device
             )
@@ -645,6 +699,22 @@ class FlashCausalLMBatch(Batch):
                 segment_indices=adapter_segment_indices,
             )
 
+            adapter_data = None
+            if self.adapter_data is not None:
+                # Keep the prepared adapter weights if the remaining requests use the
+                # same adapters
+                adapter_rows = self.adapter_data.meta.adapter_indices.shape[0]
+                rows_per_request = adapter_rows // len(self)
+                rows = torch.tensor(indices, dtype=torch.int64, device=device)
+                if rows_per_request > 1:
+                    rows = (
+                        rows.unsqueeze(-1) * rows_per_request
+                        + torch.arange(rows_per_request, device=device)
+                    ).reshape(-1)
+                adapter_data = self.adapter_data.filter(
+                    expand_adapter_meta(adapter_meta, rows_per_request), rows
+                )
+
         return type(self)(
             batch_id=self.batch_id,
             requests=requests,
@@ -684,6 +754,7 @@ class FlashCausalLMBatch(Batch):
             max_blocks=max_blocks,
             speculative_ids=speculative_ids,
             adapter_meta=adapter_meta,
+            adapter_data=adapter_data,
         )
 
     @classmethod
@@ -904,7 +975,7 @@ class FlashCausalLMBatch(Batch):
                 segment_indices=adapter_segment_indices,
             )
 
-        return cls(
+        batch = cls(
             batch_id=batches[0].batch_id,
             requests=requests,
             requests_idx_mapping=requests_idx_mapping,
@@ -944,6 +1015,26 @@ class FlashCausalLMBatch(Batch):
             speculative_ids=speculative_ids,
             adapter_meta=adapter_meta,
         )
+        if GROUP_ADAPTER_ROWS and cls.group_adapter_rows:
+            batch = batch.group_by_adapter()
+        return batch
+
+    def group_by_adapter(self) -> "FlashCausalLMBatch":
+        """Make the requests of each adapter contiguous.
+
+        Concatenating batches interleaves the requests of the adapters, and the cost
+        of the LoRA kernels grows with the number of segments. Filtering keeps the
+        requests grouped.
+        """
+        ADAPTER_TO_INDEX = get_adapter_to_index()
+        if not ADAPTER_TO_INDEX:
+            return self
+        order = group_by_adapter(
+            [ADAPTER_TO_INDEX.get(r.adapter_id, 0) for r in self.requests]
+        )
+        if order is None:
+            return self
+        return self._select([self.requests[i].id for i in order])
 
     def prepare_for_prefill(self):
         # Prepare values if we need to continue prefilling
@@ -1154,10 +1245,10 @@ class FlashCausalLMBatch(Batch):
         self.prefill_next_token_indices = prefill_next_token_indices
 
         if adapter_set:
-            adapter_indices = torch.cat(adapter_indices_list).to(
-                dtype=torch.int64, device=device
-            )
+            adapter_indices = torch.cat(adapter_indices_list)
+            # Find the segments before moving the indices to the device
             adapter_segments, adapter_segment_indices = find_segments(adapter_indices)
+            adapter_indices = adapter_indices.to(dtype=torch.int64, device=device)
         else:
             adapter_indices = torch.zeros_like(self.input_ids)
             adapter_segments = [0, len(adapter_indices)]
@@ -1191,6 +1282,8 @@ ROW_PARALLEL = {"o_proj", "down_proj", "lm_head"}
 
 
 class FlashCausalLM(Model):
+    support_packed_generations = True
+
     def __init__(
         self,
         model_id: str,
@@ -1226,6 +1319,10 @@ class FlashCausalLM(Model):
                 device = torch.device("cpu")
                 dtype = torch.bfloat16 if dtype is None else dtype
                 init_cpu_threads_env(rank_id=rank, world_size=world_size)
+        elif ATTENTION == "torch":
+            device = torch.device("cpu")
+            dtype = torch.float32 if dtype is None else dtype
+            init_cpu_threads_env(rank_id=rank, world_size=world_size)
         else:
             raise NotImplementedError(f"{model_class} is only available on GPU")
 
@@ -1791,7 +1888,9 @@ class FlashCausalLM(Model):
 
         bs = input_ids.shape[0]
         sorted_padded_bs = sorted([k for k in self.cuda_graphs.keys() if k >= bs])
-        if sorted_padded_bs:
+        # The graphs are captured without adapters, adapter batches run eagerly
+        uses_adapters = any(index != 0 for index in batch.adapter_meta.adapter_set)
+        if sorted_padded_bs and not uses_adapters:
             # Get associated cuda graph
             cuda_graph = self.cuda_graphs[sorted_padded_bs[0]]
         else:
@@ -1875,6 +1974,7 @@ class FlashCausalLM(Model):
             cache_lengths_tensor=cuda_graph["cache_lengths"],
             state=cuda_graph["state"],
         ):
+            set_graph_tokens(bs)
             # Replay the graph
             cuda_graph["graph"].replay()
 
@@ -1887,63 +1987,228 @@ class FlashCausalLM(Model):
         logits = cuda_graph["logits"][:bs]
         return logits, speculative_logits
 
+    def _prefill_tokens_indices(self, batch: FlashCausalLMBatch) -> torch.Tensor:
+        """Prompt tokens that the prefill logprobs are gathered for."""
+        if len(batch) == 1:
+            # Logprobs generated by the model are for the next token
+            # So we need to translate the id tensor by 1
+            cache_length = batch.cache_lengths[0]
+            input_length = batch.input_lengths[0]
+            return batch.all_input_ids_tensor[
+                0, cache_length + 1 : cache_length + input_length + 1
+            ]
+
+        prefill_tokens_indices = batch.input_ids.new_zeros(batch.prefill_cu_outlens[-1])
+        for i, (request, cache_length, input_length, request_prefilling) in enumerate(
+            zip(
+                batch.requests,
+                batch.cache_lengths,
+                batch.input_lengths,
+                batch.prefilling_mask,
+            )
+        ):
+            if request.prefill_logprobs and request_prefilling:
+                # Indexing metadata
+                out_start_index = batch.prefill_cu_outlens[i]
+                out_end_index = batch.prefill_cu_outlens[i + 1]
+                ids = batch.all_input_ids_tensor[
+                    i, cache_length + 1 : cache_length + input_length + 1
+                ]
+                prefill_tokens_indices[out_start_index:out_end_index] = ids
+        return prefill_tokens_indices
+
+    @tracer.start_as_current_span("score")
+    def score(self, batch: generate_pb2.Batch, targets: List[str]) -> List[Score]:
+        if any(not r.blocks for r in batch.requests):
+            # Without blocks, the batch would be written over the first blocks of
+            # the KV cache
+            raise ValueError("Scored requests must have KV cache blocks")
+
+        tokenized_inputs = self.batch_type.batch_tokenized_inputs(
+            batch.requests, self.tokenizer
+        )
+        # Tokens in the KV cache, starting with the ones of the prefix cache
+        cache_lengths = [r.cache_len for r in batch.requests]
+        logprobs = [[float("nan")] * len(input_ids) for input_ids in tokenized_inputs]
+
+        pending = [
+            i
+            for i, input_ids in enumerate(tokenized_inputs)
+            if cache_lengths[i] < len(input_ids)
+        ]
+        while pending:
+            # Prompt chunks of this step, within the prefill token budget
+            budget = get_max_prefill_tokens() if self.support_chunking else None
+            chunks = []
+            for i in pending:
+                chunk_length = len(tokenized_inputs[i]) - cache_lengths[i]
+                if budget is not None:
+                    chunk_length = min(chunk_length, max(budget, 1))
+                    budget -= chunk_length
+                chunks.append((i, chunk_length))
+                if budget is not None and budget <= 0:
+                    break
+
+            self._score_step(batch, tokenized_inputs, cache_lengths, chunks, logprobs)
+            for i, chunk_length in chunks:
+                cache_lengths[i] += chunk_length
+            pending = [
+                i for i in pending if cache_lengths[i] < len(tokenized_inputs[i])
+            ]
+
+        return [
+            self._score(r.id, input_ids, request_logprobs)
+            for r, input_ids, request_logprobs in zip(
+                batch.requests, tokenized_inputs, logprobs
+            )
+        ]
+
+    def _score_step(
+        self,
+        batch: generate_pb2.Batch,
+        tokenized_inputs: List[List[int]],
+        cache_lengths: List[int],
+        chunks: List[Tuple[int, int]],
+        logprobs: List[List[float]],
+    ):
+        """Prefill a chunk of the prompt of some requests and store its logprobs."""
+        requests = []
+        for i, chunk_length in chunks:
+            request = generate_pb2.Request()
+            request.CopyFrom(batch.requests[i])
+            request.cache_len = cache_lengths[i]
+            request.chunk_len = chunk_length
+            requests.append(request)
+        step_pb = generate_pb2.Batch(
+            id=batch.id,
+            requests=requests,
+            size=len(requests),
+            max_tokens=batch.max_tokens,
+            max_blocks=batch.max_blocks,
+        )
+        step = self.batch_type.from_tokenized(
+            step_pb,
+            self.tokenizer,
+            [tokenized_inputs[i] for i, _ in chunks],
+            self.dtype,
+            self.device,
+        )
+        for request in step.requests:
+            request.prefill_logprobs = True
+        step.prepare_for_prefill()
+
+        # Logprobs generated by the model are for the next token, the last token
+        # of the prompt has no target
+        target_ids = []
+        for i, chunk_length in chunks:
+            start = cache_lengths[i] + 1
+            ids = tokenized_inputs[i][start : start + chunk_length]
+            target_ids.extend(ids + [0] * (chunk_length - len(ids)))
+        target_ids = torch.tensor(target_ids, dtype=torch.int64, device=self.device)
+
+        adapter_data = AdapterBatchData.from_meta(
+            step.adapter_meta,
+            self.layer_to_adapter_weights,
+            True,
+            step.prefill_head_indices,
+        )
+        prompt_logprobs = PromptLogprobs(
+            target_ids,
+            step.prefill_next_token_indices,
+            chunk_size=PROMPT_LOGPROBS_CHUNK_SIZE or len(target_ids),
+        )
+        with prompt_logprobs.scoring(self.model):
+            out, _ = self.forward(step, adapter_data)
+        step_logprobs = prompt_logprobs.logprobs
+        if step_logprobs is None:
+            # The model has no `SpeculativeHead`, `out` has the logits of the chunks
+            step_logprobs = token_logprobs(out, target_ids)
+        # GPU <-> CPU sync
+        step_logprobs = step_logprobs.tolist()
+
+        offset = 0
+        for i, chunk_length in chunks:
+            start = cache_lengths[i] + 1
+            end = min(start + chunk_length, len(logprobs[i]))
+            logprobs[i][start:end] = step_logprobs[offset : offset + end - start]
+            offset += chunk_length
+
     @tracer.start_as_current_span("generate_token")
     def generate_token(
-        self, batch: FlashCausalLMBatch
-    ) -> Tuple[List[Generation], Optional[FlashCausalLMBatch], Tuple[int, int]]:
+        self, batch: FlashCausalLMBatch, packed_generations: bool = False
+    ) -> Tuple[
+        Union[List[Generation], PackedGenerations],
+        Optional[FlashCausalLMBatch],
+        Tuple[int, int],
+    ]:
         start = time.time_ns()
+        timer = phase_timer()
         prefill = batch.prefilling
         if prefill:
             batch.prepare_for_prefill()
+            timer.lap("prepare_for_prefill")
 
         if hasattr(self, "set_inputs_embeds") and callable(self.set_inputs_embeds):
             self.set_inputs_embeds(batch)
+            timer.lap("inputs_embeds")
 
         prefill_logprobs = batch.prefill_next_token_indices is not None
+        prompt_logprobs = None
+        if prefill and prefill_logprobs:
+            # Used to gather prefill logprobs
+            prefill_tokens_indices = self._prefill_tokens_indices(batch)
+            if PROMPT_LOGPROBS_CHUNK_SIZE > 0:
+                prompt_logprobs = PromptLogprobs(
+                    prefill_tokens_indices, batch.prefill_next_token_indices
+                )
 
         # Update adapter indices for speculative tokens (if present)
-        adapter_meta = batch.adapter_meta
-        if batch.speculative_ids is not None:
-            B, speculative_length = batch.speculative_ids.shape
-            new_length = speculative_length + 1
-            adapter_indices = (
-                adapter_meta.adapter_indices.unsqueeze(-1)
-                .expand(B, new_length)
-                .reshape(-1)
-            )
-            adapter_segments = adapter_meta.adapter_segments * new_length
-            adapter_meta = AdapterBatchMetadata(
-                adapter_indices=adapter_indices,
-                adapter_set=adapter_meta.adapter_set,
-                adapter_segments=adapter_segments,
-                segment_indices=adapter_meta.segment_indices,
-            )
-
-        # Assign pointers to adapter weights
-        # TODO(travis): don't update this if indices haven't changed
-        adapter_data = AdapterBatchData.from_meta(
-            adapter_meta,
-            self.layer_to_adapter_weights,
-            prefill,
-            batch.prefill_head_indices,
+        new_length = (
+            batch.speculative_ids.shape[1] + 1
+            if batch.speculative_ids is not None
+            else 1
         )
-
-        out, speculative_logits = self.forward(batch, adapter_data)
+        # Assign pointers to adapter weights
+        # Decode steps reuse them until the batch is filtered or concatenated
+        adapter_data = batch.adapter_data
+        if (
+            prefill
+            or adapter_data is None
+            or adapter_data.meta.adapter_indices.shape[0] != len(batch) * new_length
+        ):
+            adapter_data = AdapterBatchData.from_meta(
+                expand_adapter_meta(batch.adapter_meta, new_length),
+                self.layer_to_adapter_weights,
+                prefill,
+                batch.prefill_head_indices,
+            )
+            batch.adapter_data = None if prefill else adapter_data
+        timer.lap("adapter_data")
+
+        if prompt_logprobs is not None:
+            # The LM head scores the prompt by chunks and only returns the logits
+            # of the next tokens
+            with prompt_logprobs.scoring(self.model):
+                out, speculative_logits = self.forward(batch, adapter_data)
+            if prompt_logprobs.logprobs is None:
+                # The model has no `SpeculativeHead`, the logits of the whole
+                # prompt were returned
+                prompt_logprobs = None
+        else:
+            out, speculative_logits = self.forward(batch, adapter_data)
+        timer.lap("forward")
 
         if prefill:
+            index_next_tokens = prefill_logprobs and prompt_logprobs is None
             next_token_logits = (
-                out[batch.prefill_next_token_indices] if prefill_logprobs else out
+                out[batch.prefill_next_token_indices] if index_next_tokens else out
             )
             if speculative_logits is not None:
                 speculative_logits = (
                     speculative_logits[batch.prefill_next_token_indices]
-                    if prefill_logprobs
+                    if index_next_tokens
                     else speculative_logits
                 )
-            if len(batch) > 1 and prefill_logprobs:
-                # We create the prefill_tokens_indices tensor that will be used to gather prefill logprobs
-                # When batch == 1, we will just use the batch.input_ids values directly
-                prefill_tokens_indices = batch.input_ids.new_zeros(len(out))
         else:
             prefill_logprobs = None
             next_token_logits = out
@@ -2013,6 +2278,7 @@ class FlashCausalLM(Model):
         batch_top_token_ids, batch_top_token_logprobs = batch_top_tokens(
             batch.top_n_tokens, batch.top_n_tokens_tensor, logprobs, accepted_ids
         )
+        timer.lap("logits_processing")
 
         # Since we are done prefilling, all the tensors that were concatenating values for all the requests
         # instantly become of shape [BATCH_SIZE]
@@ -2055,24 +2321,6 @@ class FlashCausalLM(Model):
             request_was_prefilling,
             request_is_prefilling,
         ) in enumerate(iterator):
-            # Used to gather prefill logprobs
-            # Copy batch.all_input_ids_tensor to prefill_token_indices
-            if request.prefill_logprobs and request_was_prefilling:
-                # Indexing metadata
-                out_start_index = batch.prefill_cu_outlens[i]
-                out_end_index = batch.prefill_cu_outlens[i + 1]
-
-                # Logprobs generated by the model are for the next token
-                # So we need to translate the id tensor by 1
-                ids = batch.all_input_ids_tensor[
-                    i, cache_length + 1 : cache_length + input_length + 1
-                ]
-                if len(batch) > 1:
-                    prefill_tokens_indices[out_start_index:out_end_index] = ids
-                else:
-                    # Set prefill_tokens_indices to the correct slice
-                    prefill_tokens_indices = ids
-
             # If the device does not support triton, we copy one by one
             if not request_is_prefilling and not has_triton():
                 # Only save tokens if we are done prefilling for this request
@@ -2110,31 +2358,34 @@ class FlashCausalLM(Model):
             batch.cache_lengths_tensor += batch.input_lengths_tensor + accepted_ids - 1
             batch.input_lengths_tensor = torch.ones_like(batch.input_lengths_tensor)
             batch.slot_indices += accepted_ids
+        timer.lap("update_state")
 
         if prefill and prefill_logprobs:
-            # Get prefill logprobs with inplace softmax (avoid copying the `out` tensor (max_batch_prefill_tokens * vocab_size))
-            torch.log_softmax(out, -1, out=out)
-            prefill_logprobs_tensor = out
-            prefill_logprobs = torch.gather(
-                prefill_logprobs_tensor, 1, prefill_tokens_indices.view(-1, 1)
-            )
+            if prompt_logprobs is not None:
+                prefill_logprobs = prompt_logprobs.logprobs
+            else:
+                # Get prefill logprobs with inplace softmax (avoid copying the `out` tensor (max_batch_prefill_tokens * vocab_size))
+                torch.log_softmax(out, -1, out=out)
+                prefill_logprobs_tensor = out
+                prefill_logprobs = torch.gather(
+                    prefill_logprobs_tensor, 1, prefill_tokens_indices.view(-1, 1)
+                )
             # GPU <-> CPU sync
             prefill_logprobs = prefill_logprobs.view(-1).tolist()
+            timer.lap("prefill_logprobs")
 
-        # Does a GPU <-> CPU sync internally
         if prefill and finished_prefilling:
             # adjust segment lengths to account for all request lengths being 1 during decoding
-            adapter_segments, _ = find_segments(batch.adapter_meta.adapter_indices)
-            batch.adapter_meta.adapter_segments = torch.tensor(
-                adapter_segments,
-                dtype=torch.int32,
-                device=batch.adapter_meta.adapter_segments.device,
+            batch.adapter_meta.adapter_segments = segment_bounds(
+                batch.adapter_meta.adapter_indices,
+                len(batch.adapter_meta.segment_indices),
             )
 
         # GPU <-> CPU sync
         next_token_logprobs = next_token_logprobs.tolist()
         next_token_ids = next_input_ids.tolist()
         accepted_ids = accepted_ids.tolist()
+        timer.lap("host_sync")
 
         # Update values if we need to continue prefilling
         # This represents the `else` case of the `Update values` if above
@@ -2180,6 +2431,8 @@ class FlashCausalLM(Model):
 
         # Results
         generations: List[Generation] = []
+        # Columnar results, built directly from the step values
+        packed = PackedGenerations() if packed_generations else None
         stopped = True
 
         # Zipped iterator
@@ -2272,9 +2525,8 @@ class FlashCausalLM(Model):
                         is_special=[],
                     )
                     if past_prefill_logprob_tokens is not None:
-                        prefill_logprob_tokens = (
-                            past_prefill_logprob_tokens + prefill_logprob_tokens
-                        )
+                        past_prefill_logprob_tokens.extend(prefill_logprob_tokens)
+                        prefill_logprob_tokens = past_prefill_logprob_tokens
 
                     batch.prefill_logprob_tokens[i] = prefill_logprob_tokens
                 else:
@@ -2375,20 +2627,38 @@ class FlashCausalLM(Model):
                     else:
                         top_tokens = None
 
-                    generation = Generation(
-                        request.id,
-                        batch.prefill_logprob_tokens[i],
-                        Tokens(
+                    next_token_is_special = [
+                        nid in self.all_special_ids for nid in _next_token_ids
+                    ]
+                    if packed is not None:
+                        packed.add_tokens(
+                            request.id,
                             _next_token_ids,
                             _next_token_logprobs,
                             next_token_texts,
-                            [nid in self.all_special_ids for nid in _next_token_ids],
-                        ),
-                        generated_text,
-                        top_tokens,
-                    )
+                            next_token_is_special,
+                        )
+                        packed.add_sparse(
+                            request.id,
+                            batch.prefill_logprob_tokens[i],
+                            generated_text,
+                            top_tokens,
+                        )
+                    else:
+                        generation = Generation(
+                            request.id,
+                            batch.prefill_logprob_tokens[i],
+                            Tokens(
+                                _next_token_ids,
+                                _next_token_logprobs,
+                                next_token_texts,
+                                next_token_is_special,
+                            ),
+                            generated_text,
+                            top_tokens,
+                        )
 
-                    generations.append(generation)
+                        generations.append(generation)
 
                 # accept each new token for this specific request since we may
                 # have more than one new token per request with speculative decoding
@@ -2411,6 +2681,11 @@ class FlashCausalLM(Model):
             batch.read_offsets[i] = read_offset
             batch.all_input_ids[i] = all_input_ids
 
+        timer.lap("detokenization")
+
+        if packed is not None:
+            generations = packed
+
         if stopped:
             # No need to return a batch if we know that all requests stopped
             forward_ns = start_decode - start
@@ -13,8 +13,11 @@ PREFIX_CACHING = os.environ["PREFIX_CACHING"].lower() in {
     "true",
 }
 PREFILL_CHUNKING = os.getenv("PREFILL_CHUNKING", "1").lower() in {"1", "true"}
+# Reorder the rows of concatenated batches so that the requests of each LoRA adapter
+# are contiguous, the LoRA kernels run one segment per adapter
+GROUP_ADAPTER_ROWS = os.getenv("GROUP_ADAPTER_ROWS", "1").lower() in {"1", "true"}
 log_master(logger.info, f"Using prefix caching = {PREFIX_CACHING}")
-_expected = {"paged", "flashdecoding", "flashdecoding-ipex", "flashinfer"}
+_expected = {"paged", "flashdecoding", "flashdecoding-ipex", "flashinfer", "torch"}
 assert (
     ATTENTION in _expected
 ), f"Attention is not valid {ATTENTION}, expected {_expected}"
@@ -24,6 +27,7 @@ if PREFIX_CACHING and ATTENTION not in {
     "flashinfer",
     "flashdecoding",
     "flashdecoding-ipex",
+    "torch",
 }:
     raise RuntimeError("Prefix caching is only supported with flashinfer")
 
@@ -59,6 +63,9 @@ else:
 # memory impact and results in less memory usage
 if cuda_graphs is not None:
     cuda_graphs.sort(reverse=True)
+if cuda_graphs and ATTENTION == "torch" and not torch.cuda.is_available():
+    log_master(logger.info, "Disabling cuda graphs, no CUDA device is available")
+    cuda_graphs = None
 
 CUDA_GRAPHS = cuda_graphs
 
@@ -13,10 +13,11 @@ from text_generation_server.models.globals import (
     BLOCK_SIZE,
     PREFILL_CHUNKING,
 )
-from text_generation_server.models.types import Batch, Generation
+from text_generation_server.models.types import Batch, Generation, Score, Tokens
 from text_generation_server.utils.log import log_master
 from text_generation_server.utils.prefill_chunking import set_support_chunking
 from text_generation_server.utils.speculate import get_speculate
+from text_generation_server.pb import generate_pb2
 from text_generation_server.pb.generate_pb2 import InfoResponse
 from text_generation_server.adapters.weights import LayerAdapterWeights
 
@@ -27,6 +28,9 @@ B = TypeVar("B", bound=Batch)
 
 
 class Model(ABC):
+    # Whether `generate_token` can build `PackedGenerations` directly
+    support_packed_generations = False
+
     def __init__(
         self,
         model_id: str,
@@ -64,6 +68,8 @@ class Model(ABC):
             LayerAdapterWeights
         )
         self.loaded_adapters = set()
+        # Set by `get_model_with_lora_adapters`
+        self.adapter_manager = None
         self.static_adapter_id = adapter_id
 
         if speculate is None:
@@ -80,12 +86,13 @@ class Model(ABC):
             )
             support_chunking = False
         if (
-            ATTENTION not in ["flashinfer", "flashdecoding", "flashdecoding-ipex"]
+            ATTENTION
+            not in ["flashinfer", "flashdecoding", "flashdecoding-ipex", "torch"]
             and support_chunking
         ):
             log_master(
                 logger.warning,
-                "Prefill chunking is only supported with `flashinfer` or `flashdecoding` or `flashdecoding-ipex` attention types.",
+                "Prefill chunking is only supported with `flashinfer` or `flashdecoding` or `flashdecoding-ipex` or `torch` attention types.",
             )
             support_chunking = False
 
@@ -129,6 +136,23 @@ class Model(ABC):
     ) -> Tuple[List[Generation], Optional[B], Tuple[int, int]]:
         raise NotImplementedError
 
+    def score(self, batch: generate_pb2.Batch, targets: List[str]) -> List[Score]:
+        """Logprobs of the prompts of `batch`, without generating any token.
+
+        `targets` are the texts scored by the decoder of encoder-decoder models.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support scoring")
+
+    def _score(
+        self, request_id: int, token_ids: List[int], logprobs: List[float]
+    ) -> Score:
+        texts = self.tokenizer.batch_decode(
+            token_ids,
+            clean_up_tokenization_spaces=False,
+            skip_special_tokens=False,
+        )
+        return Score(request_id, Tokens(token_ids, logprobs, texts, is_special=[]))
+
     def warmup(
         self, batch: B, max_input_tokens: Optional[int], max_total_tokens: Optional[int]
     ) -> Tuple[Optional[int], int, int]:
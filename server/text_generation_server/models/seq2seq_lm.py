@@ -20,10 +20,12 @@ from text_generation_server.utils.chunks import concat_text_chunks
 from text_generation_server.utils.quantization import get_loader
 from text_generation_server.utils.tokens import batch_top_tokens
 from text_generation_server.models import Model
+from text_generation_server.layers.prompt_logprobs import token_logprobs
 from text_generation_server.models.types import (
     GeneratedText,
     Batch,
     Generation,
+    Score,
     Tokens,
 )
 from text_generation_server.pb import generate_pb2
@@ -722,6 +724,54 @@ class Seq2SeqLM(Model):
             outputs.past_key_values,
         )
 
+    @tracer.start_as_current_span("score")
+    def score(self, batch: generate_pb2.Batch, targets: List[str]) -> List[Score]:
+        if len(targets) != len(batch.requests):
+            raise ValueError(
+                f"Expected one target per request, got {len(targets)} targets for "
+                f"{len(batch.requests)} requests"
+            )
+        batch = self.batch_type.from_pb(batch, self.tokenizer, self.dtype, self.device)
+        target_ids = self.tokenizer(targets, return_token_type_ids=False)["input_ids"]
+
+        # Teacher forcing: the decoder reads its start token and the target without
+        # its last token, the targets are right padded
+        max_length = max(max(len(ids) for ids in target_ids), 1)
+        decoder_input_ids = batch.decoder_input_ids.new_full(
+            (len(target_ids), max_length), self.tokenizer.pad_token_id
+        )
+        decoder_attention_mask = torch.zeros_like(decoder_input_ids)
+        decoder_input_ids[:, 0] = batch.decoder_input_ids[:, 0]
+        for i, ids in enumerate(target_ids):
+            decoder_input_ids[i, 1 : len(ids)] = decoder_input_ids.new_tensor(ids[:-1])
+            decoder_attention_mask[i, : len(ids)] = 1
+
+        # Single forward, the past is not kept
+        logits, _, _, _ = self.forward(
+            batch.input_ids,
+            batch.attention_mask,
+            decoder_input_ids,
+            decoder_attention_mask,
+            None,
+        )
+
+        scores = []
+        start_ids = batch.decoder_input_ids[:, 0].tolist()
+        for i, (request, start_id, ids) in enumerate(
+            zip(batch.requests, start_ids, target_ids)
+        ):
+            request_logprobs = token_logprobs(
+                logits[i, : len(ids)], decoder_input_ids.new_tensor(ids)
+            )
+            scores.append(
+                self._score(
+                    request.id,
+                    [start_id] + ids,
+                    [float("nan")] + request_logprobs.tolist(),
+                )
+            )
+        return scores
+
     @tracer.start_as_current_span("generate_token")
     def generate_token(
         self, batch: Seq2SeqLMBatch
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import torch
+
+from pathlib import Path
+from typing import Dict
+
+from huggingface_hub.constants import HUGGINGFACE_HUB_CACHE
+from loguru import logger
+from safetensors.torch import save_file
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+# `get_model` loads this model id from a randomly initialized Llama checkpoint that
+# is generated locally, so that the whole serving stack can run without downloads.
+SYNTHETIC_MODEL_ID = "synthetic"
+
+# Architecture of the synthetic model. Fields can be overridden with a JSON object
+# in SYNTHETIC_MODEL_CONFIG, e.g. `{"num_hidden_layers": 8, "hidden_size": 512}`.
+SYNTHETIC_CONFIG = {
+    "hidden_size": 256,
+    "intermediate_size": 512,
+    "num_hidden_layers": 4,
+    "num_attention_heads": 8,
+    "num_key_value_heads": 4,
+    "max_position_embeddings": 4096,
+    "rms_norm_eps": 1e-5,
+    "tie_word_embeddings": False,
+}
+SYNTHETIC_SEED = 0
+# Bump when the generated checkpoint changes to invalidate the cached ones
+_SYNTHETIC_VERSION = 1
+
+_SPECIAL_TOKENS = ["<pad>", "</s>", "<s>", "<unk>"]
+
+
+def synthetic_tokenizer() -> PreTrainedTokenizerFast:
+    """Byte level tokenizer without merges: every byte of the input is a token."""
+    alphabet = sorted(pre_tokenizers.ByteLevel.alphabet())
+    vocab = {token: i for i, token in enumerate(_SPECIAL_TOKENS + alphabet)}
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[], unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(
+        add_prefix_space=False, use_regex=False
+    )
+    tokenizer.decoder = decoders.ByteLevel()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        pad_token="<pad>",
+        eos_token="</s>",
+        bos_token="<s>",
+        unk_token="<unk>",
+    )
+
+
+def synthetic_config() -> Dict:
+    config = dict(SYNTHETIC_CONFIG)
+    config.update(json.loads(os.getenv("SYNTHETIC_MODEL_CONFIG", "{}")))
+    return config
+
+
+def synthetic_model_path() -> Path:
+    """Return the directory of the synthetic checkpoint, generating it if needed."""
+    config = synthetic_config()
+    fingerprint = hashlib.sha256(
+        json.dumps(
+            {
+                "config": config,
+                "seed": SYNTHETIC_SEED,
+                "version": _SYNTHETIC_VERSION,
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()[:16]
+    path = Path(HUGGINGFACE_HUB_CACHE) / "text-generation-synthetic" / fingerprint
+    if not path.exists():
+        _write_synthetic_model(path, config)
+    return path
+
+
+def _write_synthetic_model(path: Path, config: Dict):
+    logger.info(f"Generating synthetic model in {path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary directory and rename it so that concurrent shards never
+    # load a partially written checkpoint
+    tmp_path = Path(tempfile.mkdtemp(dir=path.parent))
+    try:
+        tokenizer = synthetic_tokenizer()
+        llama_config = LlamaConfig(
+            vocab_size=len(tokenizer),
+            pad_token_id=tokenizer.pad_token_id,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            torch_dtype="float32",
+            **config,
+        )
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(SYNTHETIC_SEED)
+            model = LlamaForCausalLM(llama_config)
+        save_file(
+            {name: t.contiguous() for name, t in model.state_dict().items()},
+            tmp_path / "model.safetensors",
+            metadata={"format": "pt"},
+        )
+        llama_config.save_pretrained(tmp_path)
+        tokenizer.save_pretrained(tmp_path)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another shard generated the same checkpoint first
+            if not path.exists():
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
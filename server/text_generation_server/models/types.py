@@ -1,7 +1,9 @@
+import math
 import torch
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from itertools import accumulate
 from typing import List, Optional
 
 from transformers import PreTrainedTokenizerBase
@@ -82,6 +84,33 @@ class Tokens:
             self.is_special + other.is_special,
         )
 
+    def extend(self, other: "Tokens"):
+        """Append the tokens of `other` in place, e.g. for each prefill chunk."""
+        self.token_ids.extend(other.token_ids)
+        self.logprobs.extend(other.logprobs)
+        self.texts.extend(other.texts)
+        self.is_special.extend(other.is_special)
+
+
+@dataclass
+class Score:
+    request_id: int
+    # The first token and the tokens read from the prefix cache have a NaN logprob
+    tokens: Tokens
+
+    @property
+    def scored_logprobs(self) -> List[float]:
+        return [logprob for logprob in self.tokens.logprobs if not math.isnan(logprob)]
+
+    def to_pb(self) -> generate_pb2.Score:
+        scored_logprobs = self.scored_logprobs
+        return generate_pb2.Score(
+            request_id=self.request_id,
+            tokens=self.tokens.to_pb(),
+            nll=-sum(scored_logprobs),
+            scored_tokens=len(scored_logprobs),
+        )
+
 
 @dataclass
 class Generation:
@@ -108,3 +137,100 @@ class Generation:
                 else None
             ),
         )
+
+
+class PackedGenerations:
+    """Columnar accumulator for the generations of a step.
+
+    Tokens of every request are appended to flat lists instead of allocating a
+    `Generation` per request. Only requests with prefill tokens, top tokens or
+    a generated text get a (sparse) `Generation` entry.
+    """
+
+    def __init__(self):
+        self.request_ids: List[int] = []
+        self.token_counts: List[int] = []
+        self.token_ids: List[int] = []
+        self.logprobs: List[float] = []
+        self.is_special: List[bool] = []
+        self.texts: List[str] = []
+        self.generations: List[generate_pb2.Generation] = []
+
+    @classmethod
+    def from_generations(cls, generations: List[Generation]) -> "PackedGenerations":
+        packed = cls()
+        for generation in generations:
+            tokens = generation.tokens
+            packed.add_tokens(
+                generation.request_id,
+                tokens.token_ids,
+                tokens.logprobs,
+                tokens.texts,
+                tokens.is_special,
+            )
+            packed.add_sparse(
+                generation.request_id,
+                generation.prefill_tokens,
+                generation.generated_text,
+                generation.top_tokens,
+            )
+        return packed
+
+    def add_tokens(
+        self,
+        request_id: int,
+        token_ids: List[int],
+        logprobs: List[float],
+        texts: List[str],
+        is_special: List[bool],
+    ):
+        self.request_ids.append(request_id)
+        self.token_counts.append(len(token_ids))
+        self.token_ids.extend(token_ids)
+        self.logprobs.extend(logprobs)
+        self.texts.extend(texts)
+        self.is_special.extend(is_special)
+
+    def add_sparse(
+        self,
+        request_id: int,
+        prefill_tokens: Optional[Tokens],
+        generated_text: Optional[GeneratedText],
+        top_tokens: Optional[List[Tokens]],
+    ):
+        if prefill_tokens is None and generated_text is None and top_tokens is None:
+            return
+        self.generations.append(
+            generate_pb2.Generation(
+                request_id=request_id,
+                prefill_tokens=(
+                    prefill_tokens.to_pb() if prefill_tokens is not None else None
+                ),
+                generated_text=(
+                    generated_text.to_pb() if generated_text is not None else None
+                ),
+                top_tokens=(
+                    [tokens.to_pb() for tokens in top_tokens]
+                    if top_tokens is not None
+                    else None
+                ),
+            )
+        )
+
+    def __len__(self):
+        return len(self.request_ids)
+
+    def to_pb(self) -> generate_pb2.PackedGenerations:
+        encoded_texts = [text.encode("utf-8") for text in self.texts]
+        text_offsets = [0]
+        text_offsets.extend(accumulate(len(text) for text in encoded_texts))
+        return generate_pb2.PackedGenerations(
+            request_ids=self.request_ids,
+            token_counts=self.token_counts,
+            token_ids=self.token_ids,
+            logprobs=self.logprobs,
+            is_special=self.is_special,
+            text_offsets=text_offsets,
+            texts=b"".join(encoded_texts),
+            generations=self.generations,
+        )
@@ -310,6 +310,9 @@ class VlmCausalLMBatch(FlashCausalLMBatch):
     has_image_inputs: bool = False
     inputs_embeds: Optional[torch.Tensor] = None
 
+    # The image inputs are concatenated after the text rows, in batch order
+    group_adapter_rows = False
+
     @classmethod
     @tracer.start_as_current_span("concatenate")
     def concatenate(cls, batches):
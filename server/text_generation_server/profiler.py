@@ -0,0 +1,181 @@
+import gc
+import heapq
+import os
+import sys
+import threading
+import time
+import torch
+
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+PROFILER_OUTPUT_DIR = os.getenv(
+    "PROFILER_OUTPUT_DIR", "/tmp/text-generation-server-profiles"
+)
+# Number of steps captured when the capture is started with SIGUSR1
+PROFILER_SIGNAL_STEPS = int(os.getenv("PROFILER_SIGNAL_STEPS", "20"))
+
+
+class StackSampler:
+    """Periodically samples the Python stack of a single thread.
+
+    Stacks are aggregated in the folded format used by flamegraph tools:
+    one `outer;...;inner count` line per distinct stack.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self, path: Path):
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def write_host_memory_snapshot(path: Path, top_n: int = 100):
+    """Write the largest live Python objects and the memory used per type."""
+    gc.collect()
+    largest = []
+    per_type = Counter()
+    for obj in gc.get_objects():
+        try:
+            if isinstance(obj, torch.Tensor):
+                if obj.device.type != "cpu":
+                    continue
+                size = obj.element_size() * obj.nelement()
+                description = f"Tensor{tuple(obj.shape)} {obj.dtype}"
+            else:
+                size = sys.getsizeof(obj)
+                description = type(obj).__qualname__
+        except Exception:
+            # Some objects (weakref proxies, ...) do not support introspection
+            continue
+        type_name = type(obj).__qualname__
+        per_type[type_name] += size
+        if len(largest) < top_n:
+            heapq.heappush(largest, (size, id(obj), description))
+        elif size > largest[0][0]:
+            heapq.heapreplace(largest, (size, id(obj), description))
+
+    with open(path, "w") as f:
+        f.write("# Largest live objects (bytes, id, description)\n")
+        for size, obj_id, description in sorted(largest, reverse=True):
+            f.write(f"{size}\t{obj_id:#x}\t{description}\n")
+        f.write("\n# Shallow size per type (bytes, type)\n")
+        for type_name, size in per_type.most_common(top_n):
+            f.write(f"{size}\t{type_name}\n")
+
+
+class Profiler:
+    """On-demand profile capture of the model thread.
+
+    `start`, `step` and `stop` must be called from the model executor thread.
+    A capture stops on its own after the requested number of Prefill/Decode
+    steps or after the requested duration and writes:
+
+    - `trace.json`: `torch.profiler` Chrome trace
+    - `python_stacks.folded`: sampled Python stacks of the model thread
+    - `host_memory.txt`: largest live objects in host memory
+    """
+
+    def __init__(self, rank: int = 0, output_dir: str = PROFILER_OUTPUT_DIR):
+        self.rank = rank
+        self.output_dir = Path(output_dir)
+        self.capture_dir: Optional[Path] = None
+        # Numbers the captures, several of them can start within the same second
+        self._captures = 0
+        self._profiler = None
+        self._sampler = None
+        self._remaining_steps: Optional[int] = None
+        self._deadline: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.capture_dir is not None
+
+    def start(self, steps: Optional[int], duration: Optional[float]) -> str:
+        if self.active:
+            raise ValueError(
+                f"A profile is already being captured in {self.capture_dir}"
+            )
+        if steps is None and duration is None:
+            raise ValueError("Either `steps` or `duration` must be set")
+
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        self._captures += 1
+        capture_dir = self.output_dir / f"{timestamp}-rank-{self.rank}-{self._captures}"
+        capture_dir.mkdir(parents=True, exist_ok=True)
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        elif hasattr(torch, "xpu") and torch.xpu.is_available():
+            activities.append(torch.profiler.ProfilerActivity.XPU)
+
+        self._profiler = torch.profiler.profile(
+            activities=activities, record_shapes=True
+        )
+        self._profiler.start()
+        self._sampler = StackSampler(threading.get_ident())
+        self._sampler.start()
+
+        self._remaining_steps = steps
+        self._deadline = time.monotonic() + duration if duration is not None else None
+        self.capture_dir = capture_dir
+        logger.info(f"Started profile capture in {capture_dir}")
+        return str(capture_dir)
+
+    def step(self):
+        """Mark the end of a Prefill/Decode step."""
+        if not self.active:
+            return
+        if self._remaining_steps is not None:
+            self._remaining_steps -= 1
+            if self._remaining_steps <= 0:
+                self.stop()
+                return
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            self.stop()
+
+    def stop(self, capture_dir: Optional[str] = None):
+        """Stop the current capture, or only the one in `capture_dir` if set."""
+        if not self.active:
+            return
+        if capture_dir is not None and Path(capture_dir) != self.capture_dir:
+            return
+
+        capture_dir = self.capture_dir
+        self._profiler.stop()
+        self._profiler.export_chrome_trace(str(capture_dir / "trace.json"))
+        self._sampler.stop(capture_dir / "python_stacks.folded")
+        write_host_memory_snapshot(capture_dir / "host_memory.txt")
+
+        self.capture_dir = None
+        self._profiler = None
+        self._sampler = None
+        logger.info(f"Profile written to {capture_dir}")
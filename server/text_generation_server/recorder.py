@@ -0,0 +1,126 @@
+import asyncio
+import os
+import struct
+import time
+
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from text_generation_server.pb import generate_pb2
+
+# Shard traffic is recorded when SHARD_RECORD_PATH is set.
+# Sharded deployments write one file per rank: `{SHARD_RECORD_PATH}-{rank}`.
+SHARD_RECORD_PATH = os.getenv("SHARD_RECORD_PATH")
+
+# Each entry is a `RecordedCall` prefixed by its length as a little endian u32
+_LENGTH = struct.Struct("<I")
+
+
+class Recorder:
+    """Appends the calls received by a shard to a length-prefixed protobuf log."""
+
+    def __init__(self, path: Path, info: generate_pb2.InfoResponse):
+        self.path = path
+        self.file: BinaryIO = open(path, "wb")
+        self.start_ns = time.time_ns()
+        self.record(info=info)
+        logger.info(f"Recording shard traffic to {path}")
+
+    @classmethod
+    def from_env(
+        cls, info: generate_pb2.InfoResponse, rank: int, world_size: int
+    ) -> Optional["Recorder"]:
+        if SHARD_RECORD_PATH is None:
+            return None
+        path = SHARD_RECORD_PATH
+        if world_size > 1:
+            path = f"{path}-{rank}"
+        return cls(Path(path), info)
+
+    def record(self, start_ns: Optional[int] = None, **request):
+        """Record a call, `request` being a single `RecordedCall.request` field."""
+        now = time.time_ns()
+        start_ns = now if start_ns is None else start_ns
+        entry = generate_pb2.RecordedCall(
+            timestamp_ns=start_ns - self.start_ns,
+            duration_ns=now - start_ns,
+            **request,
+        ).SerializeToString()
+        self.file.write(_LENGTH.pack(len(entry)))
+        self.file.write(entry)
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(path: Path) -> Iterator[generate_pb2.RecordedCall]:
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(header)
+            entry = f.read(length)
+            if len(entry) < length:
+                logger.warning(f"Truncated entry at the end of {path}")
+                return
+            yield generate_pb2.RecordedCall.FromString(entry)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def report(step_times: Dict[str, List[float]]):
+    print(
+        f"{'method':>12} {'count':>8} {'mean':>10} {'p50':>10} {'p90':>10} "
+        f"{'p99':>10} {'max':>10}  (ms)"
+    )
+    for method, times in step_times.items():
+        if not times:
+            continue
+        times = sorted(times)
+        mean = sum(times) / len(times)
+        print(
+            f"{method:>12} {len(times):>8} {mean:>10.2f} "
+            f"{_percentile(times, 0.5):>10.2f} {_percentile(times, 0.9):>10.2f} "
+            f"{_percentile(times, 0.99):>10.2f} {times[-1]:>10.2f}"
+        )
+
+
+async def replay(
+    service, calls: Iterator[generate_pb2.RecordedCall], realtime: bool
+) -> Dict[str, List[float]]:
+    """Send the recorded calls to `service` and return the step times in ms per method.
+
+    Calls are sent back to back, or with their original spacing if `realtime`.
+    """
+    handlers = {
+        "warmup": service.Warmup,
+        "prefill": service.Prefill,
+        "decode": service.Decode,
+        "filter_batch": service.FilterBatch,
+        "clear_cache": service.ClearCache,
+        "load_adapter": service.LoadAdapter,
+        "unload_adapter": service.UnloadAdapter,
+        "score": service.Score,
+    }
+    step_times: Dict[str, List[float]] = {method: [] for method in handlers}
+
+    replay_start_ns = time.monotonic_ns()
+    for call in calls:
+        method = call.WhichOneof("request")
+        if method not in handlers:
+            continue
+        if realtime:
+            delay_ns = call.timestamp_ns - (time.monotonic_ns() - replay_start_ns)
+            if delay_ns > 0:
+                await asyncio.sleep(delay_ns / 1e9)
+
+        start = time.perf_counter()
+        await handlers[method](getattr(call, method), None)
+        step_times[method].append((time.perf_counter() - start) * 1e3)
+
+    return step_times
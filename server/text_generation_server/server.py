@@ -1,20 +1,38 @@
 import asyncio
+import contextlib
 import os
 import torch
 import time
 import signal
+import threading
 
 from grpc import aio
 from loguru import logger
 
 from grpc_reflection.v1alpha import reflection
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
 
 from text_generation_server.cache import Cache
+from text_generation_server.executor import ModelExecutor
 from text_generation_server.interceptor import ExceptionInterceptor
+from text_generation_server.metrics import (
+    monitor_event_loop_lag,
+    monitor_expert_load,
+    set_step_labels,
+    span,
+    start_metrics_server,
+)
 from text_generation_server.models import Model, get_model_with_lora_adapters
+from text_generation_server.models.types import Batch, PackedGenerations
+from text_generation_server.profiler import PROFILER_SIGNAL_STEPS, Profiler
+from text_generation_server.recorder import Recorder
 from text_generation_server.utils.adapter import AdapterInfo
+from text_generation_server.utils.expert_load import (
+    MOE_EXPERT_LOAD,
+    read_expert_load,
+    reset_expert_load,
+)
 from text_generation_server.utils.prefill_chunking import set_max_prefill_tokens
 
 try:
@@ -53,15 +71,56 @@ class SignalHandler:
         self.set_keep_processing(False)
 
 
+class ProfileSignalHandler:
+    """Start a profile capture of the next steps on SIGUSR1."""
+
+    def __init__(self, service: "TextGenerationService"):
+        self.service = service
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, self.start_profile
+        )
+
+    def start_profile(self):
+        asyncio.ensure_future(self._start_profile())
+
+    async def _start_profile(self):
+        try:
+            await self.service.start_profile(steps=PROFILER_SIGNAL_STEPS, duration=None)
+        except Exception:
+            logger.exception("Could not start profile capture")
+
+
+def _log_profile_stop(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.opt(exception=future.exception()).error("Could not stop profile capture")
+
+
+def _batch_adapters(batch: Optional[Batch]) -> Set[int]:
+    adapter_meta = getattr(batch, "adapter_meta", None)
+    return set(adapter_meta.adapter_set) if adapter_meta is not None else set()
+
+
 class TextGenerationService(generate_pb2_grpc.TextGenerationServiceServicer):
     def __init__(
         self,
         model: Model,
         cache: Cache,
         server_urls: List[str],
+        executor: ModelExecutor,
     ):
         self.cache = cache
         self.model = model
+        # Model steps run on a dedicated thread to keep the event loop responsive
+        self.executor = executor
+        # Adapters of the batches taken out of the cache by the running RPCs, they
+        # cannot be unloaded before the batches are cached again
+        self._adapters_in_flight: Dict[int, Set[int]] = {}
+        # In flight RPCs that were running during a ClearCache, their batches are
+        # not cached again
+        self._cleared_in_flight: Set[int] = set()
+        self._batches_lock = threading.Lock()
+        self.profiler = Profiler(rank=model.rank)
+        self.recorder = Recorder.from_env(model.info, model.rank, model.world_size)
         # Quantize is resolved during model loading
         self.quantize = model.quantize
         self.server_urls = server_urls
@@ -82,55 +141,36 @@ class TextGenerationService(generate_pb2_grpc.TextGenerationServiceServicer):
         return generate_pb2.ServiceDiscoveryResponse(urls=self.server_urls)
 
     async def ClearCache(self, request, context):
-        if request.HasField("id"):
-            self.cache.delete(request.id)
-        else:
-            self.cache.clear()
+        start = time.time_ns()
+        with self._batches_lock:
+            if request.HasField("id"):
+                self.cache.delete(request.id)
+            else:
+                self.cache.clear()
+                self._cleared_in_flight.update(self._adapters_in_flight)
+        if self.recorder is not None:
+            self.recorder.record(start, clear_cache=request)
         return generate_pb2.ClearCacheResponse()
 
     async def FilterBatch(self, request, context):
-        batch = self.cache.pop(request.batch_id)
-        if batch is None:
-            raise ValueError(f"Batch ID {request.batch_id} not found in cache.")
-        filtered_batch = batch.filter(request.request_ids)
-        self.cache.set(filtered_batch)
+        start = time.time_ns()
+        with self._batches_in_flight() as adapters:
+            batch = self._pop_batch(request.batch_id, adapters)
+            if batch is None:
+                raise ValueError(f"Batch ID {request.batch_id} not found in cache.")
+            filtered_batch = await self.executor.run(
+                self._filter, batch, request.request_ids
+            )
+            self._cache_batch(filtered_batch, adapters)
+        if self.recorder is not None:
+            self.recorder.record(start, filter_batch=request)
 
         return generate_pb2.FilterBatchResponse(batch=filtered_batch.to_pb())
 
     async def Warmup(self, request, context):
+        start = time.time_ns()
         set_max_prefill_tokens(request.max_prefill_tokens)
 
-        if self.quantize in {"exl2", "gptq"}:
-            try:
-                # When using GPTQ, Exllama kernels need some global kernels
-                # For which we have the finale shapes only after the model has loaded
-                # This will allocate those buffers.
-                from text_generation_server.layers.gptq import (
-                    create_exllama_buffers,
-                    set_device,
-                )
-
-                set_device(self.model.device)
-                create_exllama_buffers(request.max_prefill_tokens)
-            except ImportError:
-                pass
-
-        if (
-            self.model.batch_type in VLM_BATCH_TYPES
-        ):  # Hack, i would rather use kwargs in the `from_pb` call
-            batch = self.model.batch_type.from_pb_processor(
-                request.batch,
-                self.model.tokenizer,
-                self.model.processor,
-                self.model.model.config,
-                self.model.dtype,
-                self.model.device,
-            )
-        else:
-            batch = self.model.batch_type.from_pb(
-                request.batch, self.model.tokenizer, self.model.dtype, self.model.device
-            )
-
         # Override default values with None for clearer semantics.
         max_input_tokens = (
             request.max_input_tokens if request.HasField("max_input_tokens") else None
@@ -139,8 +179,16 @@ class TextGenerationService(generate_pb2_grpc.TextGenerationServiceServicer):
             request.max_total_tokens if request.HasField("max_total_tokens") else None
         )
         max_supported_total_tokens, max_input_tokens, max_total_tokens = (
-            self.model.warmup(batch, max_input_tokens, max_total_tokens)
+            await self.executor.run(
+                self._warmup,
+                request.batch,
+                request.max_prefill_tokens,
+                max_input_tokens,
+                max_total_tokens,
+            )
         )
+        if self.recorder is not None:
+            self.recorder.record(start, warmup=request)
 
         return generate_pb2.WarmupResponse(
             max_supported_total_tokens=max_supported_total_tokens,
@@ -150,39 +198,38 @@ class TextGenerationService(generate_pb2_grpc.TextGenerationServiceServicer):
 
     async def Prefill(self, request, context):
         start = time.time_ns()
-        if (
-            self.model.batch_type in VLM_BATCH_TYPES
-        ):  # Hack, i would rather use kwargs in the `from_pb` call
-            batch = self.model.batch_type.from_pb_processor(
-                request.batch,
-                self.model.tokenizer,
-                self.model.processor,
-                self.model.model.config,
-                self.model.dtype,
-                self.model.device,
-            )
-        else:
-            batch = self.model.batch_type.from_pb(
-                request.batch, self.model.tokenizer, self.model.dtype, self.model.device
-            )
-
-        concat_ns = None
-        if self.model.support_chunking:
-            if request.HasField("cached_batch"):
-                cached_batch = self.cache.pop(request.cached_batch.id)
+        with self._batches_in_flight() as adapters:
+            cached_batch = None
+            if self.model.support_chunking and request.HasField("cached_batch"):
+                cached_batch = self._pop_batch(request.cached_batch.id, adapters)
                 if cached_batch is None:
                     raise ValueError(
                         f"Batch ID {request.cached_batch.id} not found in cache."
                     )
-                start_concat = time.time_ns()
-                batch = self.model.batch_type.concatenate([cached_batch, batch])
-                concat_ns = time.time_ns() - start_concat
 
-        generations, next_batch, timings = self.model.generate_token(batch)
-        self.cache.set(next_batch)
+            manager = self.model.adapter_manager
+            if manager is not None:
+                adapters.update(
+                    manager.adapter_to_index.get(r.adapter_id, 0)
+                    for r in request.batch.requests
+                )
+                # Read the adapters that are not on the device while the model
+                # thread finishes its current step
+                manager.prefetch_cold(r.adapter_id for r in request.batch.requests)
 
+            generations, next_batch, timings, concat_ns = await self.executor.run(
+                self._prefill, request.batch, cached_batch
+            )
+            self._cache_batch(next_batch, adapters)
+        if self.recorder is not None:
+            self.recorder.record(start, prefill=request)
+
+        # The model thread can start the next step while we build the response
+        set_step_labels("prefill", len(generations))
+        with span("to_pb"):
+            generations_pb = [generation.to_pb() for generation in generations]
         return generate_pb2.PrefillResponse(
-            generations=[generation.to_pb() for generation in generations],
+            generations=generations_pb,
             batch=next_batch.to_pb() if next_batch else None,
             forward_ns=timings[0],
             decode_ns=timings[1],
@@ -195,35 +242,335 @@ class TextGenerationService(generate_pb2_grpc.TextGenerationServiceServicer):
         if len(request.batches) == 0:
             raise ValueError("Must provide at least one batch")
 
-        batches = []
-        for batch_pb in request.batches:
-            batch = self.cache.pop(batch_pb.id)
-            if batch is None:
-                raise ValueError(f"Batch ID {batch_pb.id} not found in cache.")
-            batches.append(batch)
+        with self._batches_in_flight() as adapters:
+            batches = []
+            for batch_pb in request.batches:
+                batch = self._pop_batch(batch_pb.id, adapters)
+                if batch is None:
+                    raise ValueError(f"Batch ID {batch_pb.id} not found in cache.")
+                batches.append(batch)
+
+            if len(batches) == 0:
+                raise ValueError("All batches are empty")
+
+            # Requests to keep, sent instead of a FilterBatch call before this step
+            filters = {
+                filter_pb.batch_id: filter_pb.request_ids
+                for filter_pb in request.filters
+            }
+
+            generations, next_batch, timings, concat_ns = await self.executor.run(
+                self._decode, batches, filters, request.packed_generations
+            )
+            self._cache_batch(next_batch, adapters)
+        if self.recorder is not None:
+            self.recorder.record(start, decode=request)
+
+        # The model thread can start the next step while we build the response
+        set_step_labels("decode", len(generations))
+        if request.packed_generations:
+            with span("to_pb"):
+                packed_generations_pb = generations.to_pb()
+            return generate_pb2.DecodeResponse(
+                packed_generations=packed_generations_pb,
+                batch=next_batch.to_pb() if next_batch else None,
+                concat_ns=concat_ns,
+                forward_ns=timings[0],
+                decode_ns=timings[1],
+                total_ns=time.time_ns() - start,
+            )
+        with span("to_pb"):
+            generations_pb = [generation.to_pb() for generation in generations]
+        return generate_pb2.DecodeResponse(
+            generations=generations_pb,
+            batch=next_batch.to_pb() if next_batch else None,
+            concat_ns=concat_ns,
+            forward_ns=timings[0],
+            decode_ns=timings[1],
+            total_ns=time.time_ns() - start,
+        )
+
+    async def Score(self, request, context):
+        start = time.time_ns()
+        if self.model.batch_type in VLM_BATCH_TYPES:
+            raise ValueError("Scoring is not supported for vision models")
+        if self.model.adapter_manager is not None:
+            self.model.adapter_manager.prefetch_cold(
+                r.adapter_id for r in request.batch.requests
+            )
 
-        if len(batches) == 0:
-            raise ValueError("All batches are empty")
+        scores = await self.executor.run(
+            self._score, request.batch, list(request.targets)
+        )
+        if self.recorder is not None:
+            self.recorder.record(start, score=request)
+
+        with span("to_pb"):
+            scores_pb = [score.to_pb() for score in scores]
+        return generate_pb2.ScoreResponse(
+            scores=scores_pb, total_ns=time.time_ns() - start
+        )
+
+    async def Profile(self, request, context):
+        steps = request.steps if request.HasField("steps") else None
+        duration = request.duration_s if request.HasField("duration_s") else None
+        output_dir = await self.start_profile(steps, duration)
+        return generate_pb2.ProfileResponse(output_dir=output_dir)
+
+    async def start_profile(self, steps: Optional[int], duration: Optional[float]):
+        output_dir = await self.executor.run(self.profiler.start, steps, duration)
+        if duration is not None:
+            # Also stop the capture if no step is running when the time is up
+            asyncio.get_running_loop().call_later(
+                duration, self._stop_profile, output_dir
+            )
+        return output_dir
+
+    def _stop_profile(self, output_dir: str):
+        future = asyncio.ensure_future(
+            self.executor.run(self.profiler.stop, output_dir)
+        )
+        # Nothing awaits the stop, its errors would be lost
+        future.add_done_callback(_log_profile_stop)
+
+    async def LoadAdapter(self, request, context):
+        start = time.time_ns()
+        manager = self._adapter_manager()
+        adapter = AdapterInfo(
+            id=request.adapter_id,
+            path=request.path if request.HasField("path") else None,
+            revision=request.revision if request.HasField("revision") else None,
+        )
+        adapter_index = manager.register(adapter)
+        prefetch = manager.prefetch(adapter.id)
+        if not request.prefetch:
+            # Read the weights without blocking the model thread, `load` raises
+            # the loading errors
+            with contextlib.suppress(Exception):
+                await asyncio.wrap_future(prefetch)
+            adapter_index = await self.executor.run(manager.load, adapter)
+        if self.recorder is not None:
+            self.recorder.record(start, load_adapter=request)
+        return generate_pb2.LoadAdapterResponse(
+            adapter_index=adapter_index, active=adapter.id in manager.active
+        )
+
+    async def UnloadAdapter(self, request, context):
+        start = time.time_ns()
+        self._adapter_manager()
+        await self.executor.run(self._unload_adapter, request.adapter_id)
+        if self.recorder is not None:
+            self.recorder.record(start, unload_adapter=request)
+        return generate_pb2.UnloadAdapterResponse()
+
+    def _adapter_manager(self):
+        if self.model.adapter_manager is None:
+            raise ValueError("This model does not support LoRA adapters")
+        return self.model.adapter_manager
+
+    @contextlib.contextmanager
+    def _batches_in_flight(self):
+        """Collect the adapters of the batches an RPC works on until it returns"""
+        adapters = set()
+        with self._batches_lock:
+            self._adapters_in_flight[id(adapters)] = adapters
+        try:
+            yield adapters
+        finally:
+            with self._batches_lock:
+                del self._adapters_in_flight[id(adapters)]
+                self._cleared_in_flight.discard(id(adapters))
+
+    def _pop_batch(self, batch_id: int, adapters: Set[int]) -> Optional[Batch]:
+        # The batch is in the cache or in flight for a concurrent unload
+        with self._batches_lock:
+            batch = self.cache.pop(batch_id)
+            adapters.update(_batch_adapters(batch))
+        return batch
+
+    def _cache_batch(self, batch: Optional[Batch], adapters: Set[int]):
+        with self._batches_lock:
+            if id(adapters) not in self._cleared_in_flight:
+                self.cache.set(batch)
+
+    def _adapters_in_use(self) -> Set[int]:
+        in_use = set()
+        for batch in self.cache.cache.values():
+            in_use.update(_batch_adapters(batch))
+        for adapters in self._adapters_in_flight.values():
+            in_use.update(adapters)
+        return in_use
+
+    async def DecodeStream(self, request_iterator, context):
+        # Commands are processed in order, one response per command
+        async for command in request_iterator:
+            kind = command.WhichOneof("command")
+            if kind == "decode":
+                response = generate_pb2.DecodeStreamResponse(
+                    decode=await self.Decode(command.decode, context)
+                )
+            elif kind == "filter":
+                response = generate_pb2.DecodeStreamResponse(
+                    filter=await self.FilterBatch(command.filter, context)
+                )
+            elif kind == "prefill":
+                response = generate_pb2.DecodeStreamResponse(
+                    prefill=await self.Prefill(command.prefill, context)
+                )
+            else:
+                raise ValueError(f"Unknown DecodeStream command {kind}")
+            yield response
+
+    # The methods below run on the model executor thread
+
+    def _batch_from_pb(self, batch_pb: generate_pb2.Batch):
+        with span("from_pb"):
+            if (
+                self.model.batch_type in VLM_BATCH_TYPES
+            ):  # Hack, i would rather use kwargs in the `from_pb` call
+                return self.model.batch_type.from_pb_processor(
+                    batch_pb,
+                    self.model.tokenizer,
+                    self.model.processor,
+                    self.model.model.config,
+                    self.model.dtype,
+                    self.model.device,
+                )
+            return self.model.batch_type.from_pb(
+                batch_pb, self.model.tokenizer, self.model.dtype, self.model.device
+            )
+
+    def _warmup(
+        self,
+        batch_pb: generate_pb2.Batch,
+        max_prefill_tokens: int,
+        max_input_tokens: Optional[int],
+        max_total_tokens: Optional[int],
+    ):
+        if self.quantize in {"exl2", "gptq"}:
+            try:
+                # When using GPTQ, Exllama kernels need some global kernels
+                # For which we have the finale shapes only after the model has loaded
+                # This will allocate those buffers.
+                from text_generation_server.layers.gptq import (
+                    create_exllama_buffers,
+                    set_device,
+                )
 
+                set_device(self.model.device)
+                create_exllama_buffers(max_prefill_tokens)
+            except ImportError:
+                pass
+
+        set_step_labels("warmup", len(batch_pb.requests))
+        batch = self._batch_from_pb(batch_pb)
+        result = self.model.warmup(batch, max_input_tokens, max_total_tokens)
+        # Only count the routing of the requests
+        reset_expert_load()
+        return result
+
+    def _activate_adapters(
+        self, batches: List[Batch], batch_pb: Optional[generate_pb2.Batch] = None
+    ):
+        """Page in the adapters used by the step, evicted adapters come back here"""
+        manager = self.model.adapter_manager
+        if manager is None or not manager.adapters:
+            return
+        indices = set()
+        for batch in batches:
+            adapter_meta = getattr(batch, "adapter_meta", None)
+            if adapter_meta is not None:
+                indices.update(adapter_meta.adapter_set)
+        if batch_pb is not None:
+            indices.update(
+                manager.adapter_to_index.get(r.adapter_id, 0) for r in batch_pb.requests
+            )
+        indices.discard(0)
+        if manager.activate(indices):
+            # Drop the weights prepared for the previous steps
+            for batch in batches:
+                if getattr(batch, "adapter_data", None) is not None:
+                    batch.adapter_data = None
+
+    def _unload_adapter(self, adapter_id: str):
+        # The batches cannot be taken out of the cache or cached again meanwhile
+        with self._batches_lock:
+            self.model.adapter_manager.unload(adapter_id, self._adapters_in_use())
+
+    def _filter(self, batch: Batch, request_ids: List[int]) -> Batch:
+        set_step_labels("filter", len(request_ids))
+        with span("filter"):
+            return batch.filter(request_ids)
+
+    def _prefill(self, batch_pb: generate_pb2.Batch, cached_batch: Optional[Batch]):
+        batch_size = len(batch_pb.requests)
+        if cached_batch is not None:
+            batch_size += len(cached_batch)
+        set_step_labels("prefill", batch_size)
+        self._activate_adapters([cached_batch] if cached_batch else [], batch_pb)
+        batch = self._batch_from_pb(batch_pb)
+
+        concat_ns = None
+        if cached_batch is not None:
+            start_concat = time.time_ns()
+            with span("concatenate"):
+                batch = self.model.batch_type.concatenate([cached_batch, batch])
+            concat_ns = time.time_ns() - start_concat
+
+        generations, next_batch, timings = self.model.generate_token(batch)
+        self.profiler.step()
+        return generations, next_batch, timings, concat_ns
+
+    def _score(self, batch_pb: generate_pb2.Batch, targets: List[str]):
+        set_step_labels("score", len(batch_pb.requests))
+        self._activate_adapters([], batch_pb)
+        scores = self.model.score(batch_pb, targets)
+        self.profiler.step()
+        return scores
+
+    def _decode(
+        self,
+        batches: List[Batch],
+        filters: Dict[int, List[int]],
+        packed_generations: bool,
+    ):
+        set_step_labels("decode", sum(len(batch) for batch in batches))
+        if filters:
+            filtered_batches = []
+            for batch in batches:
+                request_ids = filters.get(batch.batch_id)
+                if request_ids is None:
+                    filtered_batches.append(batch)
+                elif len(request_ids) > 0:
+                    with span("filter"):
+                        filtered_batches.append(batch.filter(request_ids))
+                # An empty keep-list drops the batch altogether
+            batches = filtered_batches
+
+            if len(batches) == 0:
+                generations = PackedGenerations() if packed_generations else []
+                return generations, None, (0, 0), None
+
+        self._activate_adapters(batches)
         if len(batches) > 1:
             start_concat = time.time_ns()
-            batch = self.model.batch_type.concatenate(batches)
+            with span("concatenate"):
+                batch = self.model.batch_type.concatenate(batches)
             concat_ns = time.time_ns() - start_concat
         else:
             batch = batches[0]
             concat_ns = None
 
-        generations, next_batch, timings = self.model.generate_token(batch)
-        self.cache.set(next_batch)
-
-        return generate_pb2.DecodeResponse(
-            generations=[generation.to_pb() for generation in generations],
-            batch=next_batch.to_pb() if next_batch else None,
-            concat_ns=concat_ns,
-            forward_ns=timings[0],
-            decode_ns=timings[1],
-            total_ns=time.time_ns() - start,
-        )
+        if packed_generations and self.model.support_packed_generations:
+            generations, next_batch, timings = self.model.generate_token(
+                batch, packed_generations=True
+            )
+        else:
+            generations, next_batch, timings = self.model.generate_token(batch)
+            if packed_generations:
+                generations = PackedGenerations.from_generations(generations)
+        self.profiler.step()
+        return generations, next_batch, timings, concat_ns
 
 
 def serve(
@@ -294,9 +641,10 @@ def serve(
                 ("grpc.max_receive_message_length", (1 << 31) - 1)
             ],
         )
-        generate_pb2_grpc.add_TextGenerationServiceServicer_to_server(
-            TextGenerationService(model, Cache(), server_urls), server
-        )
+        executor = ModelExecutor(model.device)
+        service = TextGenerationService(model, Cache(), server_urls, executor)
+        ProfileSignalHandler(service)
+        generate_pb2_grpc.add_TextGenerationServiceServicer_to_server(service, server)
         SERVICE_NAMES = (
             generate_pb2.DESCRIPTOR.services_by_name["TextGenerationService"].full_name,
             reflection.SERVICE_NAME,
@@ -305,11 +653,26 @@ def serve(
         server.add_insecure_port(local_url)
 
         await server.start()
+        start_metrics_server(model.rank)
+        lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+        expert_load_monitor = None
+        if MOE_EXPERT_LOAD:
+            # Read on the model thread, after the queued steps
+            expert_load_monitor = asyncio.create_task(
+                monitor_expert_load(lambda: executor.run(read_expert_load))
+            )
 
         logger.info("Server started at {}".format(local_url))
         while signal_handler.KEEP_PROCESSING:
             await asyncio.sleep(0.5)
 
+        lag_monitor.cancel()
+        if expert_load_monitor is not None:
+            expert_load_monitor.cancel()
+        executor.shutdown()
+        if service.recorder is not None:
+            service.recorder.close()
+
     asyncio.run(
         serve_inner(
             model_id,
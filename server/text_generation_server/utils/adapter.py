@@ -8,9 +8,11 @@ from dataclasses import dataclass
 from functools import lru_cache
 from typing import TYPE_CHECKING, Set, Tuple, Optional, List
 
+import torch
 from safetensors.torch import load_file
 from transformers import AutoConfig, AutoTokenizer, PreTrainedTokenizer
 
+from text_generation_server.utils.merges.cache import load_merge, merge_key, save_merge
 from text_generation_server.utils.merges.strategies import merge_adapters
 
 from text_generation_server.utils import hub
@@ -35,9 +37,11 @@ class AdapterInfo:
 class AdapterParameters:
     adapter_info: Tuple[AdapterInfo]
     weights: Tuple[float]
-    merge_strategy: NotImplemented
-    density: float
-    majority_sign_method: NotImplemented
+    # One of `strategy_registry` in `utils/merges/strategies.py`
+    merge_strategy: str = "linear"
+    density: float = 1.0
+    # "total" or "frequency"
+    majority_sign_method: str = "total"
 
 
 @dataclass
@@ -74,6 +78,7 @@ def load_and_merge_adapters(
     adapter_index: int,
     weight_names: Tuple[str],
     trust_remote_code: bool = False,
+    device: Optional[torch.device] = None,
 ) -> Tuple["ModuleMap", "AdapterConfig", Set[str], PreTrainedTokenizer]:
     if len(adapter_parameters.adapter_info) == 1:
         adapter = next(iter(adapter_parameters.adapter_info))
@@ -92,6 +97,7 @@ def load_and_merge_adapters(
         adapter_params,
         weight_names,
         trust_remote_code,
+        device,
     )
 
 
@@ -110,16 +116,34 @@ def _load_and_merge(
     adapter_params: AdapterParametersContainer,
     weight_names: Tuple[str],
     trust_remote_code: bool = False,
+    device: Optional[torch.device] = None,
 ) -> Tuple["ModuleMap", "AdapterConfig", Set[str], PreTrainedTokenizer]:
     params = adapter_params.adapter_parameters
 
+    if any(adapter.id == BASE_MODEL_ADAPTER_ID for adapter in params.adapter_info):
+        raise ValueError("Base model adapter cannot be merged.")
+
+    # Merges are saved to disk, keyed by the adapter files and the merge parameters
+    adapter_files = [
+        load_adapter_files(
+            model_id, adapter.revision, adapter.id, adapter.path, trust_remote_code
+        )
+        for adapter in params.adapter_info
+    ]
+    tokenizer = next(
+        (files[2] for files in adapter_files if files[2] is not None), None
+    )
+    key = merge_key(
+        model_id, params, [files[1] for files in adapter_files], weight_names
+    )
+    cached = load_merge(key)
+    if cached is not None:
+        module_map, adapter_config, merged_weight_names = cached
+        return module_map, adapter_config, merged_weight_names, tokenizer
+
     adapters_to_merge = []
     merged_weight_names = set()
-    tokenizer = None
     for adapter in params.adapter_info:
-        if adapter.id == BASE_MODEL_ADAPTER_ID:
-            raise ValueError("Base model adapter cannot be merged.")
-
         (
             module_map,
             adapter_config,
@@ -136,13 +160,15 @@ def _load_and_merge(
 
         adapters_to_merge.append((module_map, adapter_config))
         merged_weight_names = merged_weight_names.union(adapter_weight_names)
-        if tokenizer is None:
-            tokenizer = adapter_tokenizer
 
     if len(adapters_to_merge) == 0:
         raise ValueError("No adapters to merge.")
 
-    module_map, adapter_config = merge_adapters(adapters_to_merge, params)
+    # The same seed on every shard, for the random pruning of the DARE strategies
+    module_map, adapter_config = merge_adapters(
+        adapters_to_merge, params, device=device, seed=int(key[:8], 16)
+    )
+    save_merge(key, module_map, adapter_config, merged_weight_names)
     return module_map, adapter_config, merged_weight_names, tokenizer
 
 
@@ -184,15 +210,14 @@ def check_architectures(
         )
 
 
-@lru_cache(maxsize=128)
-def load_module_map(
+def load_adapter_files(
     model_id: str,
     revision: str,
     adapter_id: str,
     adapter_path: Optional[str],
-    weight_names: Tuple[str],
     trust_remote_code: bool = False,
-) -> Tuple["ModuleMap", "AdapterConfig", Set[str], PreTrainedTokenizer]:
+) -> Tuple["AdapterConfig", List[str], Optional[PreTrainedTokenizer]]:
+    """Resolve the config, the safetensors files and the tokenizer of an adapter."""
     adapter_config = LoraConfig.load(adapter_path or adapter_id, None)
 
     if not adapter_path and adapter_config.base_model_name_or_path != model_id:
@@ -206,6 +231,12 @@ def load_module_map(
         )
     )
 
+    if not adapter_filenames and not adapter_path and not hub.HF_HUB_OFFLINE:
+        # Adapters loaded while serving were not downloaded by the launcher
+        adapter_filenames = hub.download_weights(
+            hub.weight_hub_files(adapter_id, revision), adapter_id, revision
+        )
+
     # throw an error if no adapter weights are found
     if not adapter_filenames:
         raise FileNotFoundError(
@@ -221,6 +252,22 @@ def load_module_map(
         # Adapter does not have a tokenizer, so fallback to base model tokenizer
         adapter_tokenizer = None
 
+    return adapter_config, adapter_filenames, adapter_tokenizer
+
+
+@lru_cache(maxsize=128)
+def load_module_map(
+    model_id: str,
+    revision: str,
+    adapter_id: str,
+    adapter_path: Optional[str],
+    weight_names: Tuple[str],
+    trust_remote_code: bool = False,
+) -> Tuple["ModuleMap", "AdapterConfig", Set[str], PreTrainedTokenizer]:
+    adapter_config, adapter_filenames, adapter_tokenizer = load_adapter_files(
+        model_id, revision, adapter_id, adapter_path, trust_remote_code
+    )
+
     # load adapter weights from all shards (should have relatively small memory footprint)
     adapter_weights = {}
     for filename in adapter_filenames:
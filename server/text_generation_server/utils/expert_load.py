@@ -0,0 +1,87 @@
+import os
+
+from typing import Dict, List, Optional
+
+import torch
+
+# Count the tokens routed to each expert of the MoE layers, disabled by default.
+# The counts are accumulated on the device and exported every
+# MOE_EXPERT_LOAD_INTERVAL seconds as `tgi_shard_moe_expert_tokens`.
+MOE_EXPERT_LOAD = os.getenv("MOE_EXPERT_LOAD", "0").lower() in {"1", "true"}
+MOE_EXPERT_LOAD_INTERVAL = float(os.getenv("MOE_EXPERT_LOAD_INTERVAL", "10"))
+
+
+# Number of real tokens of the batch a CUDA graph is replayed on, by device. The
+# graphs are captured for padded batches and only count the rows before it.
+_GRAPH_TOKENS: Dict[str, torch.Tensor] = {}
+
+
+def _graph_tokens(device: torch.device) -> torch.Tensor:
+    key = str(device)
+    if key not in _GRAPH_TOKENS:
+        _GRAPH_TOKENS[key] = torch.zeros((), dtype=torch.int64, device=device)
+    return _GRAPH_TOKENS[key]
+
+
+def set_graph_tokens(num_tokens: int):
+    """Set the number of real tokens before replaying a CUDA graph."""
+    for tokens in _GRAPH_TOKENS.values():
+        tokens.fill_(num_tokens)
+
+
+class ExpertLoad:
+    """Number of tokens routed to each expert of a MoE layer.
+
+    Recording does not synchronize with the host and can be captured in CUDA
+    graphs: the counters are only updated in place.
+    """
+
+    def __init__(self, n_experts: int, device: torch.device):
+        self.counts = torch.zeros(n_experts, dtype=torch.int64, device=device)
+        self.graph_tokens = _graph_tokens(device)
+
+    def record(self, topk_ids: torch.Tensor):
+        ids = topk_ids.reshape(-1).long()
+        if torch.cuda.is_available() and torch.cuda.is_current_stream_capturing():
+            # The padding rows of the replayed batches are not counted
+            rows = torch.arange(topk_ids.shape[0], device=ids.device)
+            real = (rows < self.graph_tokens).view(-1, 1).expand_as(topk_ids)
+            self.counts.index_add_(0, ids, real.reshape(-1).long())
+        else:
+            self.counts.index_add_(0, ids, torch.ones_like(ids))
+
+
+_EXPERT_LOADS: Dict[str, ExpertLoad] = {}
+
+
+def expert_load(
+    prefix: str, n_experts: int, device: torch.device
+) -> Optional[ExpertLoad]:
+    """Counters of the layer at `prefix`, None when `MOE_EXPERT_LOAD` is not set."""
+    if not MOE_EXPERT_LOAD:
+        return None
+    load = ExpertLoad(n_experts, device)
+    _EXPERT_LOADS[prefix] = load
+    return load
+
+
+def read_expert_load() -> Dict[str, List[int]]:
+    """Tokens routed to each expert since the last reset, by layer prefix."""
+    if not _EXPERT_LOADS:
+        return {}
+    prefixes = list(_EXPERT_LOADS)
+    counts = [_EXPERT_LOADS[prefix].counts for prefix in prefixes]
+    # Single copy to the host for all layers
+    flat = torch.cat([c.to(counts[0].device) for c in counts]).tolist()
+    loads = {}
+    start = 0
+    for prefix, c in zip(prefixes, counts):
+        loads[prefix] = flat[start : start + c.numel()]
+        start += c.numel()
+    return loads
+
+
+def reset_expert_load():
+    """Zero the counters, e.g. to forget the routing of the warmup batches."""
+    for load in _EXPERT_LOADS.values():
+        load.counts.zero_()
@@ -0,0 +1,121 @@
+import math
+import urllib.request
+
+from dataclasses import dataclass
+from typing import Dict, List
+
+from prometheus_client.parser import text_string_to_metric_families
+
+EXPERT_TOKENS_METRIC = "tgi_shard_moe_expert_tokens"
+
+
+@dataclass
+class ExpertPlacement:
+    # Experts of each rank, replicated experts are on several ranks
+    experts: List[List[int]]
+    # Number of copies of each expert
+    copies: List[int]
+    # Tokens of each rank, the tokens of an expert are split between its copies
+    rank_loads: List[float]
+    # Most loaded rank over the mean, for this placement and for the contiguous one
+    imbalance: float
+    contiguous_imbalance: float
+
+
+def read_metrics(source: str) -> str:
+    """Prometheus text of a shard metrics endpoint or of a file saved from one."""
+    if source.startswith(("http://", "https://")):
+        with urllib.request.urlopen(source) as response:
+            return response.read().decode("utf-8")
+    with open(source) as f:
+        return f.read()
+
+
+def parse_expert_load(text: str) -> Dict[str, List[int]]:
+    """Tokens of each expert by layer, from the expert counters of a shard."""
+    samples = {}
+    for family in text_string_to_metric_families(text):
+        # Older parsers keep the `_total` suffix in the family name
+        if family.name not in {EXPERT_TOKENS_METRIC, f"{EXPERT_TOKENS_METRIC}_total"}:
+            continue
+        for sample in family.samples:
+            if not sample.name.endswith("_total"):
+                continue
+            layer = sample.labels["layer"]
+            expert = int(sample.labels["expert"])
+            samples.setdefault(layer, {})[expert] = int(sample.value)
+
+    loads = {}
+    for layer, counts in samples.items():
+        loads[layer] = [counts.get(expert, 0) for expert in range(max(counts) + 1)]
+    return loads
+
+
+def merge_expert_load(loads: List[Dict[str, List[int]]]) -> Dict[str, List[int]]:
+    """Sum the tokens of each expert over several shards, e.g. one per replica."""
+    merged = {}
+    for load in loads:
+        for layer, counts in load.items():
+            total = merged.setdefault(layer, [])
+            # The shards may not report the same experts
+            total.extend([0] * (len(counts) - len(total)))
+            for expert, count in enumerate(counts):
+                total[expert] += count
+    return merged
+
+
+def _imbalance(rank_loads: List[float]) -> float:
+    mean = sum(rank_loads) / len(rank_loads)
+    return max(rank_loads) / mean if mean > 0 else 1.0
+
+
+def propose_placement(
+    counts: List[int], num_ranks: int, replicas: int = 0
+) -> ExpertPlacement:
+    """Place the experts of a layer on `num_ranks` ranks, balancing their tokens.
+
+    The `replicas` additional copies go to the experts with the most tokens per
+    copy, the tokens of a replicated expert are assumed to be split evenly between
+    its copies. The copies are then placed from the most to the least loaded, each
+    on the least loaded rank that still has a free slot. All ranks get the same
+    number of slots.
+    """
+    n_experts = len(counts)
+    copies = [1] * n_experts
+    for _ in range(replicas):
+        candidates = [e for e in range(n_experts) if copies[e] < num_ranks]
+        if not candidates:
+            break
+        expert = max(candidates, key=lambda e: counts[e] / copies[e])
+        copies[expert] += 1
+
+    slots = math.ceil(sum(copies) / num_ranks)
+    items = sorted(
+        [
+            (counts[e] / copies[e], e)
+            for e in range(n_experts)
+            for _ in range(copies[e])
+        ],
+        key=lambda item: (-item[0], item[1]),
+    )
+    experts = [[] for _ in range(num_ranks)]
+    rank_loads = [0.0] * num_ranks
+    for load, expert in items:
+        free = [r for r in range(num_ranks) if len(experts[r]) < slots]
+        # Copies of an expert go to different ranks when possible
+        candidates = [r for r in free if expert not in experts[r]] or free
+        rank = min(candidates, key=lambda r: rank_loads[r])
+        experts[rank].append(expert)
+        rank_loads[rank] += load
+
+    contiguous_loads = [0.0] * num_ranks
+    for expert, count in enumerate(counts):
+        contiguous_loads[expert * num_ranks // n_experts] += count
+
+    return ExpertPlacement(
+        experts=[sorted(rank_experts) for rank_experts in experts],
+        copies=copies,
+        rank_loads=rank_loads,
+        imbalance=_imbalance(rank_loads),
+        contiguous_imbalance=_imbalance(contiguous_loads),
+    )
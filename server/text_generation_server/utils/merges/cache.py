@@ -0,0 +1,129 @@
+import dataclasses
+import hashlib
+import json
+import os
+import tempfile
+
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Set, Tuple
+
+from huggingface_hub.constants import HUGGINGFACE_HUB_CACHE
+from loguru import logger
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from text_generation_server.adapters.lora import LoraConfig
+
+if TYPE_CHECKING:
+    from text_generation_server.adapters.config import ModuleMap
+    from text_generation_server.utils.adapter import AdapterParameters
+
+# Directory of the adapter merges computed by previous runs
+ADAPTER_MERGE_CACHE = os.getenv(
+    "ADAPTER_MERGE_CACHE", os.path.join(HUGGINGFACE_HUB_CACHE, "tgi-adapter-merges")
+)
+
+
+def merge_key(
+    model_id: str,
+    params: "AdapterParameters",
+    adapter_filenames: List[List[str]],
+    weight_names: Tuple[str],
+) -> str:
+    """Key of a merge, changes with the files of the adapters and the merge parameters.
+
+    The files of hub adapters resolve to blobs named after their content, the files
+    of local adapters are identified by their size and modification time.
+    """
+    adapters = []
+    for adapter, filenames in zip(params.adapter_info, adapter_filenames):
+        files = []
+        for filename in filenames:
+            path = os.path.realpath(filename)
+            stat = os.stat(path)
+            files.append([path, stat.st_size, stat.st_mtime_ns])
+        adapters.append(
+            {
+                "id": adapter.id,
+                "path": adapter.path,
+                "revision": adapter.revision,
+                "files": sorted(files),
+            }
+        )
+    description = {
+        "model_id": model_id,
+        "adapters": adapters,
+        "weights": list(params.weights) if params.weights else None,
+        "merge_strategy": params.merge_strategy,
+        "density": params.density,
+        "majority_sign_method": params.majority_sign_method,
+        "weight_names": sorted(weight_names),
+    }
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def merge_path(key: str) -> Path:
+    return Path(ADAPTER_MERGE_CACHE) / f"{key}.safetensors"
+
+
+def load_merge(key: str) -> Optional[Tuple["ModuleMap", LoraConfig, Set[str]]]:
+    """Merge saved by `save_merge`, None if it is not cached."""
+    path = merge_path(key)
+    if not path.exists():
+        return None
+    try:
+        with safe_open(str(path), framework="pt") as f:
+            metadata = f.metadata()
+            param_names = json.loads(metadata["param_names"])
+            module_map = {}
+            for tensor_name, (weight_name, k, param_name) in param_names.items():
+                module_map.setdefault(weight_name, {})[k] = (
+                    f.get_tensor(tensor_name),
+                    param_name,
+                )
+        adapter_config = LoraConfig(**json.loads(metadata["config"]))
+        weight_names = set(json.loads(metadata["weight_names"]))
+    except Exception:
+        logger.exception(f"Could not read the cached adapter merge {path}")
+        return None
+    logger.info(f"Loaded the adapter merge from {path}")
+    return module_map, adapter_config, weight_names
+
+
+def save_merge(
+    key: str,
+    module_map: "ModuleMap",
+    adapter_config: LoraConfig,
+    weight_names: Set[str],
+):
+    """Save a merge for the next runs. Failures are logged, the cache is optional."""
+    path = merge_path(key)
+    tensors = {}
+    param_names = {}
+    for weight_name, data in module_map.items():
+        for k, (tensor, param_name) in data.items():
+            tensor_name = f"{weight_name}.{k}"
+            tensors[tensor_name] = tensor.detach().contiguous().cpu()
+            param_names[tensor_name] = [weight_name, k, param_name]
+    metadata = {
+        "param_names": json.dumps(param_names),
+        "config": json.dumps(dataclasses.asdict(adapter_config), default=sorted),
+        "weight_names": json.dumps(sorted(weight_names)),
+    }
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The shards may save the same merge concurrently
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            save_file(tensors, tmp_path, metadata=metadata)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except Exception as e:
+        logger.warning(f"Could not cache the adapter merge in {path}: {e}")
+        return
+    logger.info(f"Saved the adapter merge to {path}")
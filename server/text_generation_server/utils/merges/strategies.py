@@ -1,10 +1,11 @@
 import copy
 from abc import ABC
 from collections import defaultdict
-from typing import TYPE_CHECKING, Dict, List, Tuple, Type, Union
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Type, Union
 from text_generation_server.utils.merges.utils import (
     calculate_majority_sign_mask,
     disjoint_merge,
+    merge_device,
     prune,
 )
 import torch
@@ -68,10 +69,9 @@ class TiesMerge(MergeStrategy):
         self, task_tensors: List[torch.Tensor], weights: torch.Tensor
     ) -> torch.Tensor:
         # sparsify
-        task_tensors = [
-            prune(tensor, self.density, method="magnitude") for tensor in task_tensors
-        ]
-        task_tensors = torch.stack(task_tensors, dim=0)
+        task_tensors = prune(
+            torch.stack(task_tensors, dim=0), self.density, method="magnitude"
+        )
 
         # elect sign before applying weights
         majority_sign_mask = calculate_majority_sign_mask(
@@ -84,35 +84,53 @@ class TiesMerge(MergeStrategy):
 
 
 class DareLinearMerge(MergeStrategy):
-    def __init__(self, density: float, **kwargs):
+    def __init__(
+        self,
+        density: float,
+        generator: Optional[torch.Generator] = None,
+        **kwargs,
+    ):
         self.density = density
+        self.generator = generator
 
     def merge(
         self, task_tensors: List[torch.Tensor], weights: torch.Tensor
     ) -> torch.Tensor:
         # sparsify
-        task_tensors = [
-            prune(tensor, self.density, method="random", rescale=True)
-            for tensor in task_tensors
-        ]
+        task_tensors = prune(
+            torch.stack(task_tensors, dim=0),
+            self.density,
+            method="random",
+            rescale=True,
+            generator=self.generator,
+        )
         weighted_task_tensors = _apply_weights(task_tensors, weights)
         return weighted_task_tensors.sum(dim=0)
 
 
 class DareTiesMerge(MergeStrategy):
-    def __init__(self, density: float, majority_sign_method: str = "total", **kwargs):
+    def __init__(
+        self,
+        density: float,
+        majority_sign_method: str = "total",
+        generator: Optional[torch.Generator] = None,
+        **kwargs,
+    ):
         self.density = density
         self.majority_sign_method = majority_sign_method
+        self.generator = generator
 
     def merge(
         self, task_tensors: List[torch.Tensor], weights: torch.Tensor
     ) -> torch.Tensor:
         # sparsify
-        task_tensors = [
-            prune(tensor, self.density, method="random", rescale=True)
-            for tensor in task_tensors
-        ]
-        task_tensors = torch.stack(task_tensors, dim=0)
+        task_tensors = prune(
+            torch.stack(task_tensors, dim=0),
+            self.density,
+            method="random",
+            rescale=True,
+            generator=self.generator,
+        )
 
         # elect sign before applying weights
         majority_sign_mask = calculate_majority_sign_mask(
@@ -136,22 +154,38 @@ strategy_registry: Dict[str, Type[MergeStrategy]] = {
 def merge_adapters(
     adapters: List[Tuple["ModuleMap", "LoraConfig"]],
     merge_params: AdapterParameters,
+    device: Optional[torch.device] = None,
+    seed: Optional[int] = None,
 ) -> Tuple["ModuleMap", "LoraConfig"]:
-    # strategy_name = MergeStrategyEnum.Name(merge_params.merge_strategy).lower()
-    strategy_name = "linear"
+    """Merge the LoRA weights of `adapters`, on `device` (the accelerator by default).
+
+    `seed` makes the random pruning of the DARE strategies reproducible, so that
+    all the shards compute the same merge.
+    """
+    strategy_name = merge_params.merge_strategy or "linear"
+    if strategy_name not in strategy_registry:
+        raise ValueError(
+            f"Unknown merge strategy {strategy_name}, "
+            f"expected one of {list(strategy_registry)}"
+        )
+    if device is None:
+        device = merge_device()
 
     weights = merge_params.weights
     if not weights:
-        weights = torch.ones(len(adapters))
+        weights = torch.ones(len(adapters), device=device)
     else:
-        weights = torch.tensor(weights)
+        weights = torch.tensor(weights, device=device)
+
+    generator = None
+    if seed is not None:
+        generator = torch.Generator(device=device)
+        generator.manual_seed(seed)
 
     merge_config = {
         "density": merge_params.density,
-        # "majority_sign_method": MajoritySignMethodEnum.Name(
-        #     merge_params.majority_sign_method
-        # ).lower(),
-        "majority_sign_method": "total",
+        "majority_sign_method": merge_params.majority_sign_method or "total",
+        "generator": generator,
     }
     merge_strategy = strategy_registry[strategy_name](**merge_config)
 
@@ -181,6 +215,7 @@ def merge_adapters(
         param_weights = weights[indices]
         for k, param_data in data.items():
             for param_name, tensors in param_data.items():
+                tensors = [tensor.to(device) for tensor in tensors]
                 merged_tensor = merge_strategy.merge(tensors, param_weights)
                 merged_module_map[weight_name][k] = (merged_tensor, param_name)
 
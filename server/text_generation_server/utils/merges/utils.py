@@ -15,41 +15,57 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Literal
+from typing import Literal, Optional
 
 import torch
 
 
+def merge_device() -> torch.device:
+    """Device the merges run on: the accelerator when there is one."""
+    if torch.cuda.is_available():
+        return torch.device("cuda", torch.cuda.current_device())
+    if hasattr(torch, "xpu") and torch.xpu.is_available():
+        return torch.device("xpu", torch.xpu.current_device())
+    return torch.device("cpu")
+
+
 def magnitude_based_pruning(tensor: torch.Tensor, density: float) -> torch.Tensor:
     """
     Prune the smallest values of the task tensors and retain the top-k values based on the specified fraction
-    `density`.
+    `density`. Task tensors are stacked on dimension 0 and pruned independently.
 
     Args:
-    tensor (`torch.Tensor`):The tensor to prune.
+    tensor (`torch.Tensor`):The task tensors to prune.
     density (`float`):The fraction of values to preserve. Should be in [0,1].
     """
-    mask = torch.zeros_like(tensor).reshape(-1)
-    k = int(density * tensor.reshape(-1).shape[0])
-    top_k = torch.topk(tensor.abs().reshape(-1), k=k, largest=True)
-    mask[top_k[1]] = 1
-    return tensor * mask.reshape(tensor.shape)
+    flat = tensor.reshape(tensor.shape[0], -1)
+    k = int(density * flat.shape[1])
+    top_k = torch.topk(flat.abs(), k=k, dim=1, largest=True)
+    mask = torch.zeros_like(flat, dtype=torch.bool).scatter_(1, top_k.indices, True)
+    return (flat * mask).reshape(tensor.shape)
 
 
-def random_pruning(tensor: torch.Tensor, density: float, rescale: bool) -> torch.Tensor:
+def random_pruning(
+    tensor: torch.Tensor,
+    density: float,
+    rescale: bool,
+    generator: Optional[torch.Generator] = None,
+) -> torch.Tensor:
     """
-    Prune the smallest values of the task tensors and retain the top-k values based on the specified fraction
-    `density`.
+    Prune random values of the task tensors, each value is kept with probability `density`.
 
     Args:
     tensor (`torch.Tensor`):The tensor to prune.
     density (`float`):The fraction of values to preserve. Should be in [0,1].
     rescale (`bool`):Whether to rescale the result to preserve the expected value of the original tensor.
+    generator (`torch.Generator`, *optional*):The generator used to sample the mask, on the device of `tensor`.
     """
-    mask = torch.bernoulli(torch.full_like(input=tensor, fill_value=density))
+    mask = torch.bernoulli(
+        torch.full_like(input=tensor, fill_value=density), generator=generator
+    )
     pruned_tensor = tensor * mask
-    if rescale:
-        torch.div(input=pruned_tensor, other=density)
+    if rescale and density > 0:
+        pruned_tensor = pruned_tensor / density
     return pruned_tensor
 
 
@@ -58,24 +74,26 @@ def prune(
     density: float,
     method: Literal["magnitude", "random"],
     rescale: bool = False,
+    generator: Optional[torch.Generator] = None,
 ) -> torch.Tensor:
     """
-    Prune the values of task tensors based on the `method`.
+    Prune the values of task tensors based on the `method`. Task tensors are stacked on dimension 0.
 
     Args:
-    tensor (`torch.Tensor`):The tensor to prune.
+    tensor (`torch.Tensor`):The task tensors to prune.
     density (`float`):The fraction of values to preserve. Should be in [0,1].
     method (`str`):The method to use to prune. Should be one of ["magnitude", "random"].
     rescale (`bool`):Whether to rescale the result to preserve the expected value of the original tensor.
+    generator (`torch.Generator`, *optional*):The generator of the random pruning.
     """
     if density >= 1:
         return tensor
     elif density < 0:
-        raise ValueError("Density should be >= 0, got {density}")
+        raise ValueError(f"Density should be >= 0, got {density}")
     if method == "magnitude":
         return magnitude_based_pruning(tensor, density)
     elif method == "random":
-        return random_pruning(tensor, density, rescale=rescale)
+        return random_pruning(tensor, density, rescale=rescale, generator=generator)
     else:
         raise ValueError(f"Unknown method {method}")
 
@@ -91,15 +109,14 @@ def calculate_majority_sign_mask(
     method (`str`):The method to use to get the mask. Should be one of ["total", "frequency"].
     """
 
-    sign = tensor.sign()
     if method == "total":
-        sign_magnitude = (sign * tensor.abs()).sum(dim=0)
+        sign_magnitude = tensor.sum(dim=0)
     elif method == "frequency":
-        sign_magnitude = sign.sum(dim=0)
+        sign_magnitude = (tensor > 0).sum(dim=0) - (tensor < 0).sum(dim=0)
     else:
         raise RuntimeError(f'Unimplemented mask method "{method}"')
-    majority_sign = torch.where(sign_magnitude >= 0, 1, -1)
-    return sign == majority_sign
+    # Zeros never have the majority sign
+    return torch.where(sign_magnitude >= 0, tensor > 0, tensor < 0)
 
 
 def disjoint_merge(task_tensors, majority_sign_mask):
@@ -2,32 +2,65 @@
 # Path:     lorax/server/lorax_server/utils/segments.py
 # License:  Apache License Version 2.0, January 2004
 
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import torch
-import numpy as np
 
 
 def find_segments(
     adapter_indices: Union[torch.Tensor, List[int]],
 ) -> Tuple[List[int], List[int]]:
     if isinstance(adapter_indices, torch.Tensor):
-        adapter_indices = adapter_indices.cpu().numpy()
-    elif isinstance(adapter_indices, list):
-        adapter_indices = np.array(adapter_indices)
-
-    change_mask = np.diff(adapter_indices, prepend=adapter_indices[0] - 1)
-    change_indices = np.nonzero(change_mask)[0]
+        # Find the segment starts on the device of the indices and only copy them
+        # and their adapters to the host
+        change_indices = (
+            torch.nonzero(adapter_indices[1:] != adapter_indices[:-1]).view(-1) + 1
+        )
+        starts = torch.cat([change_indices.new_zeros(1), change_indices])
+        host = torch.cat([starts, adapter_indices[starts].to(starts.dtype)]).tolist()
+        change_indices = host[: len(host) // 2]
+        segment_indices = host[len(host) // 2 :]
+    else:
+        change_indices = [
+            i
+            for i in range(len(adapter_indices))
+            if i == 0 or adapter_indices[i] != adapter_indices[i - 1]
+        ]
+        segment_indices = [adapter_indices[i] for i in change_indices]
 
     segments = [0]
-    segments.extend(change_indices[1:].tolist())
+    segments.extend(change_indices[1:])
     segments.append(len(adapter_indices))
 
-    segment_indices = adapter_indices[change_indices].tolist()
-
     return segments, segment_indices
 
 
+def segment_bounds(adapter_indices: torch.Tensor, num_segments: int) -> torch.Tensor:
+    """Segments of `adapter_indices`, as `find_segments`, without a device sync.
+
+    `num_segments` is the number of segments of `adapter_indices`, known on the
+    host, for instance when only the length of the segments changed.
+    """
+    change = torch.ones_like(adapter_indices, dtype=torch.int32)
+    change[1:] = adapter_indices[1:] != adapter_indices[:-1]
+    segment_ids = change.cumsum(0) - 1
+    lengths = change.new_zeros(num_segments + 1)
+    lengths.index_add_(0, segment_ids + 1, torch.ones_like(change))
+    return lengths.cumsum(0, dtype=torch.int32)
+
+
+def group_by_adapter(adapter_indices: List[int]) -> Optional[List[int]]:
+    """Order of the rows that makes the rows of each adapter contiguous.
+
+    The rows of an adapter keep their relative order. Returns None if the rows of
+    each adapter already are contiguous.
+    """
+    _, segment_indices = find_segments(adapter_indices)
+    if len(set(segment_indices)) == len(segment_indices):
+        return None
+    return sorted(range(len(adapter_indices)), key=adapter_indices.__getitem__)
+
+
 class SegmentConcatBuilder:
     def __init__(self):
         self.adapter_segment_indices = []